@@ -2,37 +2,69 @@ from core.book_exporter import BookExpoter
 from core.setting import *
 from core.logger import Loggable
 from core.book import *
+from core.utils import LazyModule
 
-from ebooklib import epub
+# ebooklib的导入较慢，在第一次导出时才导入
+epub = LazyModule("ebooklib.epub")
+import os
+import zipfile
 
 
 class EpubExporter(BookExpoter):
+    """
+        导出为Epub
+
+        增量导出时，上次导出的文件中未变化的章节XHTML会被直接复用，只有新章节需要读取内容并生成
+    """
+    supports_previous = True
+
     def __init__(self, setting_manager: SettingManager) -> None:
         super().__init__(setting_manager)
 
-    async def export_book(self, book: Book, output: str):
-        output = BookExpoter.fix_path(output, book.title, ".epub")
+    @staticmethod
+    def render_chapter(chapter: Chapter) -> str:
+        content: str = f"<h1>{chapter.title}</h1>\n"
+
+        paras = [i.strip() for i in (chapter.content or "").split('\n')]
+
+        for para in paras:
+            content += f"<p>{para}</p>\n"
+        return content
+
+    async def export_book(self, book: Book, output: str, previous=None) -> str:
+        if previous is not None:
+            output = previous.path
+        else:
+            output = BookExpoter.fix_path(output, book.title, ".epub")
 
         out_book = epub.EpubBook()
         out_book.add_author(book.author)
-        out_book.set_cover("cover"+book.cover_format, book.cover)
+        if book.cover is not None:
+            out_book.set_cover("cover"+book.cover_format, book.cover)
         out_book.set_title(book.title)
 
-        html_items: list[epub.EpubHtml] = []
-        for chapter in book.chapters:
-            item = epub.EpubHtml(
-                file_name=f'Chapter{chapter.chapter_index}.html', title=chapter.title)
-
-            content: str = f"<h1>{chapter.title}</h1>\n"
-
-            paras = [i.strip() for i in chapter.content.split('\n')]
+        old_file = None
+        if previous is not None:
+            old_file = zipfile.ZipFile(previous.path)
+        reused = 0
 
-            for para in paras:
-                content += f"<p>{para}</p>\n"
+        try:
+            html_items: list[epub.EpubHtml] = []
+            for chapter in book.chapters:
+                file_name = f'Chapter{chapter.chapter_index}.html'
+                item = epub.EpubHtml(file_name=file_name, title=chapter.title)
 
-            item.set_content(content)
-            out_book.add_item(item)
-            html_items.append(item)
+                if old_file is not None and chapter.chapter_index <= previous.last_chapter:
+                    # 复用已生成的XHTML，不读取章节内容
+                    item.set_content(old_file.read("EPUB/"+file_name))
+                    reused += 1
+                else:
+                    item.set_content(EpubExporter.render_chapter(chapter))
+                out_book.add_item(item)
+                html_items.append(item)
+        finally:
+            if old_file is not None:
+                old_file.close()
 
         out_book.spine = html_items
         toc = []
@@ -44,5 +76,10 @@ class EpubExporter(BookExpoter):
         out_book.add_item(epub.EpubNav())
         out_book.add_item(epub.EpubNcx())
 
-        epub.write_epub(output, out_book)
-        self.log_info(f"Successfully export book '{book.title}' to '{output}'")
+        # 先写入临时文件，完成后再替换，上次导出的文件在此之前仍然可用
+        temp_output = output + ".part"
+        epub.write_epub(temp_output, out_book)
+        os.replace(temp_output, output)
+        self.log_info(
+            f"Successfully export book '{book.title}' to '{output}', reused {reused} chapters.")
+        return output
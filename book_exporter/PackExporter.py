@@ -0,0 +1,95 @@
+from core.book_exporter import BookExpoter
+from core.setting import SettingManager
+from core.book import Book
+from core.packed_book import FLAG_ZLIB, HEADER, INDEX_ENTRY, PACK_MAGIC, PACK_VERSION, encode_chapter
+from core.utils import date_to_days
+import aiofiles
+import json
+import os
+
+
+class PackExporter(BookExpoter):
+    """
+        导出为可随机访问的 .bpk 文件，使用 `core.packed_book.PackedBook` 读取
+
+        设置 `compression` 可以是 none/zlib，压缩时每个章节单独压缩，读取单个章节不需要解压其他章节
+    """
+    compression: str
+    compress_level: int
+
+    def __init__(self, setting_manager: SettingManager) -> None:
+        super().__init__(setting_manager)
+        self.compression = self.get_setting("compression", "zlib")
+        self.compress_level = self.get_setting("compress_level", 6)
+
+    def update_setting(self, key: str, value) -> None:
+        if key == "compression":
+            self.compression = value
+        if key == "compress_level":
+            self.compress_level = value
+
+    def get_export_options(self) -> tuple:
+        return (self.compression, self.compress_level)
+
+    async def export_book(self, book: Book, output: str, previous=None) -> str:
+        output = BookExpoter.fix_path(output, book.title, ".bpk")
+        if self.compression not in ("none", "zlib"):
+            raise ValueError(
+                f"Compression '{self.compression}' is not supported")
+        flags = FLAG_ZLIB if self.compression == "zlib" else 0
+
+        # 先写入临时文件，完成后再替换，正在读取旧文件的进程不受影响
+        temp_output = output + ".part"
+        index = []
+        async with aiofiles.open(temp_output, "wb") as f:
+            await f.write(bytes(HEADER.size))
+            offset = HEADER.size
+
+            last_chapter = -1
+            for chapter in book.chapters:
+                if chapter.chapter_index <= last_chapter:
+                    raise ValueError("Chapters must be sorted by chapter_index")
+                last_chapter = chapter.chapter_index
+
+                data, raw_length = encode_chapter(
+                    chapter, flags, self.compress_level)
+                await f.write(data)
+                index.append(INDEX_ENTRY.pack(
+                    chapter.chapter_index, offset, len(data), raw_length))
+                offset += len(data)
+
+            cover = None
+            if book.cover is not None:
+                await f.write(book.cover)
+                cover = (offset, len(book.cover))
+                offset += len(book.cover)
+
+            meta = json.dumps({
+                "idx": book.idx,
+                "title": book.title,
+                "author": book.author,
+                "source": book.source,
+                "spider": book.spider,
+                "desc": book.desc,
+                "style": book.style,
+                "chapter_count": book.chapter_count,
+                "cover_format": book.cover_format,
+                "cover": cover,
+                "status": book.status,
+                "update": date_to_days(book.update),
+                "publish": date_to_days(book.publish)
+            }, ensure_ascii=False).encode("utf-8")
+            meta_offset = offset
+            await f.write(meta)
+            offset += len(meta)
+
+            await f.write(b"".join(index))
+
+            await f.seek(0)
+            await f.write(HEADER.pack(PACK_MAGIC, PACK_VERSION, flags,
+                                      len(index), offset, meta_offset, len(meta)))
+
+        os.replace(temp_output, output)
+        self.log_info(
+            f"Successfully export book '{book.title}' to '{output}'")
+        return output
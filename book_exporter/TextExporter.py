@@ -2,29 +2,145 @@ from core.book_exporter import BookExpoter
 from core.setting import SettingManager
 from core.book import Book
 import aiofiles
+import zlib
+
+
+class UnsupportedCompressionError(Exception):
+    compression: str
+
+    def __init__(self, compression: str, *args: object) -> None:
+        self.compression = compression
+        super().__init__(compression, *args)
+
+    def __str__(self) -> str:
+        return f"Compression '{self.compression}' is not supported"
+
+
+class TextStreamWriter:
+    """
+        分块写入文本，可选gzip/zstd压缩。
+        文本先缓存在内存中，达到 `chunk_size` 后编码、压缩并写入文件
+    """
+    file: object
+    chunk_size: int
+    buffer: list[str]
+    buffer_size: int
+    compressor: object
+
+    def __init__(self, file, compression="none", chunk_size=65536) -> None:
+        self.file = file
+        self.chunk_size = chunk_size
+        self.buffer = []
+        self.buffer_size = 0
+
+        if compression == "none":
+            self.compressor = None
+        elif compression == "gzip":
+            self.compressor = zlib.compressobj(wbits=31)
+        elif compression == "zstd":
+            try:
+                import zstandard
+            except ImportError:
+                raise UnsupportedCompressionError(compression)
+            self.compressor = zstandard.ZstdCompressor().compressobj()
+        else:
+            raise UnsupportedCompressionError(compression)
+
+    async def write(self, text: str) -> None:
+        self.buffer.append(text)
+        self.buffer_size += len(text)
+        if self.buffer_size >= self.chunk_size:
+            await self.flush()
+
+    async def flush(self) -> None:
+        data = "".join(self.buffer).encode("utf-8")
+        self.buffer = []
+        self.buffer_size = 0
+        if self.compressor:
+            data = self.compressor.compress(data)
+        if data:
+            await self.file.write(data)
+
+    async def close(self) -> None:
+        await self.flush()
+        if self.compressor:
+            await self.file.write(self.compressor.flush())
 
 
 class TextExporter(BookExpoter):
     """
         导出为纯文本
+
+        章节逐个从 `book.chapters` 中读取并分块写入，`book.chapters` 可以是数据库游标，
+        导出时内存占用与书籍大小无关。
+        设置 `compression` 可以是 none/gzip/zstd
     """
+    supports_previous = True
+    compression: str
+    chunk_size: int
+
+    EXTENSIONS = {
+        "none": ".txt",
+        "gzip": ".txt.gz",
+        "zstd": ".txt.zst"
+    }
 
     def __init__(self, setting_manager: SettingManager) -> None:
         super().__init__(setting_manager)
+        self.compression = self.get_setting("compression", "none")
+        self.chunk_size = self.get_setting("chunk_size", 65536)
+
+    def update_setting(self, key: str, value) -> None:
+        if key == "compression":
+            self.compression = value
+        if key == "chunk_size":
+            self.chunk_size = value
+
+    def get_export_options(self) -> tuple:
+        return (self.compression,)
 
-    async def export_book(self, book: Book, output: str):
-        output = TextExporter.fix_path(output, book.title, ".txt")
-        async with aiofiles.open(output, "w", encoding="utf-8") as f:
-            texts = []
-            texts.append(book.title+"\n\n")
-            texts.append(book.desc + "\n\n")
+    async def export_book(self, book: Book, output: str, previous=None) -> str:
+        if self.compression not in TextExporter.EXTENSIONS:
+            raise UnsupportedCompressionError(self.compression)
+
+        ext = TextExporter.EXTENSIONS[self.compression]
+        if previous is not None and previous.path.endswith(ext):
+            return await self.append_chapters(book, previous)
+
+        output = TextExporter.fix_path(output, book.title, ext)
+        async with aiofiles.open(output, "wb") as f:
+            writer = TextStreamWriter(f, self.compression, self.chunk_size)
+            await writer.write(book.title+"\n\n")
+            await writer.write(book.desc + "\n\n")
 
             for chapter in book.chapters:
-                texts.append(chapter.title+"\n")
-                texts.append(chapter.content+"\n")
+                await writer.write(chapter.title+"\n")
+                await writer.write((chapter.content or "")+"\n")
 
-            await f.write(str.join('',texts))
+            await writer.close()
 
-        async with aiofiles.open(output+book.cover_format, "wb") as f:
-            await f.write(book.cover)
+        if book.cover is not None:
+            async with aiofiles.open(output+book.cover_format, "wb") as f:
+                await f.write(book.cover)
         self.log_info(f"Successfully export book '{book.title}' to {output}")
+        return output
+
+    async def append_chapters(self, book: Book, previous) -> str:
+        """
+            把上次导出之后的新章节追加到文件末尾。
+            gzip与zstd的压缩流可以直接拼接，追加的部分作为新的压缩流写入
+        """
+        count = 0
+        async with aiofiles.open(previous.path, "ab") as f:
+            writer = TextStreamWriter(f, self.compression, self.chunk_size)
+            for chapter in book.chapters:
+                if chapter.chapter_index <= previous.last_chapter:
+                    continue
+                await writer.write(chapter.title+"\n")
+                await writer.write((chapter.content or "")+"\n")
+                count += 1
+            await writer.close()
+
+        self.log_info(
+            f"Successfully append {count} chapters of book '{book.title}' to {previous.path}")
+        return previous.path
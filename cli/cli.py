@@ -1,14 +1,17 @@
 from asyncio.log import logger
 from inspect import isfunction
 from sys import version as python_version
+from time import perf_counter
 import subprocess
 import logging
 import shlex
 
+from prettytable import PrettyTable
 
 from .version import VERSION
-from core.logger import Logger
+from core.logger import Logger, flush_logs
 from core.manager import Manager
+from core.profiler import profiler
 from . import commands
 
 logger = Logger("Console")
@@ -36,11 +39,72 @@ def help(name: str = None):
             func = vaild_func[name]
         else:
             print(f"Command '{name}' is not found.")
-            return
+            return False
 
         print(f"Usage : {get_declaration(func)} \n")
         for arg in func.__arg_commit__:
             print(f"{arg[0]} : {arg[1]}")
+    return True
+
+
+@commands.command("Run a command and show the time spent in each stage", "Options(cprofile=<path>, tracemalloc=<N>)", "The command and its params")
+def profile(*params):
+    options = {}
+    params = list(params)
+    while len(params) > 0 and "=" in params[0]:
+        k, v = params.pop(0).split("=", 1)
+        options[k] = v
+
+    if len(params) == 0 or params[0] not in vaild_func:
+        print("Usage : profile [cprofile=<path>] [tracemalloc=<N>] <command> [params]")
+        return False
+    func = vaild_func[params[0]]
+
+    cprofile_path = options.get("cprofile")
+    tracemalloc_top = int(options.get("tracemalloc", 0))
+    cprofile = None
+    if cprofile_path:
+        import cProfile
+        cprofile = cProfile.Profile()
+    if tracemalloc_top > 0:
+        import tracemalloc
+        tracemalloc.start()
+
+    profiler.reset()
+    profiler.enabled = True
+    start = perf_counter()
+    try:
+        if cprofile is not None:
+            cprofile.enable()
+        succeeded = run_function_protected(func, *params[1:])
+    finally:
+        if cprofile is not None:
+            cprofile.disable()
+        wall = perf_counter() - start
+        profiler.enabled = False
+
+    table = PrettyTable(
+        ["Stage", "Calls", "Total(s)", "Avg(ms)", "Max(ms)", "% of wall"])
+    for name, calls, total, longest in profiler.report():
+        table.add_row([name, calls, f"{total:.3f}", f"{total / calls * 1000:.2f}",
+                       f"{longest * 1000:.2f}", f"{total / max(wall, 1e-9) * 100:.1f}"])
+    print(table)
+    print(f"Wall time {wall:.3f}s. Concurrent stages overlap, so the totals may exceed the wall time.")
+
+    if cprofile is not None:
+        import pstats
+        cprofile.dump_stats(cprofile_path)
+        pstats.Stats(cprofile).sort_stats("cumulative").print_stats(20)
+        print(f"cProfile stats saved to '{cprofile_path}'")
+
+    if tracemalloc_top > 0:
+        snapshot = tracemalloc.take_snapshot()
+        tracemalloc.stop()
+        print(f"Top {tracemalloc_top} allocations:")
+        for i in snapshot.statistics("lineno")[:tracemalloc_top]:
+            print(i)
+
+    return succeeded
 
 
 def init(manager: Manager):
@@ -48,6 +112,7 @@ def init(manager: Manager):
         if isfunction(v) and ("__is_command__" in v.__dict__.keys() and v.__is_command__ == True):
             vaild_func[k] = v
     vaild_func["help"] = help
+    vaild_func["profile"] = profile
     commands.mgr = manager
 
 
@@ -57,21 +122,81 @@ def shell(*params):
     for i in params:
         cmd += i+" "
 
-    subprocess.call(["cmd.exe", "/c", cmd])
+    return subprocess.call(["cmd.exe", "/c", cmd]) == 0
 
 
 def print_exception(e: Exception):
     logging.exception(e)
 
 
-def run_function_protected(func, *args, **kwargs):
+def run_function_protected(func, *args, **kwargs) -> bool:
+    """
+        执行命令，只有命令返回 `True` 时才视为成功，抛出异常或返回其他值时返回 `False`
+    """
     try:
-        func(*args, **kwargs)
+        return func(*args, **kwargs) is True
     except KeyboardInterrupt:
-        return
+        return False
     except Exception as e:
         logger.log_error(f"{e.__class__.__name__} :")
         print_exception(e)
+        return False
+    finally:
+        # 命令结束前输出所有日志，避免与提示符交错
+        flush_logs()
+
+
+def run_command(command: list[str]) -> bool:
+    if command[0].startswith("@"):
+        command[0] = command[0][1:]
+        return run_function_protected(shell, *command)
+
+    if command[0] not in vaild_func:
+        logger.log_error(f"Command '{command[0]}' not found")
+        return False
+
+    func = vaild_func[command[0]]
+    return run_function_protected(func, *command[1:])
+
+
+def read_script(path: str) -> list[list[str]]:
+    """
+        读取脚本文件，每行一个命令，忽略空行与 `#` 开头的注释
+    """
+    res = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            command = shlex.split(line, comments=True)
+            if len(command) > 0:
+                res.append(command)
+    return res
+
+
+def batch_main(manager: Manager, commands_list: list[list[str]], stop_on_error=False) -> int:
+    """
+        非交互模式，依次执行命令，全部成功时返回0，否则返回1
+    """
+    init(manager)
+    commands.interactive = False
+
+    count = 0
+    failed = 0
+    try:
+        for command in commands_list:
+            logger.log_info(f"Run '{shlex.join(command)}'")
+            count += 1
+            if not run_command(command):
+                failed += 1
+                if stop_on_error:
+                    break
+    except SystemExit:
+        pass
+    finally:
+        manager.close()
+        flush_logs()
+
+    print(f"{count} commands run, {failed} failed.")
+    return 0 if failed == 0 else 1
 
 
 def cli_main(manager: Manager):
@@ -87,17 +212,7 @@ def cli_main(manager: Manager):
             if len(command) == 0:
                 continue
 
-            if command[0].startswith("@"):
-                command[0] = command[0][1:]
-                run_function_protected(shell, *command)
-                continue
-
-            if command[0] not in vaild_func:
-                logger.log_error("Command not found")
-                continue
-
-            func = vaild_func[command[0]]
-            run_function_protected(func, *command[1:])
+            run_command(command)
 
         except KeyboardInterrupt:
             print("")
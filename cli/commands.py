@@ -1,9 +1,16 @@
-from core.manager import Manager
-from core.logger import Logger
+import os
+import subprocess
+import sys
+from time import time
+
+from core.manager import DEFAULT_DB_FILE, Manager
+from core.daemon import CrawlDaemon
+from core.reader_server import ReaderServer
+from core.logger import Logger, flush_logs
 from prettytable import PrettyTable
 
-from core.spider import Spider
-from core.extension_manager import ExtensionManager
+from core.utils import db_to_date
+from core import metrics
 
 """
     Cli的命令模块
@@ -11,6 +18,7 @@ from core.extension_manager import ExtensionManager
 
 mgr: Manager = None
 logger = Logger("Console")
+interactive = True  # 非交互模式下不会等待用户输入
 
 
 def command(commit, *args, **kargs):
@@ -35,9 +43,10 @@ def command(commit, *args, **kargs):
 def call_func_by_op(func_table: dict[str], op: str, *params):
     if op in func_table.keys():
         func = func_table[op]
-        func(*params)
+        return func(*params)
     else:
         print("Unknown Operation.")
+        return False
 
 
 def args_to_kwargs(*params) -> dict[str, str]:
@@ -56,6 +65,9 @@ def args_to_kwargs(*params) -> dict[str, str]:
 def select(name, items: list[str]):
     if not isinstance(items, list):
         items = list(items)
+    if not interactive or len(items) == 1:
+        logger.log_info(f"Use {name} '{items[0]}'.")
+        return items[0]
     print(f'Select a {name}:')
     for idx, i in enumerate(items):
         print(f"    {idx}.{i}")
@@ -78,32 +90,38 @@ def setting(op, *params):
             value = bool(value)
 
         setmgr.set(field, name, value)
+        return True
 
     def get_setting(field, key):
-        if setmgr.has_key(field, key):
-            v = setmgr.get(field, key)
-            print_value(key, v)
-        else:
+        if not setmgr.has_key(field, key):
             logger.log_error(f"Key '{key}' of field '{field}' not found!")
+            return False
+        v = setmgr.get(field, key)
+        print_value(key, v)
+        return True
 
     def remove_setting(field, key):
-        if setmgr.has_key(field, key):
-            setmgr.remove_key(field, key)
-        else:
+        if not setmgr.has_key(field, key):
             logger.log_error(f"Key '{key}' of field '{field}' not found!")
+            return False
+        setmgr.remove_key(field, key)
+        return True
 
     def list_setting(field):
         setmgr.check_field_exist(field)
         for k, v in setmgr.get_field(field).items():
             print_value(k, v)
+        return True
 
     def list_fields():
         for field in setmgr.get_field_names():
             print(field)
+        return True
 
     def help():
         print(
             "Usage : setting set/get/remove/list/fields [field] [key] [value]\n")
+        return True
 
     func_table = {
         "set": set_setting,
@@ -114,23 +132,27 @@ def setting(op, *params):
         "help": help
     }
 
-    call_func_by_op(func_table, op, *params)
+    return call_func_by_op(func_table, op, *params)
 
 
 @command("Manager spiders", "Operation", "The params of the operatrion.")
 def spider(op: str, *params):
     def add_spider(name: str):
         mgr.spiders_manager.add_extension(name)
+        return True
 
     def remove_spider(name: str):
         mgr.spiders_manager.remove_extension(name)
+        return True
 
     def list_spiders():
         for name in mgr.spiders_manager.get_extension_list():
             print(name)
+        return True
 
     def help():
         print("Usage : spider add/remove/list [name]")
+        return True
 
     func_table = {
         "add": add_spider,
@@ -138,69 +160,121 @@ def spider(op: str, *params):
         "list": list_spiders,
         "help": help
     }
-    call_func_by_op(func_table, op, *params)
+    return call_func_by_op(func_table, op, *params)
 
 
 @command("Managers Books", "Operation", "The params of the operatrion.")
 def book(op: str, *params):
     def search(*params):
         args, kwargs = args_to_kwargs(*params)
-
-        table = PrettyTable(
-            ["Id", "Title", "Author", "Chapter Count", "Style", "Status", "Publish Date", "Update Date"])
+        columns = kwargs.pop(
+            "columns", "Id,Title,Author,ChapterCount,Style,Status,PublishDate,UpdateDate").split(",")
+        order = kwargs.pop("order", "Id")
+        size = int(kwargs.pop("size", 20))
+        descending = kwargs.pop("desc", "0") == "1"
+
+        def format_row(row):
+            row = list(row)
+            if "Status" in columns:
+                idx = columns.index("Status")
+                row[idx] = "End" if row[idx] else "Not End"
+            for column in ("PublishDate", "UpdateDate"):
+                if column in columns:
+                    idx = columns.index(column)
+                    row[idx] = db_to_date(row[idx]).strftime("%Y-%m-%d")
+            return row
+
+        after = None
         cnt = 0
-
-        for book in mgr.query_book(-1, -1, *args, **kwargs):
-            table.add_row([book.idx, book.title, book.author, book.chapter_count, book.style,
-                          "End" if book.status else "Not End", book.publish, book.update])
-            cnt += 1
-
-        print(f"{cnt} result in tot.\n")
-        print(table)
+        while True:
+            rows, after = mgr.list_books(
+                columns, order, after, size, descending, *args, **kwargs)
+            cnt += len(rows)
+
+            table = PrettyTable(columns)
+            for row in rows:
+                table.add_row(format_row(row))
+            print(table)
+
+            if after is None:
+                print(f"{cnt} result in tot.\n")
+                break
+            # 非交互模式下输出所有页
+            if interactive and input("Press Enter to show the next page or 'q' to quit:") == "q":
+                break
+        return True
 
     def check(index="", *params):
+        _, kwargs = args_to_kwargs(*params)
         if index == "":
-            mgr.check_all_book()
-        else:
-            index = int(index)
-            mgr.check_book(index, *params)
+            return mgr.check_all_book(**kwargs)
+        return mgr.check_book(int(index), **kwargs)
 
     def export(index, outpath="."):
-        exporter = select(
-            "Book exporter", mgr.book_exporters_manager.get_extension_list())
-        exporter = mgr.book_exporters_manager.extensions[exporter]
+        exporters = mgr.book_exporters_manager.get_extension_list()
+        if len(exporters) == 0:
+            logger.log_error("No book exporter added.")
+            return False
+        exporter = mgr.book_exporters_manager.get_extension(
+            select("Book exporter", exporters))
 
         index = int(index)
         mgr.export_book_by_id(index, exporter, outpath)
+        return True
 
-    def remove(index):
+    def export_all(outpath=".", *params):
+        args, kwargs = args_to_kwargs(*params)
+        workers = int(kwargs.pop("workers", 0))
+        exporter = kwargs.pop("exporter", "")
+        if exporter == "":
+            exporter = select(
+                "Book exporter", mgr.book_exporters_manager.get_extension_list())
+        exporter = mgr.book_exporters_manager.get_extension(exporter)
+
+        succeeded, failed = mgr.export_library(
+            exporter, outpath, workers, *args, **kwargs)
+        print(f"{succeeded} books exported, {failed} failed.")
+        return failed == 0
+
+    def remove(index, *params):
         index = int(index)
 
-        confirm = input("Confirm to remove book (Yes/No):")
-        if confirm == "Yes":
-            mgr.delete_book(index)
+        if "--yes" not in params:
+            # 非交互模式下必须显式确认
+            if not interactive:
+                logger.log_error(
+                    "Removing a book needs '--yes' in non-interactive mode.")
+                return False
+            if input("Confirm to remove book (Yes/No):") != "Yes":
+                return False
+        mgr.delete_book(index)
+        return True
 
     func_table = {
         "search": search,
         "check": check,
         "export": export,
+        "export_all": export_all,
         "remove": remove
     }
 
-    call_func_by_op(func_table, op, *params)
+    return call_func_by_op(func_table, op, *params)
 
 
 @command("Manage book exporter", "Operation", "Params")
 def exporter(op: str, *params):
     def add(name):
         mgr.book_exporters_manager.add_extension(name)
+        return True
 
     def remove(name):
         mgr.book_exporters_manager.remove_extension(name)
+        return True
 
     def _list():
         for i in mgr.book_exporters_manager.get_extension_list():
             print(i)
+        return True
 
     func_table = {
         "add": add,
@@ -208,19 +282,44 @@ def exporter(op: str, *params):
         "list": _list
     }
 
-    call_func_by_op(func_table, op, *params)
+    return call_func_by_op(func_table, op, *params)
 
 
-@command("Get book from url", "Thr url", "The params that pass to the spider.")
+def read_url_list(path: str):
+    """
+        逐行读取Url列表，忽略空行与 `#` 开头的注释
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line and not line.startswith("#"):
+                yield line
+
+
+@command("Get book from url(or '--from-file <path>' to get all urls in the file)", "Thr url", "The params that pass to the spider.")
 def get(url, *params):
+    if url == "--from-file":
+        if len(params) == 0:
+            print("Usage : get --from-file <path> [params]")
+            return False
+        path = params[0]
+        _, kwargs = args_to_kwargs(*params[1:])
+        start = time()
+        succeeded, failed = mgr.get_books(read_url_list(path), **kwargs)
+        flush_logs()
+        print(f"{succeeded} books succeeded, {len(failed)} failed in {time() - start:.1f}s.")
+        for i in failed:
+            print(f"    failed: {i}")
+        return len(failed) == 0
+
     _, kwargs = args_to_kwargs(*params)
     vaild_spiders = mgr.get_vaild_spiders(url, **kwargs)
     if len(vaild_spiders) == 0:
         logger.log_error("No spider match the url!")
-        return
+        return False
 
-    spider = mgr.spiders_manager.extensions[select("spider", vaild_spiders)]
-    mgr.get_book(url, spider, **kwargs)
+    spider = mgr.spiders_manager.get_extension(select("spider", vaild_spiders))
+    return mgr.get_book(url, spider, **kwargs) is not None
 
 
 @command("Get all books in the specificed site.", "The params that pass to the spider")
@@ -228,10 +327,79 @@ def site(*params):
     spiders = mgr.spiders_manager.get_extension_list()
     if len(spiders) == 0:
         logger.log_error("No spider added.")
-        return
+        return False
 
-    spider = mgr.spiders_manager.extensions[select("spider", spiders)]
+    spider = mgr.spiders_manager.get_extension(select("spider", spiders))
     mgr.get_all_book(spider, **(args_to_kwargs(*params)[1]))
+    return True
+
+
+@command("Run as a daemon with a local control API", "Options(host=..., port=N, socket=<path>)")
+def daemon(*params):
+    _, kwargs = args_to_kwargs(*params)
+    CrawlDaemon(mgr, kwargs.get("host"), kwargs.get("port"),
+                kwargs.get("socket")).run()
+    return True
+
+
+@command("Serve books to readers over HTTP(read only)", "Options(host=..., port=N)")
+def serve(*params):
+    _, kwargs = args_to_kwargs(*params)
+    server = ReaderServer(mgr.setting_manager, mgr.get_setting("database", DEFAULT_DB_FILE),
+                          kwargs.get("host"), kwargs.get("port"))
+    print("Press Ctrl+C to stop.")
+    server.serve_forever()
+    return True
+
+
+@command("Dump books to an archive file(.jsonl or .jsonl.gz)", "The path of the archive", "The conditions of books")
+def dump(path, *params):
+    args, kwargs = args_to_kwargs(*params)
+    cnt = mgr.dump_library(path, *args, **kwargs)
+    print(f"{cnt} books dumped.")
+    return True
+
+
+@command("Load books from an archive file", "The path of the archive")
+def load(path):
+    cnt = mgr.load_library(path)
+    print(f"{cnt} books loaded.")
+    return True
+
+
+@command("Manage chapter shards", "Operation", "The params of the operatrion.")
+def shard(op: str, *params):
+    def _list():
+        table = PrettyTable(["Database", "File", "Chapter Count"])
+        table.add_rows(mgr.db.shard_stats())
+        print(table)
+        return True
+
+    def migrate():
+        cnt = mgr.db.migrate_chapters_to_shards()
+        print(f"{cnt} chapters moved.")
+        return True
+
+    def vacuum(name="main"):
+        mgr.db.vacuum(name)
+        return True
+
+    def backup(name, path):
+        mgr.db.backup(name, path)
+        return True
+
+    def help():
+        print("Usage : shard list/migrate/vacuum/backup [name] [path]")
+        return True
+
+    func_table = {
+        "list": _list,
+        "migrate": migrate,
+        "vacuum": vacuum,
+        "backup": backup,
+        "help": help
+    }
+    return call_func_by_op(func_table, op, *params)
 
 
 @command("Run sql", "The sql")
@@ -243,16 +411,116 @@ def runsql(*params):
     table = PrettyTable()
     table.add_rows(res)
     print(table)
+    return True
+
+
+@command("Show the query plan of a sql", "The sql")
+def explain(*params):
+    sql = ""
+    for i in params:
+        sql += i+" "
+    table = PrettyTable(["Id", "Parent", "Detail"])
+    for row in mgr.db.explain(sql):
+        table.add_row([row[0], row[1], row[3]])
+    print(table)
+    return True
+
+
+@command("Show crawl metrics", "Operation(show/reset/write/serve)", "The params of the operatrion.")
+def stats(op: str = "show", *params):
+    def show():
+        elapsed = time() - metrics.registry.start_time
+        table = PrettyTable(["Metric", "Labels", "Value"])
+        for row in metrics.registry.summary():
+            table.add_row(row)
+        print(table)
+        print(f"Collected in {elapsed:.0f}s, {metrics.chapters.get() / max(elapsed, 1):.2f} chapters/s, "
+              f"{metrics.chapter_bytes.get() / max(elapsed, 1) / 1024:.1f} KB/s.")
+        return True
+
+    def reset():
+        metrics.registry.reset()
+        return True
+
+    def write(path):
+        metrics.registry.write_prometheus(path)
+        return True
+
+    def serve(port="9464"):
+        metrics.registry.start_http_server(int(port))
+        print(f"Serving metrics on http://127.0.0.1:{port}/metrics")
+        return True
+
+    def help():
+        print("Usage : stats show/reset/write/serve [path/port]")
+        return True
+
+    func_table = {
+        "show": show,
+        "reset": reset,
+        "write": write,
+        "serve": serve,
+        "help": help
+    }
+    return call_func_by_op(func_table, op, *params)
+
+
+# 测量启动耗时时在子进程中执行的代码，与 `main.py` 启动时导入相同的模块
+STARTUP_SCRIPT = """
+from time import perf_counter
+start = perf_counter()
+from core.manager import DEFAULT_DB_FILE, Manager
+import cli.cli
+mgr = Manager()
+mgr.close()
+print(perf_counter() - start)
+"""
+
+
+@command("Measure the startup time(python -X importtime)", "The number of the slowest modules to show")
+def importtime(top="15"):
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(
+        [root, env["PYTHONPATH"]]) if env.get("PYTHONPATH") else root
+
+    res = subprocess.run([sys.executable, "-X", "importtime", "-c", STARTUP_SCRIPT],
+                         capture_output=True, text=True, env=env)
+    if res.returncode != 0:
+        print(res.stderr)
+        return False
+
+    # 每行的格式为 `import time: self [us] | cumulative | imported package`
+    modules = []
+    for line in res.stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        modules.append((name.rstrip(), int(self_us), int(cumulative_us)))
+
+    modules.sort(key=lambda i: i[2], reverse=True)
+    table = PrettyTable(["Module", "Self(ms)", "Cumulative(ms)"])
+    for name, self_us, cumulative_us in modules[:int(top)]:
+        table.add_row([name, f"{self_us/1000:.1f}",
+                      f"{cumulative_us/1000:.1f}"])
+    print(table)
+
+    import_ms = sum(i[1] for i in modules) / 1000
+    startup_ms = float(res.stdout.strip().splitlines()[-1]) * 1000
+    print(f"{len(modules)} modules imported in {import_ms:.1f}ms, startup took {startup_ms:.1f}ms.")
+    return True
 
 
 @command("Commit to the database.")
 def commit():
     mgr.db.commit()
+    return True
 
 
 @command("Rollback database.")
 def rollback():
     mgr.db.rollback()
+    return True
 
 
 @command("Exit")
@@ -0,0 +1,215 @@
+"""
+    书库的导出(dump)与导入(load)
+
+    归档文件是按行分隔的JSON,以`.gz`结尾时使用gzip压缩。
+    第一行是文件头,之后每一行是一条记录:
+    ```
+        {"type": "cover", "hash": ..., "data": base64}
+        {"type": "book", "book": {列名: 值}}
+        {"type": "chapter", "id": ChapterId, "title": ..., "content": ...}
+    ```
+    章节紧跟在所属书籍之后,封面在第一次被引用之前写入。
+    导出与导入都是流式的,内存占用与书库大小无关。
+"""
+
+from base64 import b64decode, b64encode
+import gzip
+import json
+from typing import TextIO
+
+from .database import BOOK_COLUMNS, Database
+from .logger import Loggable
+from .utils import date_to_days, db_to_date
+
+ARCHIVE_FORMAT = "BookSpiderArchive"
+ARCHIVE_VERSION = 1
+
+
+class ArchiveFormatError(Exception):
+    path: str
+
+    def __init__(self, path: str, *args: object) -> None:
+        self.path = path
+        super().__init__(path, *args)
+
+    def __str__(self) -> str:
+        return f"'{self.path}' is not a BookSpider archive"
+
+
+def open_archive(path: str, mode: str) -> TextIO:
+    if path.endswith(".gz"):
+        return gzip.open(path, mode+"t", encoding="utf-8")
+    return open(path, mode, encoding="utf-8")
+
+
+class LibraryDumper(Loggable):
+    """
+        把书库导出到归档文件
+    """
+    db: Database
+    page_size: int
+
+    def __init__(self, db: Database, page_size: int = 100) -> None:
+        Loggable.__init__(self)
+        self.db = db
+        self.page_size = page_size
+
+    def dump(self, path: str, *params, **kparams) -> int:
+        """
+            导出满足条件的书籍，返回导出的书籍数
+        """
+        written_covers = set()
+        book_count = 0
+
+        with open_archive(path, "w") as f:
+            self.write(f, {"format": ARCHIVE_FORMAT,
+                       "version": ARCHIVE_VERSION})
+
+            after = None
+            while True:
+                rows, after = self.db.list_books(
+                    BOOK_COLUMNS, "Id", after, self.page_size, False, *params, **kparams)
+
+                for row in rows:
+                    book = dict(zip(BOOK_COLUMNS, row))
+                    cover_hash = book["CoverHash"]
+                    if cover_hash is not None and cover_hash not in written_covers:
+                        self.write(f, {"type": "cover", "hash": cover_hash,
+                                       "data": b64encode(self.db.load_cover(cover_hash)).decode()})
+                        written_covers.add(cover_hash)
+
+                    self.write(f, {"type": "book", "book": book})
+                    for chapter in self.db.iter_chapters(book["Id"]):
+                        self.write(f, {"type": "chapter", "id": chapter.chapter_index,
+                                       "title": chapter.title, "content": chapter.content})
+                    book_count += 1
+
+                self.log_info(f"Dumped {book_count} books.")
+                if after is None:
+                    break
+
+        return book_count
+
+    @staticmethod
+    def write(f: TextIO, record: dict) -> None:
+        f.write(json.dumps(record, ensure_ascii=False))
+        f.write("\n")
+
+
+class LibraryLoader(Loggable):
+    """
+        从归档文件导入书库
+
+        使用批量导入模式，章节按 `batch_size` 条一批插入，
+        在书籍之间提交，每次提交至少包含 `transaction_size` 条章节，导入失败时不会留下只导入了一部分的书籍。
+        来源已存在并且章节完整的书籍会被跳过，章节不完整的书籍会补全章节
+    """
+    db: Database
+    batch_size: int
+    transaction_size: int
+
+    def __init__(self, db: Database, batch_size: int = 1000, transaction_size: int = 100000) -> None:
+        Loggable.__init__(self)
+        self.db = db
+        self.batch_size = batch_size
+        self.transaction_size = transaction_size
+
+    def load(self, path: str) -> int:
+        """
+            导入归档文件，返回导入的书籍数
+        """
+        book_count = 0
+        skipped_count = 0
+        uncommitted = 0
+        book_index = None
+        chapters = []
+
+        def flush():
+            nonlocal chapters, uncommitted
+            if len(chapters) > 0:
+                # 归档中重复的章节以最后一条为准
+                self.db.executemany(
+                    f"""
+                    Insert into {self.db.chapters_table(chapters[0][0])} (BookId,ChapterId,Title,Content,ContentHash) Values (?1,?2,?3,?4,content_hash(?4))
+                        On Conflict(BookId,ChapterId) Do Update Set Title=excluded.Title,Content=excluded.Content,ContentHash=excluded.ContentHash;
+                    """,
+                    chapters
+                )
+            uncommitted += len(chapters)
+            chapters = []
+
+        def finish_book():
+            nonlocal uncommitted
+            flush()
+            # 只在书籍之间提交
+            if uncommitted >= self.transaction_size:
+                self.db.commit()
+                uncommitted = 0
+
+        with open_archive(path, "r") as f, self.db.bulk_load_mode:
+            header = json.loads(f.readline() or "{}")
+            if header.get("format") != ARCHIVE_FORMAT:
+                raise ArchiveFormatError(path)
+
+            for line in f:
+                record = json.loads(line)
+                type_ = record["type"]
+
+                if type_ == "chapter":
+                    if book_index is None:
+                        continue
+                    chapters.append(
+                        (book_index, record["id"], record["title"], record["content"]))
+                    if len(chapters) >= self.batch_size:
+                        flush()
+
+                elif type_ == "book":
+                    finish_book()
+                    book_index = self.insert_book(record["book"])
+                    if book_index is None:
+                        skipped_count += 1
+                    else:
+                        book_count += 1
+                        if book_count % 1000 == 0:
+                            self.log_info(f"Loaded {book_count} books.")
+
+                elif type_ == "cover":
+                    self.db.execute(
+                        "Insert or Ignore into Covers (Hash,Data) Values (?,?);",
+                        (record["hash"], b64decode(record["data"]))
+                    )
+
+            finish_book()
+
+        self.log_info(
+            f"Loaded {book_count} books, skipped {skipped_count} existing books.")
+        return book_count
+
+    def insert_book(self, book: dict) -> int:
+        """
+            插入书籍并返回编号。
+            来源已存在时，章节数与归档一致则返回 `None` ，否则返回已有的编号以补全章节
+        """
+        res = self.db.query(
+            "Select Id From Books Where Source=?;", (book["Source"],))
+        if len(res) > 0:
+            book_index = res[0][0]
+            count = self.db.query(
+                f"Select count(*) From {self.db.chapters_table(book_index)} Where BookId=?;", (book_index,))[0][0]
+            if count >= book.get("ChapterCount", 0):
+                return None
+            self.log_info(
+                f"Book '{book.get('Title')}' index={book_index} has {count} of {book['ChapterCount']} chapters, completing it from the archive.")
+            return book_index
+
+        # 兼容以字符串保存日期的归档
+        for k in ("PublishDate", "UpdateDate"):
+            if isinstance(book.get(k), str):
+                book[k] = date_to_days(db_to_date(book[k]))
+
+        columns = [k for k in BOOK_COLUMNS if k != "Id" and k in book]
+        self.db.execute(
+            f"Insert into Books ({','.join(columns)}) Values ({','.join('?' * len(columns))});",
+            [book[k] for k in columns]
+        )
+        return self.db.query("Select last_insert_rowid();")[0][0]
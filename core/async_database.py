@@ -0,0 +1,71 @@
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+import asyncio
+
+from .book import Book, BookValidators, Chapter
+from .database import Database
+
+
+class AsyncDatabase:
+    """
+        `Database` 的异步封装
+
+        所有操作都在一个专用的数据库线程中依次执行，
+        协程等待数据库时事件循环可以继续处理网络请求。
+        e.g:
+        ```
+            adb = AsyncDatabase(db)
+            await adb.upsert_chapters(chapters)
+        ```
+    """
+    db: Database
+    executor: ThreadPoolExecutor
+
+    def __init__(self, db: Database) -> None:
+        self.db = db
+        self.executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="Database")
+
+    async def run(self, func, *args, **kwargs):
+        """
+            在数据库线程中执行 `func`
+        """
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(self.executor, partial(func, *args, **kwargs))
+
+    def _run_in_transaction(self, func, *args, **kwargs):
+        with self.db.transaction:
+            return func(*args, **kwargs)
+
+    async def run_in_transaction(self, func, *args, **kwargs):
+        """
+            在数据库线程中以事务执行 `func`，结束后提交
+        """
+        return await self.run(self._run_in_transaction, func, *args, **kwargs)
+
+    async def is_book_exist(self, *params, **kparams) -> bool:
+        return await self.run(self.db.is_book_exist, *params, **kparams)
+
+    async def query_book_info(self, limit=-1, offset=-1, *params, **kparams) -> list[Book]:
+        return await self.run(self.db.query_book_info, limit, offset, *params, **kparams)
+
+    async def query_chapter_infos(self, book_index: int) -> list[tuple[int, str, int, str]]:
+        return await self.run(lambda: list(self.db.iter_chapter_infos(book_index)))
+
+    async def create_book(self, book: Book) -> Book:
+        return await self.run_in_transaction(self.db.create_book, book)
+
+    async def update_book_all_info(self, book: Book) -> None:
+        await self.run_in_transaction(self.db.update_book_all_info, book)
+
+    async def upsert_chapters(self, chapters: list[Chapter]) -> None:
+        await self.run_in_transaction(self.db.upsert_chapters, chapters)
+
+    async def query_validators(self, source: str) -> BookValidators:
+        return await self.run(self.db.query_validators, source)
+
+    async def store_validators(self, validators: BookValidators) -> None:
+        await self.run_in_transaction(self.db.store_validators, validators)
+
+    def close(self) -> None:
+        self.executor.shutdown()
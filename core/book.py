@@ -1,18 +1,45 @@
 from datetime import date, datetime
-from .utils import convert_url, str_to_date
+from typing import Callable, Iterable, Iterator
+from .utils import convert_url, date_to_days, days_to_date, db_to_date, str_to_date
 
 
 class Chapter:
+    __slots__ = ("book_index", "chapter_index", "title",
+                 "_content", "content_loader")
+
     book_index: int  # 书籍编号
     chapter_index: int  # 章节序号
     title: str  # 标题
-    content: str  # 内容
+    _content: str  # 内容
+    content_loader: Callable[[int, int], str]  # 通过书籍编号与章节序号加载内容，由数据库设置
 
-    def __init__(self, book_index, chapter_index, title, content) -> None:
+    def __init__(self, book_index, chapter_index, title, content, content_loader=None) -> None:
         self.book_index = book_index
         self.chapter_index = chapter_index
         self.title = title
-        self.content = content
+        self._content = content
+        self.content_loader = content_loader
+
+    @property
+    def content(self):
+        """
+            章节内容，设置了 `content_loader` 时在访问时才从数据库加载
+        """
+        if self._content is None and self.content_loader is not None:
+            self._content = self.content_loader(
+                self.book_index, self.chapter_index)
+        return self._content
+
+    @content.setter
+    def content(self, c):
+        self._content = c
+
+    def release_content(self) -> None:
+        """
+            释放已加载的内容，下次访问时重新加载。没有 `content_loader` 时不做任何事
+        """
+        if self.content_loader is not None:
+            self._content = None
 
     def __lt__(self, s):
         return self.chapter_index < s.chapter_index
@@ -33,7 +60,65 @@ class Chapter:
         )
 
 
+class ChapterList:
+    """
+        分块保存的章节列表，用于章节很多的书籍。
+        可以像list一样添加、遍历、按下标访问与排序
+    """
+    __slots__ = ("chunk_size", "chunks", "length")
+
+    chunk_size: int
+    chunks: list[list[Chapter]]
+    length: int
+
+    def __init__(self, chapters: Iterable[Chapter] = (), chunk_size: int = 1024) -> None:
+        self.chunk_size = chunk_size
+        self.chunks = []
+        self.length = 0
+        self.extend(chapters)
+
+    def append(self, chapter: Chapter) -> None:
+        if len(self.chunks) == 0 or len(self.chunks[-1]) >= self.chunk_size:
+            self.chunks.append([])
+        self.chunks[-1].append(chapter)
+        self.length += 1
+
+    def extend(self, chapters: Iterable[Chapter]) -> None:
+        for chapter in chapters:
+            self.append(chapter)
+
+    def sort(self) -> None:
+        chapters = sorted(self)
+        self.chunks = []
+        self.length = 0
+        self.extend(chapters)
+
+    def release_content(self) -> None:
+        """
+            释放所有可以重新加载的章节内容
+        """
+        for chapter in self:
+            chapter.release_content()
+
+    def __len__(self) -> int:
+        return self.length
+
+    def __iter__(self) -> Iterator[Chapter]:
+        for chunk in self.chunks:
+            yield from chunk
+
+    def __getitem__(self, idx: int) -> Chapter:
+        if idx < 0:
+            idx += self.length
+        if idx < 0 or idx >= self.length:
+            raise IndexError("chapter index out of range")
+        return self.chunks[idx // self.chunk_size][idx % self.chunk_size]
+
+
 class Book:
+    __slots__ = ("_idx", "title", "author", "chapter_count", "_source", "spider", "desc", "style",
+                 "_cover", "cover_hash", "cover_loader", "cover_format", "status", "_update", "_publish", "chapters")
+
     _idx: int  # 书籍编号
     title: str  # 书籍标题
     author: str  # 作者
@@ -42,12 +127,14 @@ class Book:
     spider: str  # 来源Spider
     desc: str  # 简介
     style: str  # 风格（玄幻/修仙...）
-    cover: bytes  # 封面图
+    _cover: bytes  # 封面图
+    cover_hash: str  # 封面图在封面库中的Hash
+    cover_loader: Callable[[str], bytes]  # 通过Hash加载封面图，由数据库设置
     cover_format: str  # 封面图格式
     status: bool  # 是否完结
     _update: date  # 更新时间
     _publish: date  # 发布时间
-    chapters: list[Chapter]  # 章节列表
+    chapters: Iterable[Chapter]  # 章节列表
 
     @property
     def update(self):
@@ -57,6 +144,8 @@ class Book:
     def update(self, upd):
         if isinstance(upd, str):
             self._update = str_to_date(upd)
+        elif isinstance(upd, int):
+            self._update = days_to_date(upd)
         elif isinstance(upd, datetime):
             self._update = upd
         elif isinstance(upd, date):
@@ -66,12 +155,14 @@ class Book:
 
     @property
     def publish(self):
-        return self._update
+        return self._publish
 
-    @update.setter
+    @publish.setter
     def publish(self, pub):
         if isinstance(pub, str):
             self._publish = str_to_date(pub)
+        elif isinstance(pub, int):
+            self._publish = days_to_date(pub)
         elif isinstance(pub, datetime):
             self._publish = pub
         elif isinstance(pub, date):
@@ -79,6 +170,20 @@ class Book:
         else:
             raise ValueError(f"Unrecognized type of date:{pub}")
 
+    @property
+    def cover(self):
+        """
+            封面图，从数据库读取的书籍在第一次访问时才加载
+        """
+        if self._cover is None and self.cover_hash is not None and self.cover_loader is not None:
+            self._cover = self.cover_loader(self.cover_hash)
+        return self._cover
+
+    @cover.setter
+    def cover(self, c):
+        self._cover = c
+        self.cover_hash = None
+
     @property
     def idx(self):
         return self._idx
@@ -100,7 +205,7 @@ class Book:
     def whole_url(self):
         return 'https://'+self.source
 
-    def __init__(self, title="", author="", source="", spider="", desc="", style="", idx=-1, chapter_count=0, cover=None, cover_format=None, status=True, update=datetime(1970, 1, 1), publish=datetime(1970, 1, 1)) -> None:
+    def __init__(self, title="", author="", source="", spider="", desc="", style="", idx=-1, chapter_count=0, cover=None, cover_format=None, status=True, update=datetime(1970, 1, 1), publish=datetime(1970, 1, 1), cover_hash=None) -> None:
         self.title = title
         self.author = author
         self.source = source
@@ -108,9 +213,11 @@ class Book:
         self.style = style
         self.update = update
         self.publish = publish
+        self.cover_loader = None
         self.cover = cover
+        self.cover_hash = cover_hash
         self.cover_format = cover_format
-        self.chapters = []
+        self.chapters = ChapterList()
         self.idx = idx
         self.chapter_count = chapter_count
         self.status = status
@@ -123,14 +230,14 @@ class Book:
             self.author,
             self.desc,
             self.style,
-            self.cover,
+            self.cover_hash,
             self.cover_format,
             self.chapter_count,
             self.source,
             self.spider,
             int(self.status),
-            datetime.strftime(self.publish, "%Y-%m-%d"),
-            datetime.strftime(self.update, "%Y-%m-%d")
+            date_to_days(self.publish),
+            date_to_days(self.update)
         )
 
     @staticmethod
@@ -141,7 +248,7 @@ class Book:
             author=data[2],
             desc=data[3],
             style=data[4],
-            cover=data[5],
+            cover_hash=data[5],
             cover_format=data[6],
             chapter_count=data[7],
             source=data[8],
@@ -151,6 +258,31 @@ class Book:
             update=data[12]
         )
 
+    @staticmethod
+    def from_row(data, cover_loader=None):
+        """
+            从数据库的一行创建书籍，列的顺序与 `from_tuple` 相同。
+            数据库中的数据是可信的，因此跳过Url规范化与属性检查，日期直接由天数换算
+        """
+        book = Book.__new__(Book)
+        book._idx = data[0]
+        book.title = data[1]
+        book.author = data[2]
+        book.desc = data[3]
+        book.style = data[4]
+        book._cover = None
+        book.cover_hash = data[5]
+        book.cover_loader = cover_loader
+        book.cover_format = data[6]
+        book.chapter_count = data[7]
+        book._source = data[8]
+        book.spider = data[9]
+        book.status = bool(data[10])
+        book._publish = db_to_date(data[11])
+        book._update = db_to_date(data[12])
+        book.chapters = ChapterList()
+        return book
+
     def add_chapter(self, title, content, idx=-1) -> Chapter:
         """
             添加章节到书籍中，可用于插入章节
@@ -176,3 +308,21 @@ class Book:
 
     def __str__(self) -> str:
         return f'<Book {self.idx} "{self.title}" by "{self.author}">'
+
+
+class BookValidators:
+    """
+        判断书籍是否更新的验证信息，成功获取书籍后保存在数据库中，供下次检查时使用
+    """
+    __slots__ = ("source", "etag", "last_modified", "cover_url")
+
+    source: str  # 书籍的来源网址
+    etag: str  # 书籍页面的ETag
+    last_modified: str  # 书籍页面的Last-Modified
+    cover_url: str  # 上次下载的封面Url
+
+    def __init__(self, source: str, etag: str = None, last_modified: str = None, cover_url: str = None) -> None:
+        self.source = source
+        self.etag = etag
+        self.last_modified = last_modified
+        self.cover_url = cover_url
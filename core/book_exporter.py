@@ -10,6 +10,8 @@ class BookExpoter(SettingAccessable, Loggable):
     """
         书籍导出器的基类
     """
+    # 能否利用上次的导出记录( `previous` )只处理新章节，为False时增量导出总是重新导出整本书
+    supports_previous: bool = False
 
     def __init__(self, setting_manager: SettingManager) -> None:
         SettingAccessable.__init__(self, setting_manager)
@@ -25,8 +27,18 @@ class BookExpoter(SettingAccessable, Loggable):
 
         return path
 
-    async def export_book(self, book: Book, output: str):
+    def get_export_options(self) -> tuple:
         """
-            导出书籍，异步执行
+            影响导出结果的设置，用于增量导出时判断是否需要重新导出
+        """
+        return ()
+
+    async def export_book(self, book: Book, output: str, previous=None) -> str:
+        """
+            导出书籍，异步执行，返回输出文件的路径
+
+            `previous`:上次导出的记录( `ExportRecord` )，只有 `supports_previous` 为True时才会传入。不为 `None` 时表示
+            `previous.last_chapter` 及之前的章节没有变化，导出器可以只处理新章节。
+            此时 `book.chapters` 是延迟加载的，未访问的章节内容不会被读取
         """
         raise NonimplentException(self.__class__, BookExpoter.export_book)
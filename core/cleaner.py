@@ -0,0 +1,99 @@
+import re
+from typing import Iterable
+
+from .book import Chapter
+
+
+class ContentCleaner:
+    """
+        章节内容清理器，在章节写入数据库之前去除广告、水印并规范空白字符
+
+        所有的广告规则与空白字符合并为一个正则表达式，每个章节只需扫描一次。
+        规范空白时行内连续的 `&nbsp;` 、不间断空格、全角空格、制表符与空格合并为一个普通空格，零宽字符被删除。
+        行首缩进中的 `&nbsp;` 与不间断空格换为同样数量的普通空格，缩进的宽度、换行与空行保持不变，
+        去除广告之后留在行尾的空白也会被删除。
+        使用编号反向引用、内联标志或与其他规则组名重复的规则无法合并，会在合并的表达式之后单独执行。
+        e.g:
+        ```
+            cleaner = ContentCleaner([r"请收藏本站.*", r"www\\.example\\.com"])
+            chapter.content = cleaner.clean(chapter.content)
+        ```
+    """
+    patterns: list[str]
+    normalize_whitespace: bool
+    regex: re.Pattern
+    separate_regexes: list[re.Pattern]  # 无法合并、单独执行的规则
+
+    cleaned_count: int  # 清理过的章节数
+    removed_bytes: int  # 去除的字节数(UTF-8)
+
+    # 组名加上前缀，以免与规则中的组名冲突
+    WHITESPACE_GROUP = "_ContentCleaner_ws"
+    INDENT_GROUP = "_ContentCleaner_indent"
+    WHITESPACE_CHARS = r"(?:&nbsp;|[\xa0\u3000\t\f\v ])+"
+    # 行首的缩进保留宽度，其他位置连续的空白合并为一个空格
+    INDENT = rf"(?P<{INDENT_GROUP}>(?:\A|(?<=\n)){WHITESPACE_CHARS})"
+    WHITESPACE = rf"(?P<{WHITESPACE_GROUP}>{WHITESPACE_CHARS})"
+    ZERO_WIDTH = r"[\u200b\ufeff]"
+    INDENT_SPACE = re.compile(r"&nbsp;|\xa0")
+    # 在所有规则执行完之后清理，广告可能在行尾
+    TRAILING_WHITESPACE = re.compile(r"[\u3000\t\f\v ]+(?=\r?\n|\Z)")
+    BACKREFERENCE = re.compile(r"\\[1-9]")
+
+    def __init__(self, patterns: Iterable[str] = (), normalize_whitespace=True) -> None:
+        self.patterns = list(patterns)
+        self.normalize_whitespace = normalize_whitespace
+        self.separate_regexes = []
+        self.cleaned_count = 0
+        self.removed_bytes = 0
+
+        alternatives = []
+        group_names = {ContentCleaner.WHITESPACE_GROUP,
+                       ContentCleaner.INDENT_GROUP}
+        for i in self.patterns:
+            regex = re.compile(i)
+            names = set(regex.groupindex)
+            # 合并后组的编号会变化，内联标志也只能出现在表达式的开头
+            if ContentCleaner.BACKREFERENCE.search(i) or regex.flags & ~re.UNICODE or names & group_names:
+                self.separate_regexes.append(regex)
+            else:
+                alternatives.append(f"(?:{i})")
+                group_names |= names
+
+        if normalize_whitespace:
+            alternatives.append(ContentCleaner.INDENT)
+            alternatives.append(ContentCleaner.WHITESPACE)
+            alternatives.append(ContentCleaner.ZERO_WIDTH)
+
+        if len(alternatives) > 0:
+            self.regex = re.compile("|".join(alternatives))
+        else:
+            self.regex = None
+
+    @staticmethod
+    def replace(match: re.Match) -> str:
+        if match.lastgroup == ContentCleaner.WHITESPACE_GROUP:
+            return " "
+        if match.lastgroup == ContentCleaner.INDENT_GROUP:
+            return ContentCleaner.INDENT_SPACE.sub(" ", match.group())
+        return ""
+
+    def clean(self, text: str) -> str:
+        if not text:
+            return text
+
+        res = text
+        if self.regex is not None:
+            res = self.regex.sub(ContentCleaner.replace, res)
+        for regex in self.separate_regexes:
+            res = regex.sub("", res)
+        if self.normalize_whitespace:
+            res = ContentCleaner.TRAILING_WHITESPACE.sub("", res)
+
+        self.cleaned_count += 1
+        self.removed_bytes += len(text.encode()) - len(res.encode())
+        return res
+
+    def clean_chapter(self, chapter: Chapter) -> Chapter:
+        chapter.content = self.clean(chapter.content)
+        return chapter
@@ -0,0 +1,540 @@
+"""
+    常驻进程
+
+    在一个事件循环中持续运行，Spider实例(及其连接池)、数据库连接与各种缓存在任务之间保持可用。
+    导出任务在单独的进程池中以只读连接执行，不会阻塞数据库线程中的写入。
+    任务按通道放入各自的队列，每个通道有自己的worker，交互任务不会排在整站爬取与更新检查之后；
+    各个任务的网络请求再由Manager共享的调度器按通道分配名额。守护进程会定期检查未完结书籍的更新。
+    通过本地HTTP接口(TCP或Unix socket)提交任务与查询状态，请求与响应均为JSON:
+    ```
+        GET  /status              守护进程的状态
+        GET  /jobs                最近的任务
+        GET  /jobs/<id>           任务的状态与结果
+        POST /jobs                提交任务，e.g: {"type": "get", "url": "..."}
+                                             {"type": "get", "urls": ["...", "..."]}
+                                             {"type": "check", "book": 1}   省略book时检查所有未完结的书籍
+                                             {"type": "export", "book": 1, "exporter": "TextExporter", "output": "sub/dir"}
+        POST /shutdown            停止守护进程
+    ```
+    `params` 字段会传给Spider，`lane` 字段指定请求的通道(只能是已有的通道)，
+    默认单个Url使用 `interactive` ，多个Url使用 `bulk` ，检查使用 `check` 。
+    导出的 `output` 是 `daemon_export_dir` 中的相对路径，不能指向该目录之外。
+
+    为了防止浏览器中的网页跨站请求或通过DNS重绑定访问接口，
+    TCP接口要求 `Host` 与监听的地址一致，拒绝带有其他 `Origin` 的请求，POST请求必须是 `Content-Type: application/json` 。
+    设置了 `daemon_token` 时还需要 `Authorization: Bearer <token>`
+"""
+
+import asyncio
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from hmac import compare_digest
+from http import HTTPStatus
+import json
+import logging
+import os
+import signal
+from time import time
+from typing import Union
+
+from .database import BookNotExistError
+from .export_manifest import ExportManifest, ExportRecord
+from .logger import Loggable
+from .parallel_export import export_book_worker
+from .scheduler import DEFAULT_LANE_WEIGHTS, LANE_BULK, LANE_CHECK, LANE_INTERACTIVE, lane
+from .setting import SettingAccessable
+from .spider import Spider
+from .utils import get_async_result
+
+JOB_TYPES = ("get", "check", "export")
+# 各个通道的worker数
+DEFAULT_DAEMON_WORKERS = {
+    LANE_INTERACTIVE: 2,
+    LANE_CHECK: 1,
+    LANE_BULK: 1
+}
+MAX_REQUEST_SIZE = 1024 * 1024
+
+
+class DaemonRequestError(Exception):
+    status: int
+    message: str
+
+    def __init__(self, status: int, message: str, *args: object) -> None:
+        self.status = status
+        self.message = message
+        super().__init__(status, message, *args)
+
+    def __str__(self) -> str:
+        return self.message
+
+
+class ExportJobError(Exception):
+    book_index: int
+    message: str
+
+    def __init__(self, book_index: int, message: str, *args: object) -> None:
+        self.book_index = book_index
+        self.message = message
+        super().__init__(book_index, message, *args)
+
+    def __str__(self) -> str:
+        return f"Export book {self.book_index} error:{self.message}"
+
+
+class Job:
+    """
+        守护进程中的一个任务
+    """
+    id: int
+    type: str
+    params: dict
+    status: str  # queued/running/done/failed
+    result: object
+    error: str
+    created: float
+    started: float
+    finished: float
+
+    def __init__(self, id: int, type: str, params: dict) -> None:
+        self.id = id
+        self.type = type
+        self.params = params
+        self.status = "queued"
+        self.result = None
+        self.error = None
+        self.created = time()
+        self.started = None
+        self.finished = None
+
+    def to_dict(self) -> dict:
+        return {
+            "id": self.id,
+            "type": self.type,
+            "params": self.params,
+            "status": self.status,
+            "result": self.result,
+            "error": self.error,
+            "created": self.created,
+            "started": self.started,
+            "finished": self.finished
+        }
+
+
+def read_export_record(output: str, exporter_name: str, book_index: int) -> Union[ExportRecord, None]:
+    return ExportManifest(output).get(exporter_name, book_index)
+
+
+def save_export_record(output: str, exporter_name: str, record: ExportRecord) -> None:
+    # 重新读取清单再写入，同时完成的导出任务不会覆盖彼此的记录
+    manifest = ExportManifest(output)
+    manifest.set(exporter_name, record)
+    manifest.save()
+
+
+class CrawlDaemon(Loggable, SettingAccessable):
+    """
+        常驻的爬取进程
+        e.g:
+        ```
+            CrawlDaemon(manager, port=8765).run()  # 直到收到SIGINT/SIGTERM或 `POST /shutdown`
+        ```
+    """
+    manager: object
+    host: str
+    port: int
+    socket_path: str
+    workers: dict[str, int]
+    check_interval: float
+    job_history: int
+    export_workers: int
+    export_dir: str
+    token: str
+
+    spiders: dict[str, Spider]
+    export_pools: dict[str, ProcessPoolExecutor]
+    jobs: OrderedDict[int, Job]
+    next_id: int
+    queues: dict[str, asyncio.Queue]
+    tasks: list[asyncio.Future]
+    stop_event: asyncio.Event
+    manifest_lock: asyncio.Lock  # 串行写入导出清单
+    start_time: float
+
+    def __init__(self, manager, host: str = None, port: int = None, socket_path: str = None) -> None:
+        SettingAccessable.__init__(self, manager.setting_manager)
+        Loggable.__init__(self, "Daemon")
+        self.manager = manager
+        self.host = host or self.get_setting("daemon_host", "127.0.0.1")
+        self.port = int(port or self.get_setting("daemon_port", 8765))
+        # 设置后使用Unix socket而不是TCP端口
+        self.socket_path = socket_path or self.get_setting("daemon_socket", "")
+        # 可以是各个通道的worker数，也可以是一个整数表示每个通道的worker数
+        workers = self.get_setting("daemon_workers", DEFAULT_DAEMON_WORKERS)
+        if isinstance(workers, int):
+            workers = {name: workers for name in DEFAULT_DAEMON_WORKERS}
+        self.workers = workers
+        # 定期检查未完结书籍的间隔(秒)，为0时不检查
+        self.check_interval = self.get_setting("daemon_check_interval", 3600)
+        self.job_history = self.get_setting("daemon_job_history", 1000)
+        # 每种导出器的导出进程数
+        self.export_workers = self.get_setting("daemon_export_workers", 1)
+        # 导出任务只能写入该目录
+        self.export_dir = os.path.abspath(
+            self.get_setting("daemon_export_dir", "exports"))
+        # 不为空时请求需要携带该令牌
+        self.token = self.get_setting("daemon_token", "")
+
+        self.spiders = {}
+        self.export_pools = {}
+        self.jobs = OrderedDict()
+        self.next_id = 1
+        self.queues = {}
+        self.tasks = []
+        self.stop_event = None
+        self.manifest_lock = None
+        self.start_time = time()
+
+    def run(self) -> None:
+        """
+            运行直到停止
+        """
+        get_async_result(self.serve())
+
+    def stop(self) -> None:
+        if self.stop_event is not None:
+            self.stop_event.set()
+
+    async def serve(self) -> None:
+        loop = asyncio.get_event_loop()
+        self.queues = {}
+        self.tasks = []
+        self.stop_event = asyncio.Event()
+        self.manifest_lock = asyncio.Lock()
+        self.start_time = time()
+
+        server = await self.start_server()
+        for name in set(DEFAULT_LANE_WEIGHTS) | set(self.workers):
+            self.start_workers(name)
+        if self.check_interval > 0:
+            self.tasks.append(asyncio.ensure_future(self.schedule_checks()))
+
+        signals = []
+        for i in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(i, self.stop)
+                signals.append(i)
+            except (NotImplementedError, RuntimeError, ValueError):
+                # Windows或非主线程中不支持
+                pass
+
+        try:
+            await self.stop_event.wait()
+        finally:
+            self.log_info("Stopping daemon.")
+            for i in signals:
+                loop.remove_signal_handler(i)
+            server.close()
+            await server.wait_closed()
+            for task in self.tasks:
+                task.cancel()
+            await asyncio.gather(*self.tasks, return_exceptions=True)
+            self.tasks = []
+            for spider in self.spiders.values():
+                await spider.async_close()
+            self.spiders = {}
+            for pool in self.export_pools.values():
+                pool.shutdown(cancel_futures=True)
+            self.export_pools = {}
+            if self.socket_path and os.path.exists(self.socket_path):
+                os.remove(self.socket_path)
+
+    async def start_server(self):
+        if self.socket_path:
+            if os.path.exists(self.socket_path):
+                # 上次未正常退出时残留的socket文件
+                os.remove(self.socket_path)
+            server = await asyncio.start_unix_server(self.handle_connection, path=self.socket_path)
+            self.log_info(f"Daemon listening on unix:{self.socket_path}")
+        else:
+            server = await asyncio.start_server(self.handle_connection, self.host, self.port)
+            self.log_info(
+                f"Daemon listening on http://{self.host}:{self.port}/")
+        return server
+
+    def start_workers(self, name: str) -> None:
+        """
+            创建通道的队列与worker
+        """
+        self.queues[name] = asyncio.Queue()
+        for _ in range(max(1, self.workers.get(name, 1))):
+            self.tasks.append(asyncio.ensure_future(
+                self.worker(self.queues[name])))
+
+    def submit(self, job_type: str, params: dict = None) -> Job:
+        """
+            提交任务，返回任务对象
+        """
+        params = params or {}
+        if job_type not in JOB_TYPES:
+            raise DaemonRequestError(400, f"Unknown job type '{job_type}'")
+        if job_type == "get" and "url" not in params and "urls" not in params:
+            raise DaemonRequestError(400, "Job 'get' needs 'url' or 'urls'")
+        if job_type == "export" and "book" not in params:
+            raise DaemonRequestError(400, "Job 'export' needs 'book'")
+        if "lane" in params and params["lane"] not in self.queues:
+            raise DaemonRequestError(400, f"Unknown lane '{params['lane']}'")
+        if job_type == "export":
+            params["output"] = self.get_export_output(params.get("output", ""))
+
+        job = Job(self.next_id, job_type, params)
+        self.next_id += 1
+        self.jobs[job.id] = job
+        # 只保留最近的任务，未完成的任务不会被移除
+        while len(self.jobs) > self.job_history:
+            oldest = next(iter(self.jobs.values()))
+            if oldest.status in ("queued", "running"):
+                break
+            self.jobs.popitem(last=False)
+        job_lane = self.get_job_lane(job)
+        self.queues[job_lane].put_nowait(job)
+        self.log_info(f"Job {job.id} '{job_type}' queued in lane '{job_lane}'.")
+        return job
+
+    def get_export_output(self, output: str) -> str:
+        """
+            把导出目录解析到 `export_dir` 中，指向该目录之外时拒绝
+        """
+        if not isinstance(output, str):
+            raise DaemonRequestError(400, "'output' must be a string")
+        path = os.path.realpath(os.path.join(self.export_dir, output))
+        root = os.path.realpath(self.export_dir)
+        if path != root and not path.startswith(root + os.sep):
+            raise DaemonRequestError(
+                403, "'output' must be inside the export directory")
+        os.makedirs(path, exist_ok=True)
+        return path
+
+    async def worker(self, queue: asyncio.Queue) -> None:
+        while True:
+            job: Job = await queue.get()
+            job.status = "running"
+            job.started = time()
+            try:
+                job.result = await self.run_job(job)
+                job.status = "done"
+            except Exception as e:
+                job.status = "failed"
+                job.error = f"{e.__class__.__name__}: {e}"
+                self.log_error(f"Job {job.id} '{job.type}' failed:{e}")
+                logging.exception(e)
+            finally:
+                job.finished = time()
+                queue.task_done()
+            self.log_info(
+                f"Job {job.id} '{job.type}' {job.status} in {job.finished - job.started:.2f}s.")
+
+    def get_job_lane(self, job: Job) -> str:
+        if "lane" in job.params:
+            return job.params["lane"]
+        if job.type == "get":
+            return LANE_BULK if "urls" in job.params else LANE_INTERACTIVE
+        if job.type == "check":
+            return LANE_CHECK
+        return LANE_INTERACTIVE
+
+    async def run_job(self, job: Job):
+        with lane(self.get_job_lane(job)):
+            return await self._run_job(job)
+
+    async def _run_job(self, job: Job):
+        mgr = self.manager
+        spider_params = job.params.get("params", {})
+
+        if job.type == "get":
+            urls = job.params.get("urls") or [job.params["url"]]
+            succeeded, failed = await mgr.async_get_books(urls, self.spiders, **spider_params)
+            return {"succeeded": succeeded, "failed": failed}
+
+        if job.type == "check":
+            book_index = job.params.get("book")
+            if book_index is None:
+                books = await mgr.async_db.query_book_info(Status=0)
+            else:
+                books = await mgr.async_db.query_book_info(Id=int(book_index))
+                if len(books) == 0:
+                    raise BookNotExistError(Id=book_index)
+            succeeded, failed = await mgr.async_check_books(books, self.spiders, **spider_params)
+            return {"succeeded": succeeded, "failed": failed}
+
+        # export
+        exporter = job.params.get("exporter")
+        if not exporter:
+            exporter = mgr.book_exporters_manager.get_extension_list()[0]
+        exporter_class = mgr.book_exporters_manager.get_extension(exporter)
+        output = job.params.get("output", ".")
+        book_index = int(job.params["book"])
+        if not await mgr.async_db.is_book_exist(Id=book_index):
+            raise BookNotExistError(Id=book_index)
+
+        # 清单的读写在线程池中进行，不阻塞事件循环
+        loop = asyncio.get_event_loop()
+        record = None
+        if mgr.incremental_export:
+            record = await loop.run_in_executor(
+                None, read_export_record, output, exporter_class.__name__, book_index)
+        _, title, seconds, status, record, error = await loop.run_in_executor(
+            self.get_export_pool(exporter, exporter_class), export_book_worker, book_index, output, record)
+        if error is not None:
+            raise ExportJobError(book_index, error)
+        if mgr.incremental_export:
+            async with self.manifest_lock:
+                await loop.run_in_executor(
+                    None, save_export_record, output, exporter_class.__name__, record)
+        self.log_info(
+            f"Book '{title}' index={book_index} {status} in {seconds:.2f}s.")
+        return {"book": book_index, "exporter": exporter, "output": output, "status": status}
+
+    def get_export_pool(self, name: str, exporter_class: type) -> ProcessPoolExecutor:
+        """
+            获取导出器对应的进程池，第一次使用时创建
+        """
+        if name not in self.export_pools:
+            self.export_pools[name] = self.manager.create_export_pool(
+                exporter_class, self.export_workers)
+        return self.export_pools[name]
+
+    async def schedule_checks(self) -> None:
+        while True:
+            await asyncio.sleep(self.check_interval)
+            # 上一次检查还未完成时不重复提交
+            pending = any(i.type == "check" and "book" not in i.params and i.status in ("queued", "running")
+                          for i in self.jobs.values())
+            if not pending:
+                self.submit("check")
+
+    def status(self) -> dict:
+        counts = {}
+        for job in self.jobs.values():
+            counts[job.status] = counts.get(job.status, 0) + 1
+        return {
+            "uptime": time() - self.start_time,
+            "workers": self.workers,
+            "queued": {name: queue.qsize() for name, queue in self.queues.items()},
+            "jobs": counts,
+            "spiders": list(self.spiders.keys()),
+            "check_interval": self.check_interval
+        }
+
+    def get_job(self, job_id: str) -> Job:
+        try:
+            return self.jobs[int(job_id)]
+        except (KeyError, ValueError):
+            raise DaemonRequestError(404, f"Job '{job_id}' not found")
+
+    def get_allowed_hosts(self) -> set[str]:
+        """
+            TCP接口允许的 `Host` 头，只包含监听的地址
+        """
+        hosts = {self.host}
+        if self.host in ("127.0.0.1", "::1", "localhost"):
+            hosts |= {"127.0.0.1", "[::1]", "localhost"}
+        elif ":" in self.host:
+            hosts.add(f"[{self.host}]")
+        return hosts | {f"{i}:{self.port}" for i in hosts}
+
+    def check_request(self, method: str, headers: dict[str, str]) -> None:
+        """
+            检查请求头，拒绝来自浏览器的跨站请求与DNS重绑定
+        """
+        if not self.socket_path:
+            host = headers.get("host", "").lower()
+            if host not in self.get_allowed_hosts():
+                raise DaemonRequestError(403, f"Host '{host}' is not allowed")
+            origin = headers.get("origin")
+            if origin is not None and origin.lower().partition("://")[2] not in self.get_allowed_hosts():
+                raise DaemonRequestError(403, f"Origin '{origin}' is not allowed")
+        if self.token:
+            scheme, _, token = headers.get("authorization", "").partition(" ")
+            if scheme.lower() != "bearer" or not compare_digest(token.strip().encode(), self.token.encode()):
+                raise DaemonRequestError(401, "Invalid token")
+        if method == "POST":
+            content_type = headers.get("content-type", "").partition(";")[0].strip().lower()
+            if content_type != "application/json":
+                raise DaemonRequestError(
+                    415, "Content-Type must be application/json")
+
+    def handle_request(self, method: str, path: str, body: bytes) -> tuple[int, Union[dict, list]]:
+        path = path.split("?", 1)[0].rstrip("/")
+        parts = path.split("/")[1:]
+
+        if method == "GET":
+            if path == "/status":
+                return 200, self.status()
+            if path == "/jobs":
+                return 200, [i.to_dict() for i in self.jobs.values()]
+            if len(parts) == 2 and parts[0] == "jobs":
+                return 200, self.get_job(parts[1]).to_dict()
+        elif method == "POST":
+            if path == "/jobs":
+                try:
+                    data = json.loads(body or b"{}")
+                except ValueError:
+                    raise DaemonRequestError(400, "Invalid JSON")
+                if not isinstance(data, dict):
+                    raise DaemonRequestError(400, "Invalid JSON")
+                job_type = data.pop("type", None)
+                return 202, self.submit(job_type, data).to_dict()
+            if path == "/shutdown":
+                self.stop()
+                return 200, {"stopping": True}
+        else:
+            raise DaemonRequestError(405, f"Method '{method}' not allowed")
+        raise DaemonRequestError(404, f"Path '{path}' not found")
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """
+            处理一个HTTP请求，响应后关闭连接
+        """
+        try:
+            try:
+                request_line = (await reader.readline()).decode("latin-1").split()
+                if len(request_line) < 2:
+                    raise DaemonRequestError(400, "Bad request")
+                method, path = request_line[0].upper(), request_line[1]
+
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    key, _, value = line.decode("latin-1").partition(":")
+                    headers[key.strip().lower()] = value.strip()
+                    if len(headers) > 100:
+                        raise DaemonRequestError(431, "Too many headers")
+                length = int(headers.get("content-length", 0))
+                if length < 0:
+                    raise DaemonRequestError(400, "Bad request")
+                if length > MAX_REQUEST_SIZE:
+                    raise DaemonRequestError(413, "Request too large")
+                body = await reader.readexactly(length) if length > 0 else b""
+
+                self.check_request(method, headers)
+                status, data = self.handle_request(method, path, body)
+            except DaemonRequestError as e:
+                status, data = e.status, {"error": str(e)}
+            except ValueError:
+                status, data = 400, {"error": "Bad request"}
+
+            content = json.dumps(data, ensure_ascii=False).encode("utf-8")
+            writer.write(
+                f"HTTP/1.1 {status} {HTTPStatus(status).phrase}\r\n"
+                f"Content-Type: application/json; charset=utf-8\r\n"
+                f"Content-Length: {len(content)}\r\n"
+                f"Connection: close\r\n\r\n".encode("latin-1") + content)
+            await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
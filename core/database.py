@@ -1,16 +1,70 @@
 from datetime import datetime
+import hashlib
+import os
 import sqlite3
 from threading import RLock
+from typing import Iterator, Union
 
-from .spider import Spider
-from .book import Book, Chapter
+from .book import Book, BookValidators, Chapter, ChapterList
 from .logger import Loggable
+from .utils import date_to_days, db_to_date
+from .query_builder import Query, make_condition as build_condition
+from . import metrics
+
+# 数据库结构版本，保存在 `PRAGMA user_version` 中
+SCHEMA_VERSION = 3
+
+BOOKS_TABLE_SQL = """
+    Create Table "{name}"(
+        Id           Integer            Primary Key                                    , -- 编号
+        Title        Text                              Not null                        , -- 标题
+        Author       Text                                          Default 'Unknown'   , -- 作者
+        Description  Text                                          Default ''          , -- 简介
+        Style        Text                                          Default 'Unknown'   , -- 风格
+        CoverHash    Text                                          Default Null        , -- 封面Hash,封面内容保存在Covers表中
+        CoverFormat  Text                                          Default Null        , -- 封面格式
+        ChapterCount int                               Not Null                        , -- 章节数
+        Source       Text     Unique                   Not Null                        , -- 来源网址 格式: hostname+path,path不得以'/'结尾
+        Spider       Text                              Not NUll                        , -- 来源Spider
+        Status       int                                           Default 1           , -- 是否完结(1->完结 0->未完结)
+        PublishDate  int                                           Default 0           , -- 发布日期 距1970-01-01的天数
+        UpdateDate   int                                           Default 0             -- 更新日期 距1970-01-01的天数
+    );
+"""
+
+# 二级索引，批量导入时会先删除，导入完成后重建
+INDEXES = {
+    "Books_Status_I": "Create Index If Not Exists Books_Status_I on Books(Status);",
+    "Books_Spider_I": "Create Index If Not Exists Books_Spider_I on Books(Spider);",
+    "Books_UpdateDate_I": "Create Index If Not Exists Books_UpdateDate_I on Books(UpdateDate);",
+    "Books_CoverHash_I": "Create Index If Not Exists Books_CoverHash_I on Books(CoverHash);",
+}
+
+# 章节表的索引，每个分片都有一份。`{schema}` 为分片名
+CHAPTER_INDEXES = {
+    "Chapter_I": "Create Unique Index If Not Exists {schema}.Chapter_I on Chapters(BookId,ChapterId);",
+}
+
+# 查询书籍信息时读取的列，与 `Book.from_tuple` 的顺序一致
+BOOK_COLUMNS = ("Id", "Title", "Author", "Description", "Style", "CoverHash", "CoverFormat",
+                "ChapterCount", "Source", "Spider", "Status", "PublishDate", "UpdateDate")
+
+
+def content_hash(content: Union[str, None]) -> Union[str, None]:
+    """
+        章节内容的sha1，注册为SQL函数 `content_hash` ，写入章节时计算
+    """
+    if content is None:
+        return None
+    return hashlib.sha1(content.encode("utf-8", "surrogatepass")).hexdigest()
 
 
 class BookNotExistError(Exception):
     args: int
 
-    def __init__(self, *args: object) -> None:
+    def __init__(self, *args: object, **kwargs) -> None:
+        # 查询条件以 `Id=1` 的形式记录
+        args = args + tuple(f"{k}={v}" for k, v in kwargs.items())
         self.args = args
         Exception.__init__(self, *args)
 
@@ -19,21 +73,86 @@ class BookNotExistError(Exception):
 
 
 class Transaction:
+    """
+        事务，在事务结束前一直持有数据库锁，其他线程不会插入语句。
+        嵌套的事务合并到最外层的事务中
+    """
     db: object
 
     def __init__(self, db: object) -> None:
         self.db = db
 
     def __enter__(self) -> None:
-        with self.db.db_lock:
-            self.db.connection.execute("Begin Transaction;")
+        self.db.db_lock.acquire()
+        self.db.transaction_depth += 1
+        if self.db.transaction_depth == 1:
+            try:
+                self.db.connection.execute("Begin Transaction;")
+            except:
+                self.db.transaction_depth -= 1
+                self.db.db_lock.release()
+                raise
 
     def __exit__(self, exception_type, exception_value, traceback) -> None:
-        if exception_type:
-            self.db.rollback()
-            return False
-        else:
-            self.db.commit()
+        try:
+            self.db.transaction_depth -= 1
+            if self.db.transaction_depth > 0:
+                return False
+            if exception_type:
+                self.db.rollback()
+                return False
+            else:
+                self.db.commit()
+        finally:
+            self.db.db_lock.release()
+
+
+class BulkLoadMode:
+    """
+        批量导入模式。
+        进入时删除书籍表的二级索引并关闭同步写盘，退出时重建索引、恢复设置并执行 `Analyze` 。
+        章节的唯一索引会保留，重复的章节由插入语句去重。
+        发生异常时回滚未提交的部分
+    """
+    db: object
+    synchronous: int
+
+    def __init__(self, db: object) -> None:
+        self.db = db
+
+    def __enter__(self) -> None:
+        self.db.db_lock.acquire()
+        self.db.commit()
+        self.synchronous = self.db.query("PRAGMA synchronous;")[0][0]
+        self.db.execute("PRAGMA synchronous = OFF;")
+        self.db.drop_indexes(chapters=False)
+
+    def __exit__(self, exception_type, exception_value, traceback) -> None:
+        try:
+            if exception_type:
+                self.db.rollback()
+            else:
+                self.db.commit()
+            self.db.create_indexes()
+            self.db.execute(f"PRAGMA synchronous = {self.synchronous};")
+            if not exception_type:
+                self.db.execute("Analyze;")
+        finally:
+            self.db.db_lock.release()
+        return False
+
+
+class ShardConfigError(Exception):
+    expected: int
+    actual: int
+
+    def __init__(self, expected: int, actual: int, *args: object) -> None:
+        self.expected = expected
+        self.actual = actual
+        super().__init__(expected, actual, *args)
+
+    def __str__(self) -> str:
+        return f"Database was created with {self.expected} shards, but {self.actual} shards are configured"
 
 
 class ChapterNotExistError(Exception):
@@ -50,27 +169,30 @@ class ChapterNotExistError(Exception):
         return f'Chapter {self.chapter_index} of Book {self.book_index} does not exists'
 
 
-class UnsupportedType(Exception):
-    type_: type
-
-    def __init__(self, type_: type, *args: object) -> None:
-        super().__init__(*args)
-        self.type_ = type
-
-    def __str__(self) -> str:
-        return f'Type "{self.type_}" is not supported'
-
-
 class Database(Loggable):
     connection: sqlite3.Connection
     cursor: sqlite3.Cursor
 
     db_lock: RLock
-
-    def __init__(self, db_file_path: str = "") -> None:
+    transaction_depth: int
+    cached_statements: int
+    fetch_size: int
+    shards: int  # 章节分片数，0表示不分片
+    shard_paths: list[str]
+    read_only: bool
+    quiet: bool  # 打开时不输出日志，用于连接池等会打开多个连接的场景
+
+    def __init__(self, db_file_path: str = "", cached_statements: int = 256, fetch_size: int = 64, shards: int = 0, read_only=False, quiet=False) -> None:
         self.db_lock = RLock()
+        self.transaction_depth = 0
         self.connection = None
         self.cursor = None
+        self.cached_statements = cached_statements
+        self.fetch_size = fetch_size
+        self.shards = shards
+        self.shard_paths = []
+        self.read_only = read_only
+        self.quiet = quiet
         Loggable.__init__(self)
 
         if db_file_path != "":
@@ -83,6 +205,28 @@ class Database(Loggable):
             res = self.cursor.fetchall()
         return res
 
+    def iter_query(self, sql, params=(), fetch_size: int = -1) -> Iterator[tuple]:
+        """
+            使用独立的游标执行查询，每次取 `fetch_size` 行，逐行返回。
+            只在取数据时持有锁，迭代过程中可以执行其他语句
+        """
+        if fetch_size <= 0:
+            fetch_size = self.fetch_size
+
+        with self.db_lock:
+            cursor = self.connection.cursor()
+            cursor.execute(sql, params)
+
+        try:
+            while True:
+                with self.db_lock:
+                    rows = cursor.fetchmany(fetch_size)
+                if len(rows) == 0:
+                    break
+                yield from rows
+        finally:
+            cursor.close()
+
     def fetchall(self) -> list:
         res = None
         with self.db_lock:
@@ -97,6 +241,7 @@ class Database(Loggable):
         with self.db_lock:
             self.cursor.executemany(sql, *params)
 
+    @metrics.db_write_seconds.time("commit")
     def commit(self) -> None:
         with self.db_lock:
             self.connection.commit()
@@ -115,39 +260,58 @@ class Database(Loggable):
     def transaction(self) -> Transaction:
         return Transaction(self)
 
+    @property
+    def bulk_load_mode(self) -> BulkLoadMode:
+        return BulkLoadMode(self)
+
+    @staticmethod
+    def make_read_only_uri(db_file_path: str) -> str:
+        # urllib.request的导入较慢，只在需要时导入
+        from urllib.request import pathname2url
+        return f"file:{pathname2url(os.path.abspath(db_file_path))}?mode=ro"
+
     def open(self, db_file_path: str) -> None:
+        """
+            打开数据库。只读模式下不会创建或升级表，用于导出等只读取数据的场景
+        """
+        if self.read_only:
+            self.connection = sqlite3.connect(
+                self.make_read_only_uri(db_file_path), uri=True, check_same_thread=False, isolation_level='', cached_statements=self.cached_statements)
+            self.create_functions()
+            self.cursor = self.connection.cursor()
+            self.attach_shards(db_file_path)
+            if not self.quiet:
+                self.log_info(
+                    f"Load database '{db_file_path}' (read only) successfully.")
+            return
+
         self.connection = sqlite3.connect(
-            db_file_path, check_same_thread=False, isolation_level='')
+            db_file_path, check_same_thread=False, isolation_level='', cached_statements=self.cached_statements)
+        self.create_functions()
         self.cursor = self.connection.cursor()
         self.check_primary_table_exist()
-        self.log_info(f"Load database '{db_file_path}' successfully.")
+        self.attach_shards(db_file_path)
+        self.create_indexes()
+        if not self.quiet:
+            self.log_info(f"Load database '{db_file_path}' successfully.")
 
     def __del__(self) -> None:
         self.close()
 
+    def create_functions(self) -> None:
+        """
+            注册SQL中使用的函数
+        """
+        self.connection.create_function(
+            "content_hash", 1, content_hash, deterministic=True)
+
     def create_books_table(self) -> None:
         with self.db_lock:
             with self.transaction:
                 self.execute("""
                     PRAGMA encoding = "UTF-8";
                 """)
-                self.execute("""
-                    Create Table "Books"(
-                        Id           Integer            Primary Key                                    , -- 编号
-                        Title        Text                              Not null                        , -- 标题
-                        Author       Text                                          Default 'Unknown'   , -- 作者
-                        Description  Text                                          Default ''          , -- 简介
-                        Style        Text                                          Default 'Unknown'   , -- 风格
-                        Cover        Blob                                          Default Null        , -- 封面
-                        CoverFormat  Text                                          Default Null        , -- 封面格式
-                        ChapterCount int                               Not Null                        , -- 章节数
-                        Source       Text     Unique                   Not Null                        , -- 来源网址 格式: hostname+path,path不得以'/'结尾
-                        Spider       Text                              Not NUll                        , -- 来源Spider
-                        Status       int                                           Default 1           , -- 是否完结(1->完结 0->未完结)
-                        PublishDate  Text                                          Default '0000-00-00', -- 发布日期 格式 %Y-%m-%d
-                        UpdateDate   Text                                          Default '0000-00-00'  -- 更新日期 格式 %Y-%m-%d
-                    );
-                """)
+                self.execute(BOOKS_TABLE_SQL.format(name="Books"))
 
     def check_primary_table_exist(self) -> None:
         with self.db_lock:
@@ -161,64 +325,395 @@ class Database(Loggable):
             except sqlite3.OperationalError:
                 self.create_chapters_table()
 
+            try:
+                self.execute("Select 1 from Covers;")
+            except sqlite3.OperationalError:
+                self.create_covers_table()
+
+            try:
+                self.execute("Select 1 from Shards;")
+            except sqlite3.OperationalError:
+                self.create_shards_table()
+
+            try:
+                self.execute("Select 1 from Validators;")
+            except sqlite3.OperationalError:
+                self.create_validators_table()
+
+            self.migrate()
+
+    def create_covers_table(self) -> None:
+        """
+            创建封面表，封面按内容的Hash存储，相同的封面只保存一次
+        """
+        self.execute("""
+            Create Table Covers(
+                Id          Integer Primary Key Not Null, -- 编号
+                Hash        Text    Unique      Not Null, -- 封面内容的sha1
+                Data        Blob                Not Null  -- 封面内容
+            );
+        """)
+
+    def create_shards_table(self) -> None:
+        """
+            创建分片表，记录章节分片的文件。分片数在第一次使用后不能再修改
+        """
+        self.execute("""
+            Create Table Shards(
+                Id          Integer Primary Key Not Null, -- 分片编号
+                Path        Text                Not Null  -- 分片文件
+            );
+        """)
+
+    def create_validators_table(self) -> None:
+        """
+            创建验证信息表，记录书籍页面的ETag等信息，用于检查更新时的条件请求
+        """
+        self.execute("""
+            Create Table Validators(
+                Source       Text    Primary Key Not Null, -- 来源网址，与Books.Source相同
+                ETag         Text    Default Null        , -- 书籍页面的ETag
+                LastModified Text    Default Null        , -- 书籍页面的Last-Modified
+                CoverUrl     Text    Default Null          -- 上次下载的封面Url
+            );
+        """)
+
+    @staticmethod
+    def make_shard_path(db_file_path: str, shard: int) -> str:
+        if db_file_path == ":memory:":
+            return db_file_path
+        root, ext = os.path.splitext(db_file_path)
+        return f"{root}.shard{shard}{ext}"
+
+    def attach_shards(self, db_file_path: str) -> None:
+        """
+            把章节分片附加(Attach)到主库，分片按 `BookId % shards` 路由。
+            书籍信息和封面保存在主库中
+        """
+        with self.db_lock:
+            # 只读模式下不会创建表，旧版本的数据库没有 `Shards` 表，视为没有分片
+            if self.read_only and len(self.query(
+                    "Select 1 From sqlite_master Where type=='table' and name=='Shards';")) == 0:
+                recorded = []
+            else:
+                recorded = self.query(
+                    "Select Id,Path From Shards Order By Id;")
+            if self.read_only:
+                self.shards = len(recorded)
+            elif len(recorded) == 0 and self.shards > 0:
+                with self.transaction:
+                    for i in range(self.shards):
+                        self.execute(
+                            "Insert into Shards (Id,Path) Values (?,?);",
+                            (i, self.make_shard_path(db_file_path, i)))
+                recorded = self.query(
+                    "Select Id,Path From Shards Order By Id;")
+            elif len(recorded) != self.shards:
+                raise ShardConfigError(len(recorded), self.shards)
+
+            self.shard_paths = [i[1] for i in recorded]
+            for i, path in enumerate(self.shard_paths):
+                # 分片文件的路径相对主库所在的目录
+                if path != ":memory:" and not os.path.isabs(path):
+                    path = os.path.join(
+                        os.path.dirname(db_file_path), os.path.basename(path))
+                if self.read_only:
+                    self.execute(f"Attach Database ? As shard{i};",
+                                 (self.make_read_only_uri(path),))
+                    continue
+                self.execute(f"Attach Database ? As shard{i};", (path,))
+                self.execute(f"""
+                    Create Table If Not Exists shard{i}.Chapters(
+                        Id          Integer Primary Key Not Null, -- 编号
+                        BookId      int                 Not Null, -- 书籍编号
+                        ChapterId   int                         , -- 章节编号
+                        Title       Text                Not Null, -- 标题
+                        Content     Text                        , -- 内容
+                        ContentHash Text                          -- 内容的sha1
+                    );
+                """)
+                self.migrate_content_hash(f"shard{i}")
+
+    def chapter_schemas(self) -> list[str]:
+        """
+            所有保存章节的库，未分片时只有主库
+        """
+        return ["main"] + [f"shard{i}" for i in range(self.shards)]
+
+    def chapters_table(self, book_index: int) -> str:
+        """
+            书籍的章节所在的表
+        """
+        if self.shards == 0:
+            return "main.Chapters"
+        return f"shard{book_index % self.shards}.Chapters"
+
+    def migrate_chapters_to_shards(self) -> int:
+        """
+            把主库中的章节移动到对应的分片，返回移动的章节数
+        """
+        if self.shards == 0:
+            return 0
+
+        with self.transaction:
+            count = self.query("Select count(*) From main.Chapters;")[0][0]
+            for i in range(self.shards):
+                self.execute(
+                    f"Insert into shard{i}.Chapters (BookId,ChapterId,Title,Content,ContentHash) Select BookId,ChapterId,Title,Content,ContentHash From main.Chapters Where BookId % ? == ?;",
+                    (self.shards, i))
+            self.execute("Delete From main.Chapters;")
+        self.log_info(f"Moved {count} chapters to {self.shards} shards.")
+        return count
+
+    def shard_stats(self) -> list[tuple[str, str, int]]:
+        """
+            返回每个库的名称、文件与章节数
+        """
+        res = []
+        for schema in self.chapter_schemas():
+            path = self.query(
+                "Select file From pragma_database_list Where name==?;", (schema,))[0][0]
+            count = self.query(f"Select count(*) From {schema}.Chapters;")[0][0]
+            res.append((schema, path, count))
+        return res
+
+    def vacuum(self, schema: str = "main") -> None:
+        """
+            整理单个库(主库或分片)的文件
+        """
+        if schema not in self.chapter_schemas():
+            raise ValueError(f"Unknown database:{schema}")
+        with self.db_lock:
+            self.commit()
+            self.execute(f"Vacuum {schema};")
+
+    def backup(self, schema: str, path: str) -> None:
+        """
+            把单个库(主库或分片)备份到 `path`
+        """
+        if schema not in self.chapter_schemas():
+            raise ValueError(f"Unknown database:{schema}")
+        with self.db_lock:
+            self.commit()
+            self.execute(f"Vacuum {schema} Into ?;", (path,))
+
+    def migrate(self) -> None:
+        """
+            升级旧版本的数据库结构
+        """
+        with self.db_lock:
+            version = self.query("PRAGMA user_version;")[0][0]
+            if version < 1:
+                self.migrate_covers()
+            if version < 2:
+                self.migrate_dates()
+            if version < 3:
+                self.migrate_content_hash("main")
+            self.execute(f"PRAGMA user_version = {SCHEMA_VERSION};")
+
+    def migrate_covers(self) -> None:
+        """
+            把旧版本保存在 `Books.Cover` 中的封面移动到 `Covers` 表
+        """
+        columns = [i[1] for i in self.query("PRAGMA table_info(Books);")]
+        with self.transaction:
+            if "CoverHash" not in columns:
+                self.execute(
+                    "Alter Table Books Add Column CoverHash Text Default Null;")
+            if "Cover" not in columns:
+                return
+
+            ids = [i[0] for i in self.query(
+                "Select Id From Books Where Cover Not Null;")]
+            for idx in ids:
+                cover = self.query(
+                    "Select Cover From Books Where Id==?;", (idx,))[0][0]
+                self.execute(
+                    "Update Books Set CoverHash=?,Cover=Null Where Id==?;",
+                    (self.store_cover(cover), idx))
+        self.log_info(f"Moved {len(ids)} covers to the cover table.")
+
+    def migrate_dates(self) -> None:
+        """
+            重建 `Books` 表，把以字符串保存的日期转为距1970-01-01的天数，
+            同时去掉旧版本的 `Cover` 列。无法解析的日期(如'0000-00-00')视为0
+        """
+        columns = [i[1] for i in self.query("PRAGMA table_info(Books);")]
+        if "Cover" not in columns and self.query("Select 1 From Books Where typeof(UpdateDate)=='text' or typeof(PublishDate)=='text' Limit 1;") == []:
+            return
+
+        def days(column):
+            return f"coalesce(cast(julianday(replace({column},'/','-')) - 2440587.5 as int), 0)"
+
+        copied = [i for i in BOOK_COLUMNS if i not in (
+            "PublishDate", "UpdateDate")]
+        with self.transaction:
+            self.execute(BOOKS_TABLE_SQL.format(name="Books_New"))
+            self.execute(f"""
+                Insert into Books_New ({','.join(copied)},PublishDate,UpdateDate)
+                    Select {','.join(copied)},{days("PublishDate")},{days("UpdateDate")} From Books;
+            """)
+            self.execute("Drop Table Books;")
+            self.execute("Alter Table Books_New Rename To Books;")
+        self.log_info("Converted the dates of books to days.")
+
+    def migrate_content_hash(self, schema: str) -> None:
+        """
+            为旧版本的章节表添加 `ContentHash` 列并计算已有章节的Hash
+        """
+        columns = [i[1] for i in self.query(
+            f"PRAGMA {schema}.table_info(Chapters);")]
+        if "ContentHash" in columns:
+            return
+        with self.transaction:
+            self.execute(
+                f"Alter Table {schema}.Chapters Add Column ContentHash Text Default Null;")
+            self.execute(
+                f"Update {schema}.Chapters Set ContentHash=content_hash(Content);")
+        self.log_info(f"Computed the content hash of chapters in '{schema}'.")
+
     def create_chapters_table(self) -> None:
         """
             为书籍创建章节表
         """
-        self.execute(f"""
+        self.execute("""
             Create Table Chapters(
                 Id          Integer Primary Key Not Null, -- 编号
                 BookId      int                 Not Null, -- 书籍编号
                 ChapterId   int                         , -- 章节编号
                 Title       Text                Not Null, -- 标题
                 Content     Text                        , -- 内容
+                ContentHash Text                        , -- 内容的sha1，写入章节时计算
                 Foreign Key (BookId) References Books(Id)  -- 外键约束
             );
         """)
-        self.execute(
-            "Create Unique Index Chapter_I on Chapters(BookId,ChapterId);")
 
+    def create_indexes(self) -> None:
+        """
+            创建 `Manager` 查询时用到的索引。
+            `Source` 由Unique约束自带的索引覆盖，章节由 `Chapter_I` 覆盖
+        """
+        with self.db_lock:
+            for sql in INDEXES.values():
+                self.execute(sql)
+            for schema in self.chapter_schemas():
+                for sql in CHAPTER_INDEXES.values():
+                    self.execute(sql.format(schema=schema))
+
+    def drop_indexes(self, chapters: bool = True) -> None:
+        """
+            删除索引，`chapters` 为 `False` 时保留章节的索引
+        """
+        with self.db_lock:
+            for name in INDEXES.keys():
+                self.execute(f"Drop Index If Exists {name};")
+            if not chapters:
+                return
+            for schema in self.chapter_schemas():
+                for name in CHAPTER_INDEXES.keys():
+                    self.execute(f"Drop Index If Exists {schema}.{name};")
+
+    def explain(self, sql: str, *params) -> list[tuple]:
+        """
+            返回语句的 `Explain Query Plan` 结果，用于检查查询是否使用了索引
+        """
+        return self.query("Explain Query Plan " + sql, *params)
+
+    def group_chapters(self, chapters: list[Chapter]) -> dict[str, list[tuple]]:
+        """
+            按所在的表对章节分组，并转为元组
+        """
+        res = {}
+        for chapter in chapters:
+            table = self.chapters_table(chapter.book_index)
+            res.setdefault(table, []).append(chapter.to_tuple())
+        return res
+
+    @metrics.db_write_seconds.time("insert_chapters")
     def insert_chapters(self, chapters: list[Chapter]) -> None:
-        chapters_tuple_list = [i.to_tuple() for i in chapters]
-        self.executemany(
-            f"Insert into Chapters (BookId,ChapterId,Title,Content) Values (?,?,?,?);",
-            chapters_tuple_list
-        )
+        metrics.db_rows_written.inc(len(chapters), "insert_chapters")
+        with self.db_lock:
+            for table, chapters_tuple_list in self.group_chapters(chapters).items():
+                self.executemany(
+                    f"Insert into {table} (BookId,ChapterId,Title,Content,ContentHash) Values (?1,?2,?3,?4,content_hash(?4));",
+                    chapters_tuple_list
+                )
+
+    @metrics.db_write_seconds.time("upsert_chapters")
+    def upsert_chapters(self, chapters: list[Chapter]) -> None:
+        """
+            插入章节，已存在的章节则更新标题与内容
+        """
+        metrics.db_rows_written.inc(len(chapters), "upsert_chapters")
+        with self.db_lock:
+            for table, chapters_tuple_list in self.group_chapters(chapters).items():
+                self.executemany(
+                    f"""
+                    Insert into {table} (BookId,ChapterId,Title,Content,ContentHash) Values (?1,?2,?3,?4,content_hash(?4))
+                        On Conflict(BookId,ChapterId) Do Update Set Title=excluded.Title,Content=excluded.Content,ContentHash=excluded.ContentHash;
+                    """,
+                    chapters_tuple_list
+                )
 
     def insert_chapter(self, chapter: Chapter) -> None:
         self.execute(
-            f"Insert into Chapters (BookId,ChapterId,Title,Content) Values (?,?,?,?);",
+            f"Insert into {self.chapters_table(chapter.book_index)} (BookId,ChapterId,Title,Content,ContentHash) Values (?1,?2,?3,?4,content_hash(?4));",
             chapter.to_tuple()
         )
 
+    def store_cover(self, cover: bytes) -> str:
+        """
+            保存封面并返回它的Hash，已存在的封面不会重复保存
+        """
+        cover_hash = hashlib.sha1(cover).hexdigest()
+        self.execute(
+            "Insert or Ignore into Covers (Hash,Data) Values (?,?);",
+            (cover_hash, cover)
+        )
+        return cover_hash
+
+    def store_book_cover(self, book: Book) -> None:
+        """
+            保存书籍新设置的封面，并填充 `book.cover_hash`
+        """
+        if book.cover_hash is None and book.cover is not None:
+            book.cover_hash = self.store_cover(book.cover)
+        book.cover_loader = self.load_cover
+
+    def load_cover(self, cover_hash: str) -> bytes:
+        res = self.query(
+            "Select Data From Covers Where Hash==?;", (cover_hash,))
+        if len(res) == 0:
+            return None
+        return res[0][0]
+
+    def delete_unused_cover(self, cover_hash: str) -> None:
+        """
+            若封面不再被任何书籍使用，则删除它
+        """
+        if cover_hash is None:
+            return
+        if len(self.query("Select 1 From Books Where CoverHash==? Limit 1;", (cover_hash,))) == 0:
+            self.execute("Delete From Covers Where Hash==?;", (cover_hash,))
+
     def create_books(self, books: list[Book]) -> list[Book]:
         """
             创建图书并填充编号
         """
-        # 先把Book 转成tuple方便executemany
-        books_tuple_list = [i.to_tuple() for i in books]
-        idx: int = 0
-
         with self.db_lock:  # 防止序号被扰乱
-            idx = self.query("Select last_insert_rowid() from Books;")[0][0]
-            self.executemany(
-                """
-                Insert into 'Books' (Title,Author,Description,Style,Cover,CoverFormat,ChapterCount,Source,Status,PublishDate,UpdateDate) Values (?,?,?,?,?,?,?,?,?,?,?,?);
-                """,
-                books_tuple_list
-            )
-
-        for i, book in enumerate(books):
-            book.idx = i+idx+1
-            book.update_book_index_to_chapters()
+            for book in books:
+                self.create_book(book)
 
         return books
 
+    @metrics.db_write_seconds.time("create_book")
     def create_book(self, book: Book) -> Book:
+        metrics.db_rows_written.inc(1, "create_book")
         with self.db_lock:
+            self.store_book_cover(book)
             self.execute(
                 """
-                Insert into 'Books' (Title,Author,Description,Style,Cover,CoverFormat,ChapterCount,Source,Spider,Status,PublishDate,UpdateDate) Values (?,?,?,?,?,?,?,?,?,?,?,?);
+                Insert into 'Books' (Title,Author,Description,Style,CoverHash,CoverFormat,ChapterCount,Source,Spider,Status,PublishDate,UpdateDate) Values (?,?,?,?,?,?,?,?,?,?,?,?);
                 """,
                 book.to_tuple()
             )
@@ -233,8 +728,9 @@ class Database(Loggable):
         """
             判断满足条件的书籍是否存在
         """
-        res = self.query_book_info(*params, **kparams)
-        return len(res) > 0
+        sql, values = Query("Books", "1").where(
+            *params, **kparams).limit(1).build()
+        return len(self.query(sql, values)) > 0
 
     def check_book_exist(self, **params) -> None:
         """
@@ -251,7 +747,8 @@ class Database(Loggable):
             raise BookNotExistError(Id=book_index)
 
         res = self.query(
-            f"Select Id From Chapters Where BookId=={book_index} and ChapterId=={chapter_index};")
+            f"Select Id From {self.chapters_table(book_index)} Where BookId==? and ChapterId==?;",
+            (book_index, chapter_index))
         return len(res) > 0
 
     def check_chapter_exist(self, book_index: int, chapter_index: int) -> None:
@@ -295,6 +792,7 @@ class Database(Loggable):
         for k, v in params.items():
             self.update_book_single_info(book_index, k, v)
 
+    @metrics.db_write_seconds.time("update_book")
     def update_book_all_info(self, book: Book) -> None:
         """
             更新全部书籍信息，若该书籍不存在则创建
@@ -302,11 +800,17 @@ class Database(Loggable):
         if not self.is_book_exist(Id=book.idx):
             self.create_book(book)
 
+        metrics.db_rows_written.inc(1, "update_book")
+        old_cover_hash = self.query(
+            "Select CoverHash From Books Where Id==?;", (book.idx,))[0][0]
+        self.store_book_cover(book)
         self.execute(
-            "Update Books Set Title=?,Author=?,Description=?,Style=?,Cover=?,CoverFormat=?,ChapterCount=?,Source=?,Spider=?,Status=?,PublishDate=?,UpdateDate=? Where Id == ?;",
-            (book.title, book.author, book.desc, book.style, book.cover,
-             book.cover_format, book.chapter_count, book.source, book.spider, book.status, datetime.strftime(book.publish, "%Y-%m-%d"), datetime.strftime(book.update, "%Y-%m-%d"), book.idx)
+            "Update Books Set Title=?,Author=?,Description=?,Style=?,CoverHash=?,CoverFormat=?,ChapterCount=?,Source=?,Spider=?,Status=?,PublishDate=?,UpdateDate=? Where Id == ?;",
+            (book.title, book.author, book.desc, book.style, book.cover_hash,
+             book.cover_format, book.chapter_count, book.source, book.spider, book.status, date_to_days(book.publish), date_to_days(book.update), book.idx)
         )
+        if old_cover_hash != book.cover_hash:
+            self.delete_unused_cover(old_cover_hash)
 
     def update_chapter(self, chapter: Chapter) -> None:
         """
@@ -317,7 +821,7 @@ class Database(Loggable):
                 chapter.book_index, chapter.chapter_index)
 
         self.execute(
-            f"Update Chapters Set Title=?,Content=? Where BookId=? And ChapterId=?;",
+            f"Update {self.chapters_table(chapter.book_index)} Set Title=?1,Content=?2,ContentHash=content_hash(?2) Where BookId=?3 And ChapterId=?4;",
             (chapter.title, chapter.content,
              chapter.book_index, chapter.chapter_index)
         )
@@ -327,15 +831,22 @@ class Database(Loggable):
             删除书籍
         """
         self.check_book_exist(Id=book_index)
+        cover_hash = self.query(
+            "Select CoverHash From Books Where Id==?;", (book_index,))[0][0]
         self.execute(
-            "Delete From Chapters Where BookId == ?;",
+            f"Delete From {self.chapters_table(book_index)} Where BookId == ?;",
             (book_index,)
         )
 
+        self.execute(
+            "Delete From Validators Where Source==(Select Source From Books Where Id==?);",
+            (book_index,)
+        )
         self.execute(
             "Delete From Books Where Id==?;",
             (book_index,)
         )
+        self.delete_unused_cover(cover_hash)
 
     def delete_chapter(self, book_index: int, chapter_index: int) -> None:
         """
@@ -345,66 +856,151 @@ class Database(Loggable):
             raise ChapterNotExistError(book_index, chapter_index)
 
         self.execute(
-            f"Delete From Chapters where BookId=={book_index} and ChapterId=={chapter_index};"
+            f"Delete From {self.chapters_table(book_index)} where BookId==? and ChapterId==?;",
+            (book_index, chapter_index)
         )
 
     @staticmethod
-    def make_condition(*params, **kparams):
-        sql = "Where " if len(kparams) + len(params) > 0 else ""
-        flag = False
+    def make_condition(*params, **kparams) -> tuple[str, tuple]:
+        """
+            生成Where子句，返回SQL与绑定参数，见 `query_builder.make_condition`
+        """
+        return build_condition(*params, **kparams)
 
-        for k, v in kparams.items():
-            if flag:
-                sql += "and "
-            else:
-                flag = True
-            if type(v) == type(""):
-                sql += f"{k} == '{v}' "
-            elif type(v) == type(0):
-                sql += f"{k} == {v} "
-            else:
-                raise UnsupportedType(v.__class__)
+    def query_book_info(self, limit=-1, offset=-1, *params, **kparams) -> list[Book]:
+        sql, values = Query("Books", *BOOK_COLUMNS).where(
+            *params, **kparams).limit(limit, offset).build()
 
-        for i in params:
-            if flag:
-                sql += "and "+i
-            else:
-                sql += i
-                flag = True
+        return [Book.from_row(i, self.load_cover) for i in self.query(sql, values)]
 
-        return sql
+    def query_book_update(self, source: str) -> Union[datetime, None]:
+        """
+            只读取书籍的更新日期，书籍不存在时返回 `None`
+        """
+        res = self.query(
+            "Select UpdateDate From Books Where Source==? Limit 1;", (source,))
+        if len(res) == 0:
+            return None
+        return db_to_date(res[0][0])
 
-    def query_book_info(self, limit=-1, offset=-1, *params, **kparams) -> list[Book]:
-        sql = "Select * From Books "
-        sql += Database.make_condition(*params, **kparams)
-        if limit != -1:
-            sql += f"Limit {limit} "
-        if offset != -1:
-            sql += f"Offset {offset} "
-        sql += ";"
+    def list_books(self, columns=BOOK_COLUMNS, order_by="Id", after: tuple = None, limit=20, descending=False, *params, **kparams) -> tuple[list[tuple], tuple]:
+        """
+            分页列出书籍，只读取 `columns` 中的列，不创建 `Book` 对象。
+            使用键集分页：`after` 是上一页返回的位置，查询从该位置之后开始，
+            因此每一页的耗时与页码无关。
+            `order_by` 可以是 `Id` 或 `UpdateDate`，`limit` 必须大于0。
 
-        res = self.query(sql)
-        return [Book.from_tuple(i) for i in res]
+            返回该页的数据与下一页的位置，没有更多数据时位置为 `None`
+            e.g:
+            ```
+                rows, after = db.list_books(("Id", "Title"), Status=0)
+                rows, after = db.list_books(("Id", "Title"), after=after, Status=0)
+            ```
+        """
+        if limit <= 0:
+            raise ValueError(f"Page size must be positive:{limit}")
+
+        columns = tuple(columns)
+        for column in columns:
+            if column not in BOOK_COLUMNS:
+                raise ValueError(f"Unknown column of Books:{column}")
+
+        if order_by == "Id":
+            keys = ("Id",)
+        elif order_by == "UpdateDate":
+            keys = ("UpdateDate", "Id")
+        else:
+            raise ValueError(f"Books can not be ordered by {order_by}")
+
+        query = Query("Books", *(columns + keys)).where(*params, **kparams)
+        if after is not None:
+            key_sql = ",".join(keys)
+            placeholders = ",".join("?" * len(keys))
+            query.where_clause(
+                f"({key_sql}) {'<' if descending else '>'} ({placeholders})", *after)
+        query.order_by(*(f"{k} Desc" if descending else k for k in keys))
+        query.limit(limit)
+
+        sql, values = query.build()
+        res = self.query(sql, values)
+        if len(res) < limit:
+            after = None
+        else:
+            after = res[-1][len(columns):]
+        return [i[:len(columns)] for i in res], after
 
     def query_chapter(self, book_index: int, chapter_index: int) -> Chapter:
         if not self.is_chapter_exist(book_index, chapter_index):
             raise ChapterNotExistError(book_index, chapter_index)
 
         res = self.query(
-            f"Select BookId,ChapterId,Title,Content From Chapters Where BookId=={book_index} and ChapterId=={chapter_index};")
+            f"Select BookId,ChapterId,Title,Content From {self.chapters_table(book_index)} Where BookId==? and ChapterId==?;",
+            (book_index, chapter_index))
 
         return Chapter.from_tuple(res[0])
 
-    def query_all_chapters(self, book_index: int) -> list[Chapter]:
+    def query_all_chapters(self, book_index: int, lazy=False) -> ChapterList:
+        return ChapterList(self.iter_chapters(book_index, lazy=lazy))
+
+    def iter_chapters(self, book_index: int, fetch_size: int = -1, lazy=False) -> Iterator[Chapter]:
+        """
+            按 `ChapterId` 顺序流式返回书籍的章节，内存占用与书籍大小无关。
+            `lazy` 为True时不读取章节内容，内容在访问 `chapter.content` 时才加载
+        """
         self.check_book_exist(Id=book_index)
 
+        if lazy:
+            rows = self.iter_query(
+                f"Select BookId,ChapterId,Title From {self.chapters_table(book_index)} Where BookId==? Order By ChapterId;",
+                (book_index,), fetch_size)
+            return (Chapter(i[0], i[1], i[2], None, self.load_chapter_content) for i in rows)
+
+        rows = self.iter_query(
+            f"Select BookId,ChapterId,Title,Content From {self.chapters_table(book_index)} Where BookId==? Order By ChapterId;",
+            (book_index,), fetch_size)
+        return (Chapter.from_tuple(i) for i in rows)
+
+    def load_chapter_content(self, book_index: int, chapter_index: int) -> str:
+        """
+            只读取章节内容，用于延迟加载
+        """
         res = self.query(
-            f"Select BookId,ChapterId,Title,Content From Chapters Where BookId=={book_index};")
+            f"Select Content From {self.chapters_table(book_index)} Where BookId==? and ChapterId==?;",
+            (book_index, chapter_index))
+        if len(res) == 0:
+            raise ChapterNotExistError(book_index, chapter_index)
+        return res[0][0]
+
+    def iter_chapter_infos(self, book_index: int, fetch_size: int = -1) -> Iterator[tuple[int, str, int, str]]:
+        """
+            按 `ChapterId` 顺序返回章节的 `(ChapterId, Title, 内容长度, 内容Hash)` ，不读取章节内容。
+            只读打开的旧版本数据库没有 `ContentHash` 列，此时Hash由内容计算
+        """
+        self.check_book_exist(Id=book_index)
 
-        res = [Chapter.from_tuple(i) for i in res]
-        res.sort()
+        table = self.chapters_table(book_index)
+        schema = table.split(".")[0]
+        has_hash = len(self.query(
+            "Select 1 From pragma_table_info('Chapters',?) Where name=='ContentHash';", (schema,))) > 0
+        hash_column = "ContentHash" if has_hash else "content_hash(Content)"
+        return self.iter_query(
+            f"Select ChapterId,Title,length(Content),{hash_column} From {table} Where BookId==? Order By ChapterId;",
+            (book_index,), fetch_size)
 
-        return res
+    def query_validators(self, source: str) -> BookValidators:
+        """
+            读取书籍的验证信息，没有记录时返回空的验证信息
+        """
+        res = self.query(
+            "Select ETag,LastModified,CoverUrl From Validators Where Source==?;", (source,))
+        if len(res) == 0:
+            return BookValidators(source)
+        return BookValidators(source, *res[0])
+
+    def store_validators(self, validators: BookValidators) -> None:
+        self.execute(
+            "Insert or Replace into Validators (Source,ETag,LastModified,CoverUrl) Values (?,?,?,?);",
+            (validators.source, validators.etag, validators.last_modified, validators.cover_url))
 
     def begin_transaction(self):
         self.execute("Begin Transaction;")
@@ -0,0 +1,181 @@
+"""
+    增量导出
+
+    导出目录中的清单文件记录每本书上次导出时的最后一个章节编号、书籍信息与章节信息的摘要、输出路径以及输出文件的大小与修改时间。
+    再次导出时:
+    1. 摘要不变并且输出文件未被修改，跳过这本书
+    2. 只新增了章节(已导出部分的摘要不变)并且输出文件未被修改，把上次的记录交给导出器，导出器可以只追加新章节或复用已生成的内容，
+       复用失败或导出器不支持复用( `supports_previous` 为False)时重新导出
+    3. 其他情况重新导出
+
+    摘要由导出器的选项、书名、作者、简介、封面与每个章节的 `(ChapterId, Title, 内容Hash)` 计算，
+    内容Hash在写入章节时保存在数据库中，计算摘要时不需要读取章节内容。
+"""
+
+from hashlib import sha1
+import json
+import os
+import tempfile
+from typing import Iterable, Union
+
+from .book import Book
+from .book_exporter import BookExpoter
+from .database import Database
+from .profiler import stage
+from .utils import get_async_result
+
+MANIFEST_FILE_NAME = ".export_manifest.json"
+
+
+class ExportRecord:
+    """
+        一本书的导出记录
+    """
+    book_index: int
+    last_chapter: int  # 已导出的最后一个章节编号
+    hash: str
+    path: str
+    size: int  # 输出文件的大小与修改时间(纳秒)，用于判断文件是否被替换或截断
+    mtime: int
+
+    def __init__(self, book_index: int, last_chapter: int, hash: str, path: str, size: int = None, mtime: int = None) -> None:
+        self.book_index = book_index
+        self.last_chapter = last_chapter
+        self.hash = hash
+        self.path = path
+        self.size = size
+        self.mtime = mtime
+
+    def to_dict(self) -> dict:
+        return {"book": self.book_index, "last_chapter": self.last_chapter,
+                "hash": self.hash, "path": self.path, "size": self.size, "mtime": self.mtime}
+
+    @staticmethod
+    def from_dict(data: dict) -> "ExportRecord":
+        return ExportRecord(data["book"], data["last_chapter"], data["hash"], data["path"],
+                            data.get("size"), data.get("mtime"))
+
+    def stat_output(self) -> None:
+        """
+            记录输出文件当前的大小与修改时间
+        """
+        stat = os.stat(self.path)
+        self.size = stat.st_size
+        self.mtime = stat.st_mtime_ns
+
+    def is_output_unchanged(self) -> bool:
+        """
+            输出文件是否存在并且在上次导出后没有被修改
+        """
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return False
+        return stat.st_size == self.size and stat.st_mtime_ns == self.mtime
+
+
+class ExportManifest:
+    """
+        导出清单，保存在导出目录中，按 `导出器名:书籍编号` 索引
+    """
+    file_path: str
+    records: dict[str, ExportRecord]
+
+    def __init__(self, output: str) -> None:
+        directory = os.path.dirname(output) if os.path.isfile(output) else output
+        self.file_path = os.path.join(directory, MANIFEST_FILE_NAME)
+        self.records = {}
+        self.load()
+
+    @staticmethod
+    def make_key(exporter_name: str, book_index: int) -> str:
+        return f"{exporter_name}:{book_index}"
+
+    def get(self, exporter_name: str, book_index: int) -> Union[ExportRecord, None]:
+        return self.records.get(ExportManifest.make_key(exporter_name, book_index))
+
+    def set(self, exporter_name: str, record: ExportRecord) -> None:
+        self.records[ExportManifest.make_key(
+            exporter_name, record.book_index)] = record
+
+    def load(self) -> None:
+        if os.path.exists(self.file_path):
+            with open(self.file_path, "r", encoding="utf-8") as f:
+                self.records = {k: ExportRecord.from_dict(v)
+                                for k, v in json.load(f).items()}
+
+    def save(self) -> None:
+        """
+            先写入临时文件再替换，中途失败不会损坏已有的清单
+        """
+        directory = os.path.dirname(self.file_path) or "."
+        os.makedirs(directory, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(
+            prefix=MANIFEST_FILE_NAME, dir=directory)
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump({k: v.to_dict()
+                          for k, v in self.records.items()}, f, ensure_ascii=False)
+            os.replace(temp_path, self.file_path)
+        except BaseException:
+            os.remove(temp_path)
+            raise
+
+
+def export_digest(options: tuple, book: Book, chapter_infos: Iterable[tuple[int, str, int, str]]) -> str:
+    """
+        由导出选项、书籍信息与各章节的编号、标题和内容Hash计算摘要
+    """
+    h = sha1()
+    h.update(json.dumps((options, book.title, book.author, book.desc,
+             book.cover_hash), ensure_ascii=False).encode())
+    for chapter_index, title, _, chapter_hash in chapter_infos:
+        h.update(json.dumps((chapter_index, title, chapter_hash),
+                 ensure_ascii=False).encode())
+    return h.hexdigest()
+
+
+def export_book_incremental(db: Database, exporter: BookExpoter, book: Book, output: str,
+                            record: ExportRecord = None) -> tuple[str, ExportRecord]:
+    """
+        根据上次的导出记录增量导出书籍，返回 (状态, 新的记录)。
+        状态为 `skipped` / `updated` / `exported`
+    """
+    book_index = book.idx
+    infos = list(db.iter_chapter_infos(book_index))
+    last_chapter = infos[-1][0] if len(infos) > 0 else 0
+    options = exporter.get_export_options()
+    digest = export_digest(options, book, infos)
+
+    if record is not None and record.is_output_unchanged():
+        if record.hash == digest:
+            return "skipped", record
+        exported = [i for i in infos if i[0] <= record.last_chapter]
+        if export_digest(options, book, exported) != record.hash:
+            record = None
+    else:
+        record = None
+
+    path = None
+    status = "exported"
+    # 不能复用上次结果的导出器会读取所有章节，直接一次读出内容，避免逐章查询
+    if record is not None and exporter.supports_previous:
+        # 已导出的章节可能不会被读取，使用延迟加载
+        book.chapters = db.iter_chapters(book_index, lazy=True)
+        try:
+            with stage("export"):
+                path = get_async_result(
+                    exporter.export_book(book, output, record))
+            status = "updated"
+        except Exception as e:
+            exporter.log_error(
+                f"Reuse previous export of book '{book.title}' error:{e}, exporting the whole book.")
+
+    if path is None:
+        book.chapters = db.iter_chapters(book_index)
+        with stage("export"):
+            path = get_async_result(exporter.export_book(book, output))
+
+    record = ExportRecord(book_index, last_chapter, digest, path)
+    record.stat_output()
+    return status, record
@@ -1,4 +1,5 @@
-from email.mime import base
+from typing import Iterator
+
 from .logger import Loggable
 from .setting import SettingAccessable, SettingManager
 
@@ -14,6 +15,9 @@ class ExtensionNotFoundError(Exception):
         self.extension_name = extension_name
         Exception.__init__(self, module_name, extension_name)
 
+    def __str__(self) -> str:
+        return f"Extension '{self.extension_name}' of module '{self.module_name}' not found"
+
 
 class ExtensionLoadError(Exception):
     module_name: str
@@ -31,25 +35,73 @@ class ExtensionLoadError(Exception):
 
 
 class ExtensionManager(Loggable, SettingAccessable):
-    extensions: dict[str, type]
+    """
+        扩展管理器
+
+        设置 `loaded_list` 是已注册扩展的清单。启动时只读取清单，
+        扩展模块在第一次通过 `get_extension` 使用时才导入。
+        `manifest_attrs` 中的类属性在导入扩展时记录到设置 `manifest` 中，
+        不导入扩展也可以通过 `get_extension_info` 读取
+    """
+    extensions: dict[str, type]  # 已导入的扩展
+    registered: list[str]  # 已注册的扩展
     module_name: str  # e.g. spider
     base_class: type
+    manifest_attrs: tuple[str]
+    version: int  # 已注册的扩展或清单变化时增加
 
-    def __init__(self, setting_manager: SettingManager, base_class, module_name) -> None:
+    def __init__(self, setting_manager: SettingManager, base_class, module_name, manifest_attrs: tuple[str] = ()) -> None:
         self.base_class = base_class
         self.module_name = module_name
+        self.manifest_attrs = manifest_attrs
         self.extensions = {}
+        self.registered = []
+        self.version = 0
         Loggable.__init__(self, name=module_name+"_manager")
         SettingAccessable.__init__(
             self, setting_manager, field=f"{module_name}_manager")
         self.init_loaded_extension()
 
-    def get_extension_list(self):
-        return self.extensions.keys()
+    def get_extension_list(self) -> list[str]:
+        return list(self.registered)
 
     def init_loaded_extension(self):
-        for i in self.get_setting("loaded_list", []):
-            self.load_extension(i)
+        self.registered = list(self.get_setting("loaded_list", []))
+
+    def get_extension_info(self, name: str) -> dict:
+        """
+            从清单中读取扩展的信息，清单中没有记录时导入扩展
+        """
+        info = self.get_setting("manifest", {}).get(name)
+        if info is None or any(i not in info for i in self.manifest_attrs):
+            self.get_extension(name)
+            info = self.get_setting("manifest")[name]
+        return info
+
+    def update_manifest(self, name: str, class_: type) -> None:
+        info = {i: getattr(class_, i, None) for i in self.manifest_attrs}
+        manifest = self.get_setting("manifest", {})
+        if manifest.get(name) != info:
+            manifest[name] = info
+            self.set_setting("manifest", manifest)
+            self.version += 1
+
+    def get_extension(self, name: str) -> type:
+        """
+            获取扩展类，未导入时先导入
+        """
+        if name not in self.extensions:
+            if name not in self.registered:
+                raise ExtensionNotFoundError(self.module_name, name)
+            self.load_extension(name)
+        return self.extensions[name]
+
+    def items(self) -> Iterator[tuple[str, type]]:
+        """
+            遍历所有已注册的扩展，会导入全部扩展
+        """
+        for name in self.get_extension_list():
+            yield name, self.get_extension(name)
 
     def load_extension(self, name: str):
         module = importlib.import_module(f'.{name}', self.module_name)
@@ -58,24 +110,29 @@ class ExtensionManager(Loggable, SettingAccessable):
             raise ExtensionLoadError(
                 self.module_name, name, "Extension must inherit from base class.")
         self.extensions[name] = class_
+        self.update_manifest(name, class_)
         self.log_info(
             f"Module '{self.module_name}' load extension '{name}' successfully")
 
     def add_extension(self, name: str):
-        if name in self.extensions.keys():
+        if name in self.registered:
             return
 
         self.load_extension(name)
+        self.registered.append(name)
+        self.version += 1
 
         ext_list = self.get_setting("loaded_list")
         ext_list.append(name)
         self.set_setting("loaded_list", ext_list)
 
     def remove_extension(self, name: str):
-        if name not in self.extensions.keys():
+        if name not in self.registered:
             raise ExtensionNotFoundError(self.module_name, name)
 
-        del self.extensions[name]
+        self.registered.remove(name)
+        self.extensions.pop(name, None)
+        self.version += 1
         ext_list = self.get_setting("loaded_list")
         ext_list.remove(name)
         self.set_setting("loaded_list", ext_list)
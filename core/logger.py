@@ -1,16 +1,167 @@
+"""
+    日志
+
+    日志记录放入队列后立即返回，由后台线程格式化并输出，输出到终端不会阻塞调用者。
+    队列最多保存 `LOG_QUEUE_SIZE` 条记录，队列满时丢弃Debug与Info日志并计数，丢弃的条数由输出线程随后报告，
+    Error日志则等待队列有空位，不会丢失。
+    每个组件(Loggable的name)可以单独设置级别，未设置时使用 `LogGrade`
+"""
+
 from RainbowPrint import RainbowPrint as RP
-from datetime import datetime
-from threading import Lock
+from queue import Full, Queue
+from threading import Lock, Thread
+from time import localtime, monotonic, strftime, time
+from typing import Union
+import atexit
+import os
+import sys
+
+LOG_DEBUG = 0
+LOG_INFO = 1
+LOG_ERROR = 2
+
+LOG_LEVEL_NAMES = {
+    "debug": LOG_DEBUG,
+    "info": LOG_INFO,
+    "error": LOG_ERROR
+}
+
+LogGrade = LOG_INFO  # 默认的日志级别
+LOG_QUEUE_SIZE = 10000  # 日志队列的最大长度
+component_levels: dict[str, int] = {}
+
+
+def parse_log_level(level: Union[int, str]) -> int:
+    if isinstance(level, str):
+        return LOG_LEVEL_NAMES[level.lower()]
+    return level
+
+
+def set_log_level(level: Union[int, str], component: str = None) -> None:
+    """
+        设置日志级别，`component` 为 `None` 时设置默认级别
+    """
+    global LogGrade
+    if component is None:
+        LogGrade = parse_log_level(level)
+    else:
+        component_levels[component] = parse_log_level(level)
+
+
+def is_enabled(level: int, who: str) -> bool:
+    return level >= component_levels.get(who, LogGrade)
+
+
+class LogWorker:
+    """
+        后台输出日志的线程
+    """
+    queue: Queue
+    thread: Thread
+    start_lock: Lock
+    dropped: int  # 队列满时丢弃、还未报告的日志数
+    dropped_lock: Lock
+    last_second: int
+    last_time_text: str
+
+    # 级别 -> (名称, RainbowPrint中输出函数的名称)，输出时才查找，不存在时使用 `print`
+    PRINTERS = {
+        LOG_DEBUG: ("Debug", "rainbow_debug"),
+        LOG_INFO: ("Info", "rainbow_info"),
+        LOG_ERROR: ("Error", "rainbow_error")
+    }
+
+    def __init__(self) -> None:
+        self.last_second = -1
+        self.last_time_text = ""
+        self.reset()
 
-LogGrade = 1
+    def reset(self) -> None:
+        """
+            子进程中不存在父进程的输出线程，fork后重新创建队列，输出线程在第一次输出时启动
+        """
+        self.queue = Queue(LOG_QUEUE_SIZE)
+        self.thread = None
+        self.start_lock = Lock()
+        self.dropped = 0
+        self.dropped_lock = Lock()
 
+    def put(self, level: int, who: str, msg) -> None:
+        if self.thread is None:
+            with self.start_lock:
+                if self.thread is None:
+                    self.thread = Thread(
+                        target=self.run, name="Logger", daemon=True)
+                    self.thread.start()
+        record = (level, time(), who, msg)
+        if level >= LOG_ERROR:
+            self.queue.put(record)
+            return
+        try:
+            self.queue.put_nowait(record)
+        except Full:
+            with self.dropped_lock:
+                self.dropped += 1
 
-def make_msg(type_, who, msg) -> str:
-    t = datetime.strftime(datetime.now(), "%Y-%m-%d %H:%M:%S")
-    return f"{t} [{type_}] <{who}> : {msg}"
+    def format_time(self, t: float) -> str:
+        # 同一秒内的日志共用格式化后的时间
+        second = int(t)
+        if second != self.last_second:
+            self.last_second = second
+            self.last_time_text = strftime("%Y-%m-%d %H:%M:%S", localtime(t))
+        return self.last_time_text
 
+    def run(self) -> None:
+        while True:
+            level, t, who, msg = self.queue.get()
+            text = None
+            try:
+                type_, printer_name = LogWorker.PRINTERS[level]
+                text = f"{self.format_time(t)} [{type_}] <{who}> : {msg}"
+                getattr(RP, printer_name, print)(text)
+            except Exception as e:
+                # 输出失败时写到标准错误，不丢弃日志
+                try:
+                    if text is None:
+                        text = f"<{who}> : {msg!r}"
+                    sys.stderr.write(
+                        f"Logger: failed to print a log record:{e!r}\n{text}\n")
+                except Exception:
+                    pass
+            finally:
+                self.queue.task_done()
+            if self.dropped > 0:
+                self.report_dropped()
 
-log_lock = Lock()
+    def report_dropped(self) -> None:
+        with self.dropped_lock:
+            dropped, self.dropped = self.dropped, 0
+        if dropped == 0:
+            return
+        try:
+            sys.stderr.write(
+                f"Logger: the log queue was full, dropped {dropped} debug/info records.\n")
+        except Exception:
+            pass
+
+    def flush(self) -> None:
+        """
+            等待队列中的日志全部输出
+        """
+        if self.thread is not None:
+            self.queue.join()
+            if self.dropped > 0:
+                self.report_dropped()
+
+
+log_worker = LogWorker()
+atexit.register(log_worker.flush)
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=log_worker.reset)
+
+
+def flush_logs() -> None:
+    log_worker.flush()
 
 
 class Loggable:
@@ -23,33 +174,83 @@ class Loggable:
             self.name = self.__class__.__name__
         pass
 
+    def log(self, level: int, msg) -> None:
+        if is_enabled(level, self.name):
+            log_worker.put(level, self.name, msg)
+
     def log_debug(self, msg):
-        with log_lock:
-            RP.rainbow_debug(make_msg("Debug", self.name, msg))
+        self.log(LOG_DEBUG, msg)
 
     def log_info(self, msg):
-        with log_lock:
-            RP.rainbow_info(make_msg("Info", self.name, msg))
+        self.log(LOG_INFO, msg)
 
     def log_error(self, msg):
-        with log_lock:
-            RP.rainbow_error(make_msg("Error", self.name, msg))
-
+        self.log(LOG_ERROR, msg)
 
-class Logger:
-    name: str
 
+class Logger(Loggable):
     def __init__(self, name: str) -> None:
-        self.name = name
+        super().__init__(name)
 
-    def log_debug(self, msg):
-        with log_lock:
-            RP.rainbow_debug(make_msg("Debug", self.name, msg))
 
-    def log_info(self, msg):
-        with log_lock:
-            RP.rainbow_info(make_msg("Info", self.name, msg))
+class Progress:
+    """
+        进度汇总，把大量的单条消息合并为定期输出的一行进度
+        e.g:
+        ```
+            progress = Progress(self, "Book 'xxx'", total=1000)
+            progress.advance(1, len(data))  # 每完成一项调用一次
+            progress.finish()
+        ```
+        输出: `Book 'xxx' : 120/1000, 35.2 items/s, 1.20 MB/s, ETA 00:00:25`
+    """
+    logger: Loggable
+    title: str
+    total: int
+    unit: str
+    interval: float
+    count: int
+    bytes_count: int
+    start: float
+    last_report: float
 
-    def log_error(self, msg):
-        with log_lock:
-            RP.rainbow_error(make_msg("Error", self.name, msg))
+    def __init__(self, logger: Loggable, title: str, total: int = None, unit="items", interval: float = 2.0) -> None:
+        self.logger = logger
+        self.title = title
+        self.total = total
+        self.unit = unit
+        self.interval = interval
+        self.count = 0
+        self.bytes_count = 0
+        self.start = monotonic()
+        self.last_report = self.start
+
+    def advance(self, count: int = 1, bytes_count: int = 0) -> None:
+        self.count += count
+        self.bytes_count += bytes_count
+        now = monotonic()
+        if now - self.last_report >= self.interval:
+            self.last_report = now
+            self.logger.log_info(self.make_msg(now))
+
+    def make_msg(self, now: float) -> str:
+        elapsed = max(now - self.start, 1e-6)
+        speed = self.count / elapsed
+        msg = f"{self.title} : {self.count}"
+        if self.total is not None:
+            msg += f"/{self.total}"
+        msg += f", {speed:.1f} {self.unit}/s"
+        if self.bytes_count > 0:
+            msg += f", {self.bytes_count / elapsed / 1024 / 1024:.2f} MB/s"
+        if self.total is not None and speed > 0 and self.count < self.total:
+            eta = int((self.total - self.count) / speed)
+            msg += f", ETA {eta // 3600:02d}:{eta % 3600 // 60:02d}:{eta % 60:02d}"
+        return msg
+
+    def finish(self) -> None:
+        """
+            输出最终的统计
+        """
+        now = monotonic()
+        self.logger.log_info(
+            self.make_msg(now) + f", finished in {now - self.start:.2f}s")
@@ -1,27 +1,30 @@
 from datetime import datetime
 from functools import partial
-from concurrent.futures import ThreadPoolExecutor, Future
-from genericpath import isdir
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, Future, as_completed
 import logging
-import os
-import re
 from threading import Lock
-from os import path
-import importlib
-from time import sleep
-from typing import Union
-import aiofiles
+from time import perf_counter, sleep
+from typing import Iterable, Union
 
 from core.book_exporter import BookExpoter
 
-from .book import Book, Chapter
+from .book import Book, Chapter, ChapterList
 from .setting import SettingAccessable, SettingManager
 from .database import BookNotExistError, Database
+from .async_database import AsyncDatabase
+from .archive import LibraryDumper, LibraryLoader
+from .cleaner import ContentCleaner
+from .export_manifest import ExportManifest, export_book_incremental
+from .parallel_export import export_book_worker, init_export_worker
 from .spider import Spider
 from .proxy_provider import ProxyProvider
-from .logger import Loggable
+from .logger import Loggable, Progress, set_log_level
+from .profiler import stage
+from .scheduler import DEFAULT_LANE_WEIGHTS, LANE_BULK, LANE_CHECK, PriorityScheduler, default_lane, lane
 from .utils import *
 from .extension_manager import ExtensionManager
+from .router import UrlRouter
+from . import metrics
 
 CONFIG_FILE_NAME = "config.json"
 DEFAULT_DB_FILE = "books.db"
@@ -30,57 +33,175 @@ DEFAULT_DB_FILE = "books.db"
 class Manager(Loggable, SettingAccessable):
     setting_manager: SettingManager
     db: Database
+    async_db: AsyncDatabase
 
     spiders_manager: ExtensionManager
     proxy_providers_manager: ExtensionManager
     book_exporters_manager: ExtensionManager
+    router: UrlRouter
+    router_version: int
 
     max_retry: int
+    write_batch_size: int
+    incremental_export: bool
+    progress_interval: float
+    batch_concurrency: int
+    metrics_file: str
+    cleaners: dict[str, ContentCleaner]
+    schedulers: dict[str, PriorityScheduler]
 
     def __init__(self) -> None:
         self.setting_manager = SettingManager(CONFIG_FILE_NAME)
         SettingAccessable.__init__(self, self.setting_manager)
         Loggable.__init__(self)
+        self.setting_manager.flush_interval = self.get_setting(
+            "setting_flush_interval", 1.0)
 
         self.spiders_manager = ExtensionManager(
-            self.setting_manager, Spider, "spider")
+            self.setting_manager, Spider, "spider", ("hosts", "url_patterns"))
         self.proxy_providers_manager = ExtensionManager(
             self.setting_manager, ProxyProvider, "proxy_provider")
         self.book_exporters_manager = ExtensionManager(
             self.setting_manager, BookExpoter, "book_exporter")
         self.max_retry = self.get_setting("max_retry", 5)
-
-        self.db = Database()
+        self.write_batch_size = self.get_setting("write_batch_size", 50)
+        self.incremental_export = self.get_setting("incremental_export", True)
+        self.progress_interval = self.get_setting("progress_interval", 2.0)
+        # 批量获取时同时获取的书籍数
+        self.batch_concurrency = self.get_setting("batch_concurrency", 8)
+        # 关闭时以Prometheus文本格式写入指标的文件，为空时不写入
+        self.metrics_file = self.get_setting("metrics_file", "")
+        self.apply_log_setting()
+        self.cleaners = {}
+        self.schedulers = {}
+        self.router = None
+        self.router_version = -1
+
+        self.db = Database(
+            cached_statements=self.get_setting("cached_statements", 256),
+            fetch_size=self.get_setting("fetch_size", 64),
+            shards=self.get_setting("shards", 0))
         self.db.open(self.get_setting("database", DEFAULT_DB_FILE))
+        self.async_db = AsyncDatabase(self.db)
+
+        # 通过HTTP提供指标的端口，为0时不启动
+        metrics_port = self.get_setting("metrics_port", 0)
+        if metrics_port:
+            metrics.registry.start_http_server(metrics_port)
+            self.log_info(
+                f"Serving metrics on http://127.0.0.1:{metrics_port}/metrics")
 
     def close(self) -> None:
+        self.async_db.close()
         self.db.close()
+        if self.metrics_file:
+            metrics.registry.write_prometheus(self.metrics_file)
+        metrics.registry.stop_http_server()
+        self.setting_manager.flush()
+
+    def get_router(self) -> UrlRouter:
+        """
+            获取Url路由，Spider的注册或声明变化时重新建立
+        """
+        if self.router_version != self.spiders_manager.version:
+            router = UrlRouter()
+            for name in self.spiders_manager.get_extension_list():
+                info = self.spiders_manager.get_extension_info(name)
+                router.add(name, info["hosts"] or (),
+                           info["url_patterns"] or ())
+            self.router = router
+            self.router_version = self.spiders_manager.version
+        return self.router
+
+    def apply_log_setting(self) -> None:
+        """
+            应用日志级别设置。`log_level` 是默认级别，`log_levels` 是各个组件的级别，
+            级别可以是 debug/info/error
+        """
+        set_log_level(self.get_setting("log_level", "info"))
+        for component, level in self.get_setting("log_levels", {}).items():
+            set_log_level(level, component)
 
     def get_vaild_spiders(self, url: str, **params) -> list[str]:
         """
             根据url获取可以使用的Spider
         """
-        res = []
-        for k, v in self.spiders_manager.extensions.items():
-            if v.check_url(url):
-                res.append(k)
+        router = self.get_router()
+        res = list(router.route(url))
+        if len(res) == 0:
+            for name in router.fallback:
+                if self.spiders_manager.get_extension(name).check_url(url):
+                    res.append(name)
 
         return res
 
+    def select_spider(self, url: str, **params) -> Union[str, None]:
+        """
+            自动选择Spider，有多个可用时使用第一个，没有时返回 `None`
+        """
+        spiders = self.get_vaild_spiders(url, **params)
+        return spiders[0] if len(spiders) > 0 else None
+
+    def get_cleaner(self, spider: Spider) -> ContentCleaner:
+        """
+            获取Spider对应的章节清理器。规则由全局的 `clean_patterns` 与Spider的规则组成
+        """
+        if spider.name not in self.cleaners:
+            self.cleaners[spider.name] = ContentCleaner(
+                self.get_setting("clean_patterns", []) +
+                spider.get_clean_patterns(),
+                self.get_setting("normalize_whitespace", True))
+        return self.cleaners[spider.name]
+
+    def get_scheduler(self, spider: Spider) -> PriorityScheduler:
+        """
+            获取Spider对应的请求调度器，同一种Spider的所有实例共用一个，
+            因此交互请求、更新检查与整站爬取按通道竞争同一组名额
+        """
+        if spider.name not in self.schedulers:
+            self.schedulers[spider.name] = PriorityScheduler(
+                spider.get_setting("semaphore", 100),
+                spider.get_setting("lane_weights", DEFAULT_LANE_WEIGHTS))
+        return self.schedulers[spider.name]
+
+    def create_spider(self, spider_class: type) -> Spider:
+        """
+            创建Spider实例，并使用共享的调度器
+        """
+        spider: Spider = spider_class(self.setting_manager)
+        spider.scheduler = self.get_scheduler(spider)
+        return spider
+
     def get_thread_pool(self) -> ThreadPoolExecutor:
         return ThreadPoolExecutor(max_workers=self.max_threads_count)
 
     def is_book_need_update(self, book: Book) -> bool:
-        book_info = self.db.query_book_info(Source=book.source)
-        if len(book_info) == 0:
+        update = self.db.query_book_update(book.source)
+        if update is None:
             return True
-        if book_info[0].update < book.update or book.update == datetime(1970, 1, 1):
+        if update < book.update or book.update == datetime(1970, 1, 1):
             return True
         return False
 
     def update_setting(self, key: str, value) -> None:
         if key == "max_retry":
             self.max_retry = value
+        if key == "write_batch_size":
+            self.write_batch_size = value
+        if key == "incremental_export":
+            self.incremental_export = value
+        if key == "setting_flush_interval":
+            self.setting_manager.flush_interval = value
+        if key == "progress_interval":
+            self.progress_interval = value
+        if key == "batch_concurrency":
+            self.batch_concurrency = value
+        if key == "metrics_file":
+            self.metrics_file = value
+        if key in ("log_level", "log_levels"):
+            self.apply_log_setting()
+        if key in ("clean_patterns", "normalize_whitespace"):
+            self.cleaners = {}
 
     def update_book(self, book: Book) -> None:
         """
@@ -90,11 +211,7 @@ class Manager(Loggable, SettingAccessable):
             if self.db.is_book_exist(Source=book.source):
                 self.db.get_book_index(book)
                 self.db.update_book_all_info(book)
-                for chapter in book.chapters:
-                    if self.db.is_chapter_exist(chapter.book_index, chapter.chapter_index):
-                        self.db.update_chapter(chapter)
-                    else:
-                        self.db.insert_chapter(chapter)
+                self.db.upsert_chapters(book.chapters)
                 self.log_info(
                     f"Book '{book.title}' updated.index = {book.idx};")
 
@@ -107,54 +224,143 @@ class Manager(Loggable, SettingAccessable):
         """
             使用给定的Spide获取书籍
         """
-        url = convert_url(url)
-        spider = spider_class(self.setting_manager)
+        return get_async_result(self.async_get_book(url, spider_class, **params))
 
+    async def async_get_book(self, url: str, spider_class: type, **params) -> Union[Book, None]:
+        """
+            使用给定的Spide获取书籍，异步版本。
+            获取到的章节会分批写入数据库，写入与网络请求同时进行
+        """
+        spider = self.create_spider(spider_class)
+        try:
+            return await self.async_get_book_by_spider(url, spider, **params)
+        finally:
+            await spider.async_close()
+
+    async def async_get_book_by_spider(self, url: str, spider: Spider, **params) -> Union[Book, None]:
+        """
+            使用已创建的Spider获取书籍，不会关闭Spider。
+            请求按通道与同一种Spider的其他请求共享 `semaphore` 名额
+        """
+        url = convert_url(url)
+        start = perf_counter()
+        try:
+            return await self._async_get_book(url, spider, **params)
+        except Exception:
+            metrics.books.inc(1, "error")
+            raise
+        finally:
+            metrics.get_book_seconds.observe(perf_counter() - start)
+
+    async def _async_get_book(self, url: str, spider: Spider, **params) -> Union[Book, None]:
         book = Book(source=url, spider=spider.name)
 
-        _, menu_data = get_async_result(spider.get_book_info(book, **params))
+        book_info = None
+        if await self.async_db.is_book_exist(Source=url):
+            book_info = (await self.async_db.query_book_info(Source=url))[0]
+        validators = await self.async_db.query_validators(book.source)
+
+        # 库中的书籍先用Spider的探测检查是否更新，没有更新时不需要获取完整的书籍信息与封面
+        probe_data = None
+        if book_info is not None and book_info.update != datetime(1970, 1, 1):
+            update, probe_data = await spider.probe_book(book_info, validators, **params)
+            if update is None:
+                metrics.probes.inc(1, "unsupported")
+            elif update <= book_info.update:
+                metrics.probes.inc(1, "fresh")
+                await self.async_db.store_validators(validators)
+                self.log_info(f"Book {book_info.title} is already the latest.")
+                metrics.books.inc(1, "latest")
+                return book_info
+            else:
+                metrics.probes.inc(1, "stale")
+
+        _, menu_data = await spider.get_book_info(book, validators=validators, probe_data=probe_data, **params)
 
         self.log_info(
             f"Book info : Title = '{book.title}',Author='{book.author}'")
 
-        book_exist = False
+        fetched_chapters = set()
         # 若库中已存在并且是最新的，就跳过这本书，否则获取书籍id
-        if self.db.is_book_exist(Source=url):
-            book_info = self.db.query_book_info(Source=url)[0]
-            book_exist = True
+        if book_info is not None:
             if book_info.update != datetime(1970, 1, 1) and book_info.update >= book.update:
+                await self.async_db.store_validators(validators)
                 self.log_info(f"Book {book_info.title} is already the latest.")
+                metrics.books.inc(1, "latest")
                 return book_info
             book.idx = book_info.idx
-
-        menu = get_async_result(spider.get_book_menu(menu_data, **params))
-        self.log_info(f"Get chapter info successfully.")
-
+            if book.cover is None and book.cover_hash is None:
+                # Spider没有重新下载封面，沿用原来的封面
+                book.cover_hash = book_info.cover_hash
+                book.cover_format = book_info.cover_format
+            # 只记录已有内容的章节编号，不读取章节内容
+            for chapter_index, _, length, _ in await self.async_db.query_chapter_infos(book.idx):
+                if length:
+                    fetched_chapters.add(chapter_index)
+        else:
+            # 先以最旧的更新日期创建书籍，以便章节可以边获取边写入。
+            # 若中途失败，下次检查时会补全缺失的章节
+            update = book.update
+            book.update = datetime(1970, 1, 1)
+            await self.async_db.create_book(book)
+            book.update = update
+            self.log_info(f"Book '{book.title}' created.index={book.idx};")
+
+        menu = await spider.get_book_menu(menu_data, **params)
+        self.log_info("Get chapter info successfully.")
+
+        cleaner = self.get_cleaner(spider)
+        removed_bytes = cleaner.removed_bytes
+
+        # 每个章节的结果合并为定期输出的进度
+        progress = Progress(self, f"Book '{book.title}'",
+                            unit="chapters", interval=self.progress_interval)
         failed_chapters = []
-        chapter_list = []
+        chapter_list = ChapterList()
         chapter_count = 0
-        loop = asyncio.get_event_loop()
         tasks = []
+        pending_chapters = []
+
+        async def store_chapter(chapter: Chapter):
+            nonlocal pending_chapters
+            pending_chapters.append(chapter)
+            if len(pending_chapters) >= self.write_batch_size:
+                batch, pending_chapters = pending_chapters, []
+                with stage("store"):
+                    await self.async_db.upsert_chapters(batch)
+                # 已写入数据库的章节不再占用内存，需要时再从数据库加载
+                for i in batch:
+                    i.content_loader = self.db.load_chapter_content
+                    i.release_content()
 
         async def get_chapter_content_warpper(chapter: Chapter, chapter_data):
             # 使用这个warpper来捕获异常
             try:
-                return await spider.get_chapter_content(chapter, chapter_data, **params)
+                await spider.get_chapter_content(chapter, chapter_data, **params)
             except Exception as e:
                 self.log_error(f"Get chapter '{chapter.title}' error:{e}")
                 logging.exception(e)
                 failed_chapters.append((chapter, chapter_data))
+            else:
+                with stage("clean"):
+                    cleaner.clean_chapter(chapter)
+                size = len(chapter.content.encode()) if chapter.content else 0
+                progress.advance(1, size)
+                metrics.chapters.inc()
+                metrics.chapter_bytes.inc(size)
+                await store_chapter(chapter)
 
         for idx, chapter_data in menu:
             chapter_count += 1
-            if book_exist and idx < book_info.chapter_count:
+            if idx in fetched_chapters:
                 continue
             chapter = book.make_chapter(idx)
             chapter_list.append(chapter)
 
             tasks.append(get_chapter_content_warpper(chapter, chapter_data))
 
-        loop.run_until_complete(asyncio.gather(*tasks))
+        progress.total = len(tasks)
+        await asyncio.gather(*tasks)
 
         for _ in range(self.max_retry):
             t = failed_chapters
@@ -164,22 +370,111 @@ class Manager(Loggable, SettingAccessable):
             for chapter, chapter_data in t:
                 tasks.append(get_chapter_content_warpper(
                     chapter, chapter_data))
-            loop.run_until_complete(asyncio.gather(*tasks))
+            await asyncio.gather(*tasks)
 
             if len(failed_chapters) > 0:
                 continue
             break
         else:
+            with stage("store"):
+                await self.async_db.upsert_chapters(pending_chapters)
+            progress.finish()
+            metrics.books.inc(1, "failed")
             return None
 
+        with stage("store"):
+            await self.async_db.upsert_chapters(pending_chapters)
+        progress.finish()
+
         chapter_list.sort()
         book.chapters = chapter_list
         book.chapter_count = chapter_count
 
-        self.update_book(book)
+        with stage("store"):
+            await self.async_db.update_book_all_info(book)
+            # 书籍完整更新后才保存验证信息，更新失败时下次检查不会因为页面未变化而跳过
+            await self.async_db.store_validators(validators)
+        metrics.books.inc(1, "updated")
+        self.log_info(
+            f"Book '{book.title}' updated.index = {book.idx};removed {cleaner.removed_bytes - removed_bytes} bytes of ads and whitespace.")
 
         return book
 
+    def get_books(self, urls: Iterable[str], **params) -> tuple[int, list[str]]:
+        """
+            批量获取书籍，返回 (成功数, 失败的Url)。请求使用整站爬取的通道
+        """
+        with lane(LANE_BULK):
+            return get_async_result(self.async_get_books(urls, **params))
+
+    async def async_get_books(self, urls: Iterable[str], spiders: dict[str, Spider] = None, **params) -> tuple[int, list[str]]:
+        """
+            批量获取书籍，根据Url自动选择Spider，返回 (成功数, 失败的Url)。
+            最多同时获取 `batch_concurrency` 本书，同一种Spider共用一个实例，
+            该站点的请求总数仍受Spider的 `semaphore` 限制，名额按当前的通道分配。
+            传入 `spiders` 时从中取用与保存Spider实例，结束后不会关闭
+        """
+        return await self.async_fetch_books(
+            ((url, self.select_spider(url, **params)) for url in urls), spiders, **params)
+
+    async def async_check_books(self, books: Iterable[Book], spiders: dict[str, Spider] = None, **params) -> tuple[int, list[str]]:
+        """
+            批量检查书籍的更新，使用书籍记录的Spider，返回 (成功数, 失败的Url)。
+            调用者已指定通道时使用调用者的通道，否则使用 `LANE_CHECK`
+        """
+        with default_lane(LANE_CHECK):
+            return await self.async_fetch_books(
+                ((book.source, book.spider) for book in books), spiders, **params)
+
+    async def async_fetch_books(self, items: Iterable[tuple[str, str]], spiders: dict[str, Spider] = None, **params) -> tuple[int, list[str]]:
+        """
+            并发获取 `(Url, Spider名称)` 列表中的书籍，见 `async_get_books`
+        """
+        items = iter(items)
+        close_spiders = spiders is None
+        if spiders is None:
+            spiders = {}
+        succeeded = 0
+        failed = []
+        progress = Progress(self, "Batch", unit="books",
+                            interval=self.progress_interval)
+
+        def get_spider(name: str) -> Spider:
+            if name not in spiders:
+                spiders[name] = self.create_spider(
+                    self.spiders_manager.get_extension(name))
+            return spiders[name]
+
+        async def worker():
+            nonlocal succeeded
+            # 所有worker共用一个迭代器，Url列表不需要全部读入内存
+            for url, name in items:
+                if name is None:
+                    self.log_error(f"No spider match the url '{url}'.")
+                    failed.append(url)
+                    progress.advance()
+                    continue
+                try:
+                    book = await self.async_get_book_by_spider(url, get_spider(name), **params)
+                except Exception as e:
+                    self.log_error(f"Get book '{url}' error:{e}")
+                    logging.exception(e)
+                    book = None
+                if book is None:
+                    failed.append(url)
+                else:
+                    succeeded += 1
+                progress.advance()
+
+        try:
+            await asyncio.gather(*[worker() for _ in range(max(1, self.batch_concurrency))])
+        finally:
+            if close_spiders:
+                for spider in spiders.values():
+                    await spider.async_close()
+        progress.finish()
+        return succeeded, failed
+
     def search_book(self, keyword: str, author="", style="", **params) -> list[Book]:
         book_list = []
         book_list_lock = Lock()
@@ -205,16 +500,30 @@ class Manager(Loggable, SettingAccessable):
 
         return book_list
 
-    def get_all_book(self, spider: Spider, **params) -> list[int]:
+    def get_all_book(self, spider_class: type, **params) -> list[int]:
+        """
+            获取站点的所有书籍，请求使用整站爬取的通道。
+            所有书籍共用一个Spider实例，与同时进行的其他请求共享该Spider的名额
+        """
+        spider = self.create_spider(spider_class)
+        try:
+            with lane(LANE_BULK):
+                return self._get_all_book(spider, **params)
+        finally:
+            spider.close()
+
+    def _get_all_book(self, spider: Spider, **params) -> list[int]:
         res = []
         for book in spider.get_all_book(**params):
             for _ in range(self.max_retry):
                 try:
                     if self.is_book_need_update(book):
-                        t = self.get_book(book.source, spider, **params)
+                        t = get_async_result(self.async_get_book_by_spider(
+                            book.source, spider, **params))
                     else:
                         self.log_info(
                             f"Book '{book.title}' is already the lastest.")
+                        t = None
                 except Exception as e:
                     self.log_error(
                         f"Get book '{book.title}' source='{book.source}' error:{e}")
@@ -231,39 +540,82 @@ class Manager(Loggable, SettingAccessable):
         books = self.db.query_book_info(limit, offset, *params, **kparams)
         return books
 
+    def list_books(self, columns, order_by="Id", after: tuple = None, limit=20, descending=False, *params, **kparams) -> tuple[list[tuple], tuple]:
+        """
+            分页列出书籍的部分信息，见 `Database.list_books`
+        """
+        return self.db.list_books(columns, order_by, after, limit, descending, *params, **kparams)
+
+    def dump_library(self, path: str, *params, **kparams) -> int:
+        """
+            把满足条件的书籍导出到归档文件
+        """
+        return LibraryDumper(self.db).dump(path, *params, **kparams)
+
+    def load_library(self, path: str) -> int:
+        """
+            从归档文件批量导入书籍
+        """
+        loader = LibraryLoader(
+            self.db,
+            self.get_setting("load_batch_size", 1000),
+            self.get_setting("load_transaction_size", 100000))
+        return loader.load(path)
+
     def delete_book(self, book_index: int) -> None:
         with self.db.transaction:
             self.db.delete_book(book_index)
 
-    def check_book(self, book_index: int, **params) -> None:
+    def check_book(self, book_index: int, **params) -> bool:
+        """
+            检查书籍的更新，返回是否成功
+        """
         self.db.check_book_exist(Id=book_index)
         book_old = self.db.query_book_info(Id=book_index)[0]
 
-        spider = self.spiders_manager.extensions[book_old.spider]
+        spider = self.spiders_manager.get_extension(book_old.spider)
 
-        self.get_book(book_old.source, spider, **params)
+        with lane(LANE_CHECK):
+            if self.get_book(book_old.source, spider, **params) is None:
+                self.log_error(f"Check book '{book_old.title}' failed.")
+                return False
         self.log_info(f"Check book'{book_old.title}' successfully.")
+        return True
 
-    def check_all_book(self, **params) -> None:
+    def check_all_book(self, **params) -> bool:
+        """
+            检查所有未完结书籍的更新，全部成功时返回True
+        """
+        with lane(LANE_CHECK):
+            return self._check_all_book(**params)
+
+    def _check_all_book(self, **params) -> bool:
         book_list = self.db.query_book_info(Status=0)
+        failed = 0
         for i in book_list:
-            spider = self.spiders_manager.extensions[i.spider]
+            spider = self.spiders_manager.get_extension(i.spider)
             self.log_info(f"Checking book '{i.title}'...")
 
             for _ in range(self.max_retry):
                 try:
-                    self.get_book(i.source, spider, **params)
+                    if self.get_book(i.source, spider, **params) is not None:
+                        break
                 except Exception as e:
                     self.log_error(f"Check book {i.title} error:{e}")
                     logging.exception(e)
-                    continue
-                else:
-                    break
+            else:
+                failed += 1
+        if failed > 0:
+            self.log_error(
+                f"Check all books finished, {failed} of {len(book_list)} failed.")
+            return False
         self.log_info("Check all books successfully")
+        return True
 
-    def export_book(self, book: Book, book_exporter_class: type, output: str):
+    def export_book(self, book: Book, book_exporter_class: type, output: str) -> str:
         exporter: BookExpoter = book_exporter_class(self.setting_manager)
-        get_async_result(exporter.export_book(book, output))
+        with stage("export"):
+            return get_async_result(exporter.export_book(book, output))
 
     def export_books(self, books: list[Book], book_exporter_class: type, output: str):
         exporter: BookExpoter = book_exporter_class(self.setting_manager)
@@ -275,12 +627,86 @@ class Manager(Loggable, SettingAccessable):
         loop = asyncio.get_event_loop()
         loop.run_until_complete(asyncio.gather(*tasks))
 
+    def create_export_pool(self, book_exporter_class: type, workers: int = 0) -> ProcessPoolExecutor:
+        """
+            创建导出用的进程池，每个工作进程使用自己的只读数据库连接与导出器，
+            由 `export_book_worker` 导出书籍。`workers` 为0时使用CPU核心数
+        """
+        # 先在主进程中创建一次导出器并写入设置，使工作进程读取到最新的设置，
+        # 并避免多个工作进程同时写入默认设置
+        book_exporter_class(self.setting_manager)
+        self.setting_manager.flush()
+
+        return ProcessPoolExecutor(
+            max_workers=workers or None,
+            initializer=init_export_worker,
+            initargs=(self.get_setting("database", DEFAULT_DB_FILE), self.setting_manager.file_path,
+                      book_exporter_class, self.db.fetch_size))
+
+    def export_library(self, book_exporter_class: type, output: str, workers: int = 0, *params, **kparams) -> tuple[int, int]:
+        """
+            使用进程池导出满足条件的书籍，返回 (成功数, 失败数)。
+            每个工作进程使用自己的只读数据库连接，`workers` 为0时使用CPU核心数。
+            开启 `incremental_export` 时根据导出清单跳过未变化的书籍
+        """
+        book_ids = []
+        after = None
+        while True:
+            rows, after = self.db.list_books(
+                ("Id",), "Id", after, 1000, False, *params, **kparams)
+            book_ids.extend(i[0] for i in rows)
+            if after is None:
+                break
+
+        total = len(book_ids)
+        succeeded = 0
+        failed = 0
+        exporter_name = book_exporter_class.__name__
+        manifest = ExportManifest(output) if self.incremental_export else None
+        start = perf_counter()
+        self.log_info(f"Exporting {total} books...")
+
+        with self.create_export_pool(book_exporter_class, workers) as pool:
+            tasks = [pool.submit(export_book_worker, i, output,
+                                 manifest and manifest.get(exporter_name, i))
+                     for i in book_ids]
+            try:
+                for n, task in enumerate(as_completed(tasks), 1):
+                    book_index, title, seconds, status, record, error = task.result()
+                    if error is None:
+                        succeeded += 1
+                        self.log_info(
+                            f"[{n}/{total}] Book '{title}' index={book_index} {status} in {seconds:.2f}s.")
+                        if manifest is not None:
+                            manifest.set(exporter_name, record)
+                    else:
+                        failed += 1
+                        self.log_error(
+                            f"[{n}/{total}] Export book '{title}' index={book_index} error:{error}")
+            finally:
+                if manifest is not None:
+                    manifest.save()
+
+        self.log_info(
+            f"Exported {succeeded} books, {failed} failed in {perf_counter() - start:.2f}s.")
+        return succeeded, failed
+
     def export_book_by_id(self, id: int, book_exporter_class: type, output: str):
         res = self.db.query_book_info(Id=id)
-        if len(res) < 0:
+        if len(res) == 0:
             raise BookNotExistError(Id=id)
 
         book = res[0]
-        book.chapters = self.db.query_all_chapters(id)
-        book.chapter_count = len(book.chapters)
+        if self.incremental_export:
+            manifest = ExportManifest(output)
+            exporter: BookExpoter = book_exporter_class(self.setting_manager)
+            status, record = export_book_incremental(
+                self.db, exporter, book, output, manifest.get(book_exporter_class.__name__, id))
+            manifest.set(book_exporter_class.__name__, record)
+            manifest.save()
+            self.log_info(f"Book '{book.title}' {status}.")
+            return
+
+        # 章节由游标逐个读取，导出器不会一次持有整本书
+        book.chapters = self.db.iter_chapters(id)
         self.export_book(book, book_exporter_class, output)
@@ -0,0 +1,323 @@
+"""
+    运行指标
+
+    计数器与直方图都保存在内存中，记录一次只需要一次字典查找与加法。
+    指标可以通过 `stats` 命令查看，也可以输出为Prometheus的文本格式，写入文件或通过HTTP提供
+    e.g:
+    ```
+        metrics.http_requests.inc(1, "www.example.com", "GET")
+        metrics.request_seconds.observe(0.12, "www.example.com")
+    ```
+"""
+
+from bisect import bisect_left
+from functools import wraps
+from inspect import iscoroutinefunction
+import os
+import tempfile
+from threading import Lock, Thread
+from time import perf_counter, time
+
+# 默认的直方图分桶(秒)
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25,
+                   0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def escape_label_value(value) -> str:
+    """
+        按Prometheus文本格式转义标签值中的反斜杠、双引号与换行
+    """
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_labels(labelnames: tuple[str], labels: tuple, extra: str = "") -> str:
+    items = [f'{k}="{escape_label_value(v)}"' for k, v in zip(labelnames, labels)]
+    if extra:
+        items.append(extra)
+    if len(items) == 0:
+        return ""
+    return "{" + ",".join(items) + "}"
+
+
+class Counter:
+    """
+        只增不减的计数器，按标签分别计数
+    """
+    name: str
+    help: str
+    labelnames: tuple[str]
+    values: dict[tuple, float]
+    lock: Lock
+
+    def __init__(self, name: str, help: str, labelnames: tuple[str] = ()) -> None:
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.values = {}
+        self.lock = Lock()
+
+    def inc(self, amount: float = 1, *labels) -> None:
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def get(self, *labels) -> float:
+        return self.values.get(labels, 0)
+
+    def reset(self) -> None:
+        with self.lock:
+            self.values = {}
+
+    def snapshot(self) -> list[tuple[tuple, float]]:
+        with self.lock:
+            return sorted(self.values.items())
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}",
+                 f"# TYPE {self.name} counter"]
+        for labels, value in self.snapshot():
+            lines.append(
+                f"{self.name}{format_labels(self.labelnames, labels)} {value}")
+        return lines
+
+    def summary(self) -> list[tuple[str, str, str]]:
+        return [(self.name, format_labels(self.labelnames, labels), f"{value:g}")
+                for labels, value in self.snapshot()]
+
+
+class Histogram:
+    """
+        直方图，记录值的分布，用于延迟等指标
+    """
+    name: str
+    help: str
+    labelnames: tuple[str]
+    buckets: tuple[float]
+    values: dict[tuple, list]  # 标签 -> [各个分桶的计数..., 总和, 总数]
+    lock: Lock
+
+    def __init__(self, name: str, help: str, labelnames: tuple[str] = (), buckets: tuple[float] = DEFAULT_BUCKETS) -> None:
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.buckets = tuple(sorted(buckets))
+        self.values = {}
+        self.lock = Lock()
+
+    def observe(self, value: float, *labels) -> None:
+        idx = bisect_left(self.buckets, value)
+        with self.lock:
+            data = self.values.get(labels)
+            if data is None:
+                data = self.values[labels] = [0] * (len(self.buckets) + 3)
+            data[idx] += 1
+            data[-2] += value
+            data[-1] += 1
+
+    def time(self, *labels):
+        """
+            记录函数用时的装饰器，支持普通函数与协程函数
+        """
+        def decorator(func):
+            if iscoroutinefunction(func):
+                @wraps(func)
+                async def async_wrapper(*args, **kwargs):
+                    start = perf_counter()
+                    try:
+                        return await func(*args, **kwargs)
+                    finally:
+                        self.observe(perf_counter() - start, *labels)
+                return async_wrapper
+
+            @wraps(func)
+            def wrapper(*args, **kwargs):
+                start = perf_counter()
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    self.observe(perf_counter() - start, *labels)
+            return wrapper
+        return decorator
+
+    def reset(self) -> None:
+        with self.lock:
+            self.values = {}
+
+    def snapshot(self) -> list[tuple[tuple, list]]:
+        with self.lock:
+            return sorted((k, list(v)) for k, v in self.values.items())
+
+    def quantile(self, data: list, q: float) -> float:
+        """
+            由分桶估计分位数，返回所在分桶的上界
+        """
+        target = data[-1] * q
+        cumulative = 0
+        for bound, count in zip(self.buckets, data):
+            cumulative += count
+            if cumulative >= target:
+                return bound
+        return float("inf")
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}",
+                 f"# TYPE {self.name} histogram"]
+        for labels, data in self.snapshot():
+            cumulative = 0
+            for bound, count in zip(self.buckets, data):
+                cumulative += count
+                bucket_labels = format_labels(
+                    self.labelnames, labels, f'le="{bound}"')
+                lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+            bucket_labels = format_labels(self.labelnames, labels, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{bucket_labels} {data[-1]}")
+            lines.append(
+                f"{self.name}_sum{format_labels(self.labelnames, labels)} {data[-2]}")
+            lines.append(
+                f"{self.name}_count{format_labels(self.labelnames, labels)} {data[-1]}")
+        return lines
+
+    def summary(self) -> list[tuple[str, str, str]]:
+        res = []
+        for labels, data in self.snapshot():
+            res.append((self.name, format_labels(self.labelnames, labels),
+                        f"count={data[-1]} avg={data[-2] / data[-1]:.3f} "
+                        f"p50<={self.quantile(data, 0.5)} p95<={self.quantile(data, 0.95)}"))
+        return res
+
+
+class MetricsRegistry:
+    """
+        指标的集合
+    """
+    metrics: list
+    start_time: float
+    server: object
+
+    def __init__(self) -> None:
+        self.metrics = []
+        self.start_time = time()
+        self.server = None
+
+    def counter(self, name: str, help: str, labelnames: tuple[str] = ()) -> Counter:
+        metric = Counter(name, help, labelnames)
+        self.metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, help: str, labelnames: tuple[str] = (), buckets: tuple[float] = DEFAULT_BUCKETS) -> Histogram:
+        metric = Histogram(name, help, labelnames, buckets)
+        self.metrics.append(metric)
+        return metric
+
+    def reset(self) -> None:
+        for i in self.metrics:
+            i.reset()
+        self.start_time = time()
+
+    def summary(self) -> list[tuple[str, str, str]]:
+        """
+            返回 (名称, 标签, 值) 的列表，用于在命令行中显示
+        """
+        res = []
+        for i in self.metrics:
+            res.extend(i.summary())
+        return res
+
+    def render_prometheus(self) -> str:
+        lines = []
+        for i in self.metrics:
+            lines.extend(i.render())
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path: str) -> None:
+        """
+            以Prometheus文本格式写入文件(可用于node_exporter的textfile收集器)，先写临时文件再替换
+        """
+        directory = os.path.dirname(os.path.abspath(path))
+        fd, temp_path = tempfile.mkstemp(
+            prefix=os.path.basename(path), dir=directory)
+        try:
+            with os.fdopen(fd, "w") as f:
+                f.write(self.render_prometheus())
+            os.replace(temp_path, path)
+        except BaseException:
+            os.remove(temp_path)
+            raise
+
+    def start_http_server(self, port: int, host: str = "127.0.0.1") -> None:
+        """
+            在后台线程中启动HTTP服务，通过 `/metrics` 提供指标
+        """
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+        registry = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path != "/metrics":
+                    self.send_error(404)
+                    return
+                data = registry.render_prometheus().encode()
+                self.send_response(200)
+                self.send_header(
+                    "Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), MetricsHandler)
+        Thread(target=self.server.serve_forever,
+               name="Metrics", daemon=True).start()
+
+    def stop_http_server(self) -> None:
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+
+registry = MetricsRegistry()
+
+# 网络请求
+http_requests = registry.counter(
+    "bookspider_requests_total", "Number of successful HTTP requests.", ("host", "method"))
+request_seconds = registry.histogram(
+    "bookspider_request_seconds", "HTTP request latency in seconds.", ("host",))
+response_bytes = registry.counter(
+    "bookspider_response_bytes_total", "Bytes of HTTP response bodies read.", ("host",))
+retries = registry.counter(
+    "bookspider_retries_total", "Number of failed HTTP attempts that were retried.", ("host", "method"))
+max_retries_errors = registry.counter(
+    "bookspider_max_retries_errors_total", "Number of requests that exceeded max_retry.", ("method",))
+decode_fallbacks = registry.counter(
+    "bookspider_decode_fallbacks_total", "Number of responses that needed charset detection.", ("host",))
+conditional_requests = registry.counter(
+    "bookspider_conditional_requests_total", "Conditional GET requests, by result.", ("result",))
+scheduler_wait_seconds = registry.histogram(
+    "bookspider_scheduler_wait_seconds", "Time requests waited for a scheduler slot, by priority lane.", ("lane",))
+
+# 数据库
+db_write_seconds = registry.histogram(
+    "bookspider_db_write_seconds", "Database write latency in seconds.", ("operation",))
+db_rows_written = registry.counter(
+    "bookspider_db_rows_written_total", "Number of rows written to the database.", ("operation",))
+
+# 书籍
+books = registry.counter(
+    "bookspider_books_total", "Number of books fetched, by result.", ("result",))
+probes = registry.counter(
+    "bookspider_probes_total", "Freshness probes before get_book_info, by result.", ("result",))
+get_book_seconds = registry.histogram(
+    "bookspider_get_book_seconds", "Time to fetch a whole book in seconds.", (),
+    (1, 5, 10, 30, 60, 120, 300, 600, 1800, 3600))
+chapters = registry.counter(
+    "bookspider_chapters_total", "Number of chapters fetched.")
+chapter_bytes = registry.counter(
+    "bookspider_chapter_bytes_total", "Bytes of chapter content fetched(UTF-8, after cleaning).")
+
+# 阅读服务
+reader_requests = registry.counter(
+    "bookspider_reader_requests_total", "Number of reader server responses, by status.", ("status",))
+reader_cache = registry.counter(
+    "bookspider_reader_cache_total", "Reader cache lookups, by result.", ("result",))
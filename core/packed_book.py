@@ -0,0 +1,173 @@
+"""
+    可随机访问的单文件书籍格式(.bpk)
+
+    文件结构:
+    ```
+        文件头 | 章节数据 ... | 封面 | 书籍信息(JSON) | 章节索引
+    ```
+    文件头记录章节数、索引与书籍信息的位置。索引按 `ChapterId` 排序，每项长度固定，
+    记录章节编号、数据的偏移、保存长度与原始长度。
+    章节数据为 `标题\\n内容` 的UTF-8编码，设置了 `FLAG_ZLIB` 时每个章节单独压缩。
+    导出时章节是流式写入的，章节数在写完之前未知，因此索引位于文件末尾，写完后再回填文件头。
+"""
+
+import json
+import mmap
+import struct
+from typing import Iterator, Union
+import zlib
+
+from .book import Book, Chapter
+
+PACK_MAGIC = b"BSPK"
+PACK_VERSION = 1
+
+FLAG_ZLIB = 1
+
+# magic, version, flags, chapter_count, index_offset, meta_offset, meta_length
+HEADER = struct.Struct("<4sHHIQQI")
+# chapter_index, offset, length, raw_length
+INDEX_ENTRY = struct.Struct("<IQII")
+
+
+class PackFormatError(Exception):
+    path: str
+
+    def __init__(self, path: str, *args: object) -> None:
+        self.path = path
+        super().__init__(path, *args)
+
+    def __str__(self) -> str:
+        return f"'{self.path}' is not a packed book file"
+
+
+def encode_chapter(chapter: Chapter, flags: int, level: int = 6) -> tuple[bytes, int]:
+    """
+        编码章节，返回 (保存的数据, 原始长度)
+    """
+    data = f"{chapter.title}\n{chapter.content or ''}".encode("utf-8")
+    if flags & FLAG_ZLIB:
+        return zlib.compress(data, level), len(data)
+    return data, len(data)
+
+
+class PackedBook:
+    """
+        读取 .bpk 文件
+
+        文件通过mmap映射到内存，读取第N个章节只需要解析文件头、一个索引项与该章节的数据。
+        e.g:
+        ```
+            with PackedBook("book.bpk") as book:
+                chapter = book.get_chapter(10)
+                chapter = book.find_chapter(chapter_index)
+        ```
+    """
+    path: str
+    file: object
+    map: mmap.mmap
+    flags: int
+    chapter_count: int
+    index_offset: int
+    meta_offset: int
+    meta_length: int
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.file = open(path, "rb")
+        try:
+            self.map = mmap.mmap(self.file.fileno(), 0,
+                                 access=mmap.ACCESS_READ)
+        except ValueError:
+            # 空文件不能映射
+            self.file.close()
+            raise PackFormatError(path)
+
+        if len(self.map) < HEADER.size:
+            self.close()
+            raise PackFormatError(path)
+        magic, version, self.flags, self.chapter_count, self.index_offset, self.meta_offset, self.meta_length = HEADER.unpack_from(
+            self.map, 0)
+        if magic != PACK_MAGIC or version != PACK_VERSION:
+            self.close()
+            raise PackFormatError(path)
+
+    def __enter__(self) -> "PackedBook":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self.map.close()
+        self.file.close()
+
+    def __len__(self) -> int:
+        return self.chapter_count
+
+    def get_index_entry(self, n: int) -> tuple[int, int, int, int]:
+        if n < 0:
+            n += self.chapter_count
+        if n < 0 or n >= self.chapter_count:
+            raise IndexError("chapter index out of range")
+        return INDEX_ENTRY.unpack_from(self.map, self.index_offset + n * INDEX_ENTRY.size)
+
+    def chapter_index_at(self, n: int) -> int:
+        return self.get_index_entry(n)[0]
+
+    def get_chapter(self, n: int) -> Chapter:
+        """
+            读取第 `n` 个章节(从0开始)
+        """
+        chapter_index, offset, length, _ = self.get_index_entry(n)
+        data = self.map[offset:offset + length]
+        if self.flags & FLAG_ZLIB:
+            data = zlib.decompress(data)
+        title, _, content = data.decode("utf-8").partition("\n")
+        return Chapter(None, chapter_index, title, content)
+
+    def find_chapter(self, chapter_index: int) -> Union[Chapter, None]:
+        """
+            按 `ChapterId` 查找章节，不存在时返回 `None`
+        """
+        # 二分查找索引，只解析被访问的索引项
+        low, high = 0, self.chapter_count
+        while low < high:
+            mid = (low + high) // 2
+            if self.chapter_index_at(mid) < chapter_index:
+                low = mid + 1
+            else:
+                high = mid
+        if low < self.chapter_count and self.chapter_index_at(low) == chapter_index:
+            return self.get_chapter(low)
+        return None
+
+    def __iter__(self) -> Iterator[Chapter]:
+        for i in range(self.chapter_count):
+            yield self.get_chapter(i)
+
+    def get_book_info(self) -> Book:
+        """
+            读取书籍信息，不包括章节。封面在访问 `book.cover` 时才读取
+        """
+        meta = json.loads(
+            self.map[self.meta_offset:self.meta_offset + self.meta_length].decode("utf-8"))
+        book = Book(
+            idx=meta["idx"],
+            title=meta["title"],
+            author=meta["author"],
+            source=meta["source"],
+            spider=meta["spider"],
+            desc=meta["desc"],
+            style=meta["style"],
+            chapter_count=meta["chapter_count"],
+            cover_format=meta["cover_format"],
+            status=meta["status"],
+            update=meta["update"],
+            publish=meta["publish"]
+        )
+        if meta["cover"] is not None:
+            offset, length = meta["cover"]
+            book.cover_hash = ""
+            book.cover_loader = lambda _: self.map[offset:offset + length]
+        return book
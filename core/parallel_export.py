@@ -0,0 +1,48 @@
+"""
+    多进程导出书库
+
+    每个工作进程在初始化时以只读方式打开自己的数据库连接并创建导出器，
+    之后逐本导出书籍。导出器的CPU工作(生成HTML、压缩等)分布在多个核心上。
+    导出清单只由主进程读写，工作进程返回新的导出记录。
+"""
+
+import asyncio
+from time import perf_counter
+
+from .book_exporter import BookExpoter
+from .database import Database
+from .export_manifest import ExportRecord, export_book_incremental
+from .setting import SettingManager
+
+# 工作进程内的状态，由 `init_export_worker` 初始化
+_db: Database = None
+_exporter: BookExpoter = None
+
+
+def init_export_worker(db_file_path: str, config_file_path: str, exporter_class: type, fetch_size: int = 64) -> None:
+    """
+        工作进程的初始化函数
+    """
+    global _db, _exporter
+    # fork出的进程会继承父进程(e.g: 常驻进程)正在运行的事件循环，使用新的事件循环
+    asyncio.set_event_loop(asyncio.new_event_loop())
+    _db = Database(fetch_size=fetch_size, read_only=True)
+    _db.open(db_file_path)
+    _exporter = exporter_class(SettingManager(config_file_path))
+
+
+def export_book_worker(book_index: int, output: str, record: ExportRecord = None) -> tuple[int, str, float, str, ExportRecord, str]:
+    """
+        在工作进程中增量导出一本书，返回 (书籍编号, 书名, 用时, 状态, 新的导出记录, 错误信息)。
+        导出失败时错误信息不为 `None`
+    """
+    start = perf_counter()
+    title = ""
+    try:
+        book = _db.query_book_info(Id=book_index)[0]
+        title = book.title
+        status, record = export_book_incremental(
+            _db, _exporter, book, output, record)
+    except Exception as e:
+        return book_index, title, perf_counter() - start, "failed", record, f"{e.__class__.__name__}: {e}"
+    return book_index, title, perf_counter() - start, status, record, None
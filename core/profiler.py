@@ -0,0 +1,83 @@
+"""
+    分阶段计时
+
+    爬取与导出的各个阶段(fetch/decode/parse/clean/store/export)用 `stage` 包裹，
+    由 `profile` 命令开启后统计每个阶段的调用次数与用时。未开启时 `stage` 返回空的上下文管理器，几乎没有开销。
+    e.g:
+    ```
+        with stage("parse"):
+            html = etree.HTML(text)
+    ```
+    协程并发执行时，同一阶段的用时会重叠累加，总和可能超过实际经过的时间
+"""
+
+from contextlib import nullcontext
+from threading import Lock
+from time import perf_counter
+
+# 不计时时使用的上下文管理器
+NULL_STAGE = nullcontext()
+
+
+class StageTimer:
+    __slots__ = ("profiler", "name", "start")
+
+    def __init__(self, profiler: "StageProfiler", name: str) -> None:
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.start = perf_counter()
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.profiler.record(self.name, perf_counter() - self.start)
+
+
+class StageProfiler:
+    enabled: bool
+    stages: dict[str, list]  # 阶段 -> [调用次数, 总用时, 最长用时]
+    lock: Lock
+
+    def __init__(self) -> None:
+        self.enabled = False
+        self.stages = {}
+        self.lock = Lock()
+
+    def stage(self, name: str):
+        if not self.enabled:
+            return NULL_STAGE
+        return StageTimer(self, name)
+
+    def record(self, name: str, seconds: float) -> None:
+        with self.lock:
+            data = self.stages.get(name)
+            if data is None:
+                data = self.stages[name] = [0, 0.0, 0.0]
+            data[0] += 1
+            data[1] += seconds
+            if seconds > data[2]:
+                data[2] = seconds
+
+    def reset(self) -> None:
+        with self.lock:
+            self.stages = {}
+
+    def report(self) -> list[tuple[str, int, float, float]]:
+        """
+            返回 (阶段, 调用次数, 总用时, 最长用时) 的列表，按总用时从大到小排列
+        """
+        with self.lock:
+            res = [(k, v[0], v[1], v[2]) for k, v in self.stages.items()]
+        res.sort(key=lambda i: i[2], reverse=True)
+        return res
+
+
+profiler = StageProfiler()
+
+
+def stage(name: str):
+    """
+        记录一个阶段的用时
+    """
+    return profiler.stage(name)
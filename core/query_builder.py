@@ -0,0 +1,140 @@
+from functools import lru_cache
+from typing import Any
+
+
+class UnsupportedType(Exception):
+    type_: type
+
+    def __init__(self, type_: type, *args: object) -> None:
+        super().__init__(*args)
+        self.type_ = type_
+
+    def __str__(self) -> str:
+        return f'Type "{self.type_}" is not supported'
+
+
+# 可以作为绑定参数的类型
+BINDABLE_TYPES = (str, int, float, bytes, type(None))
+
+
+def check_bindable(value: Any) -> None:
+    """
+        断言值可以作为绑定参数，否则抛出 `UnsupportedType` 异常
+    """
+    if not isinstance(value, BINDABLE_TYPES):
+        raise UnsupportedType(value.__class__)
+
+
+@lru_cache(maxsize=256)
+def condition_sql(keys: tuple[str], clauses: tuple[str]) -> str:
+    """
+        由条件的结构（字段名与原始子句）生成Where子句。
+        结构相同的条件总是得到相同的SQL文本，值通过 `?` 绑定
+    """
+    items = [f"{k} == ?" for k in keys]
+    items.extend(clauses)
+    if len(items) == 0:
+        return ""
+    return "Where " + " and ".join(items) + " "
+
+
+def make_condition(*params, **kparams) -> tuple[str, tuple]:
+    """
+        生成Where子句，返回SQL与绑定参数。
+        `kparams` 中的值通过参数绑定传入；`params` 是原始的SQL子句，原样拼接
+        e.g:
+        ```
+            make_condition("ChapterCount > 100", Status=0)
+            # ("Where Status == ? and ChapterCount > 100 ", (0,))
+        ```
+    """
+    for v in kparams.values():
+        check_bindable(v)
+
+    return condition_sql(tuple(kparams.keys()), tuple(params)), tuple(kparams.values())
+
+
+@lru_cache(maxsize=256)
+def select_sql(table: str, columns: tuple[str], condition: str, order_by: tuple[str], has_limit: bool) -> str:
+    sql = f"Select {','.join(columns)} From {table} {condition}"
+    if len(order_by) > 0:
+        sql += f"Order By {','.join(order_by)} "
+    if has_limit:
+        sql += "Limit ? Offset ? "
+    return sql + ";"
+
+
+class Query:
+    """
+        Select语句构造器
+
+        生成的SQL只包含结构信息，所有的值都作为绑定参数传入，
+        因此结构相同的查询会得到相同的SQL文本，可以命中sqlite3的预编译语句缓存。
+        e.g:
+        ```
+            sql, params = Query("Books", "Id", "Title").where(Status=0).limit(10).build()
+            db.query(sql, params)
+        ```
+    """
+    table: str
+    columns: tuple[str]
+    clauses: tuple[str]
+    clause_params: tuple
+    conditions: dict[str, Any]
+    order: tuple[str]
+    limit_: int
+    offset_: int
+
+    def __init__(self, table: str, *columns: str) -> None:
+        self.table = table
+        self.columns = columns if len(columns) > 0 else ("*",)
+        self.clauses = ()
+        self.clause_params = ()
+        self.conditions = {}
+        self.order = ()
+        self.limit_ = None
+        self.offset_ = -1
+
+    def where(self, *clauses: str, **conditions) -> "Query":
+        """
+            添加条件，多次调用时条件之间为 `and` 关系
+        """
+        for v in conditions.values():
+            check_bindable(v)
+        self.clauses += clauses
+        self.conditions.update(conditions)
+        return self
+
+    def where_clause(self, clause: str, *params) -> "Query":
+        """
+            添加带有 `?` 占位符的子句，`params` 按顺序绑定
+        """
+        for v in params:
+            check_bindable(v)
+        self.clauses += (clause,)
+        self.clause_params += params
+        return self
+
+    def order_by(self, *columns: str) -> "Query":
+        self.order += columns
+        return self
+
+    def limit(self, limit: int = -1, offset: int = -1) -> "Query":
+        """
+            `limit` 为-1时不限制数量，SQLite会把负数的Offset当作0处理
+        """
+        self.limit_ = int(limit)
+        self.offset_ = int(offset)
+        return self
+
+    def build(self) -> tuple[str, tuple]:
+        condition = condition_sql(
+            tuple(self.conditions.keys()), self.clauses)
+        sql = select_sql(self.table, self.columns, condition,
+                         self.order, self.limit_ is not None)
+
+        params = tuple(self.conditions.values()) + self.clause_params
+        if self.limit_ is not None:
+            params += (self.limit_, self.offset_)
+        return sql, params
+
@@ -0,0 +1,445 @@
+"""
+    本地阅读服务
+
+    通过HTTP只读地提供书库中的内容，不经过爬虫使用的数据库连接:
+    ```
+        GET /books?after=<Id>&limit=<N>      书籍列表(按Id分页)
+        GET /books/<Id>                      书籍信息
+        GET /books/<Id>/chapters             目录
+        GET /books/<Id>/chapters/<ChapterId>         章节文本
+        GET /books/<Id>/chapters/<ChapterId>.html    渲染好的章节HTML
+        GET /books/<Id>/cover                封面
+    ```
+    读取使用只读连接池，常读的目录与章节保存在按大小淘汰的LRU缓存中。
+    缓存项记录书籍的版本(更新日期与章节数)，书籍更新后旧的缓存项不再使用；
+    书籍的版本在 `version_ttl` 秒内不会重复查询，因此命中缓存的请求不需要访问数据库。
+    响应带有ETag，客户端可以用 `If-None-Match` 得到304
+"""
+
+from collections import OrderedDict
+from contextlib import contextmanager
+from hashlib import sha1
+import html
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+from queue import Empty, LifoQueue
+from threading import Lock, Thread
+from time import monotonic
+from typing import Iterator, Union
+from urllib.parse import parse_qs, urlsplit
+
+from .database import BookNotExistError, ChapterNotExistError, Database
+from .logger import Loggable
+from .setting import SettingAccessable, SettingManager
+from .utils import db_to_date
+from . import metrics
+
+BOOK_LIST_COLUMNS = ("Id", "Title", "Author", "ChapterCount",
+                     "Status", "UpdateDate")
+MAX_PAGE_SIZE = 100
+
+
+class ConnectionPool:
+    """
+        只读数据库连接池，连接在第一次需要时创建，最多 `size` 个
+    """
+    db_file_path: str
+    size: int
+    created: int
+    idle: LifoQueue
+    lock: Lock
+    db_kparams: dict
+
+    def __init__(self, db_file_path: str, size: int = 8, **db_kparams) -> None:
+        self.db_file_path = db_file_path
+        self.size = size
+        self.created = 0
+        self.idle = LifoQueue()
+        self.lock = Lock()
+        self.db_kparams = db_kparams
+
+    @contextmanager
+    def connection(self) -> Iterator[Database]:
+        try:
+            db = self.idle.get_nowait()
+        except Empty:
+            create = False
+            with self.lock:
+                if self.created < self.size:
+                    self.created += 1
+                    create = True
+            if create:
+                try:
+                    db = Database(self.db_file_path,
+                                  read_only=True, quiet=True, **self.db_kparams)
+                except BaseException:
+                    with self.lock:
+                        self.created -= 1
+                    raise
+            else:
+                db = self.idle.get()
+
+        try:
+            yield db
+        finally:
+            self.idle.put(db)
+
+    def close(self) -> None:
+        while True:
+            try:
+                self.idle.get_nowait().close()
+            except Empty:
+                break
+
+
+class CacheEntry:
+    __slots__ = ("version", "body", "etag", "content_type")
+
+    def __init__(self, version: tuple, body: bytes, content_type: str) -> None:
+        self.version = version
+        self.body = body
+        self.etag = '"' + sha1(body).hexdigest()[:20] + '"'
+        self.content_type = content_type
+
+
+class LRUCache:
+    """
+        按大小淘汰的LRU缓存，缓存项的大小为响应体的字节数
+    """
+    max_bytes: int
+    size: int
+    entries: OrderedDict
+    lock: Lock
+
+    def __init__(self, max_bytes: int) -> None:
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.entries = OrderedDict()
+        self.lock = Lock()
+
+    def get(self, key) -> Union[CacheEntry, None]:
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+            return entry
+
+    def put(self, key, entry: CacheEntry) -> None:
+        size = len(entry.body)
+        if size > self.max_bytes:
+            return
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.size -= len(old.body)
+            self.entries[key] = entry
+            self.size += size
+            while self.size > self.max_bytes:
+                _, old = self.entries.popitem(last=False)
+                self.size -= len(old.body)
+
+    def clear(self) -> None:
+        with self.lock:
+            self.entries = OrderedDict()
+            self.size = 0
+
+
+class ReaderRequestError(Exception):
+    status: int
+    message: str
+
+    def __init__(self, status: int, message: str, *args: object) -> None:
+        self.status = status
+        self.message = message
+        super().__init__(status, message, *args)
+
+    def __str__(self) -> str:
+        return self.message
+
+
+def render_chapter_html(title: str, content: str) -> str:
+    title = html.escape(title or "")
+    paras = "\n".join(f"<p>{html.escape(i.strip())}</p>"
+                      for i in (content or "").split("\n") if i.strip())
+    return (f'<!DOCTYPE html>\n<html><head><meta charset="utf-8"><title>{title}</title></head>\n'
+            f"<body>\n<h1>{title}</h1>\n{paras}\n</body></html>\n")
+
+
+def to_json(data) -> bytes:
+    return json.dumps(data, ensure_ascii=False).encode("utf-8")
+
+
+class ReaderServer(Loggable, SettingAccessable):
+    """
+        只读的HTTP阅读服务
+        e.g:
+        ```
+            server = ReaderServer(setting_manager, "books.db", port=8080)
+            server.start()  # 在后台线程中运行，或 `server.serve_forever()`
+            server.stop()
+        ```
+    """
+    host: str
+    port: int
+    pool: ConnectionPool
+    cache: LRUCache
+    version_ttl: float
+    max_versions: int
+    versions: OrderedDict[int, tuple[tuple, float]]  # 书籍 -> (版本, 过期时间)
+    versions_lock: Lock
+    server: ThreadingHTTPServer
+    thread: Thread
+
+    def __init__(self, setting_manager: SettingManager, db_file_path: str, host: str = None, port: int = None) -> None:
+        SettingAccessable.__init__(self, setting_manager)
+        Loggable.__init__(self, "Reader")
+        self.host = host or self.get_setting("reader_host", "127.0.0.1")
+        self.port = int(port or self.get_setting("reader_port", 8080))
+        self.pool = ConnectionPool(
+            db_file_path, self.get_setting("reader_pool_size", 8),
+            cached_statements=self.get_setting("cached_statements", 256))
+        # 缓存大小(MB)
+        self.cache = LRUCache(
+            int(self.get_setting("reader_cache_size", 64) * 1024 * 1024))
+        self.version_ttl = self.get_setting("reader_version_ttl", 1.0)
+        # 最多记录多少本书的版本，超出时淘汰最久未使用的记录
+        self.max_versions = self.get_setting("reader_max_versions", 10000)
+        self.versions = OrderedDict()
+        self.versions_lock = Lock()
+        self.server = None
+        self.thread = None
+
+    def get_book_version(self, db: Database, book_index: int) -> tuple:
+        now = monotonic()
+        with self.versions_lock:
+            res = self.versions.get(book_index)
+            if res is not None and res[1] > now:
+                self.versions.move_to_end(book_index)
+                return res[0]
+        rows = db.query(
+            "Select UpdateDate,ChapterCount From Books Where Id==?;", (book_index,))
+        if len(rows) == 0:
+            raise BookNotExistError(Id=book_index)
+        version = tuple(rows[0])
+        with self.versions_lock:
+            self.versions[book_index] = (version, now + self.version_ttl)
+            self.versions.move_to_end(book_index)
+            while len(self.versions) > self.max_versions:
+                self.versions.popitem(last=False)
+        return version
+
+    def get_cached(self, book_index: int, key: tuple, build) -> CacheEntry:
+        """
+            从缓存中获取书籍的某项内容，缓存不存在或书籍版本变化时调用 `build(db)` 生成
+        """
+        with self.pool.connection() as db:
+            version = self.get_book_version(db, book_index)
+            entry = self.cache.get(key)
+            if entry is not None and entry.version == version:
+                metrics.reader_cache.inc(1, "hit")
+                return entry
+            metrics.reader_cache.inc(1, "miss")
+            body, content_type, cacheable = build(db)
+        entry = CacheEntry(version, body, content_type)
+        if cacheable:
+            self.cache.put(key, entry)
+        return entry
+
+    def book_list(self, query: dict) -> CacheEntry:
+        after = query.get("after")
+        limit = max(1, min(int(query.get("limit", 20)), MAX_PAGE_SIZE))
+        with self.pool.connection() as db:
+            rows, after = db.list_books(BOOK_LIST_COLUMNS, "Id",
+                                        None if after is None else (int(after),), limit)
+        books = [{
+            "id": i[0],
+            "title": i[1],
+            "author": i[2],
+            "chapter_count": i[3],
+            "status": bool(i[4]),
+            "update": db_to_date(i[5]).strftime("%Y-%m-%d")
+        } for i in rows]
+        return CacheEntry(None, to_json({"books": books, "after": None if after is None else after[0]}),
+                          "application/json; charset=utf-8")
+
+    def book_info(self, book_index: int) -> CacheEntry:
+        def build(db: Database):
+            books = db.query_book_info(Id=book_index)
+            if len(books) == 0:
+                raise BookNotExistError(Id=book_index)
+            book = books[0]
+            return to_json({
+                "id": book.idx,
+                "title": book.title,
+                "author": book.author,
+                "desc": book.desc,
+                "style": book.style,
+                "chapter_count": book.chapter_count,
+                "status": book.status,
+                "source": book.source,
+                "update": book.update.strftime("%Y-%m-%d"),
+                "publish": book.publish.strftime("%Y-%m-%d"),
+                "cover": f"/books/{book.idx}/cover" if book.cover_hash else None
+            }), "application/json; charset=utf-8", True
+        return self.get_cached(book_index, ("info", book_index), build)
+
+    def book_menu(self, book_index: int) -> CacheEntry:
+        def build(db: Database):
+            chapters = [{"id": i[0], "title": i[1], "length": i[2] or 0}
+                        for i in db.iter_chapter_infos(book_index)]
+            return to_json(chapters), "application/json; charset=utf-8", True
+        return self.get_cached(book_index, ("menu", book_index), build)
+
+    def chapter(self, book_index: int, chapter_index: int, as_html: bool) -> CacheEntry:
+        def build(db: Database):
+            rows = db.query(
+                f"Select Title,Content From {db.chapters_table(book_index)} Where BookId==? and ChapterId==?;",
+                (book_index, chapter_index))
+            if len(rows) == 0:
+                raise ChapterNotExistError(book_index, chapter_index)
+            title, content = rows[0]
+            # 还没有获取到内容的章节不缓存
+            cacheable = bool(content)
+            if as_html:
+                return render_chapter_html(title, content).encode("utf-8"), "text/html; charset=utf-8", cacheable
+            return f"{title}\n\n{content or ''}".encode("utf-8"), "text/plain; charset=utf-8", cacheable
+        return self.get_cached(book_index, ("html" if as_html else "text", book_index, chapter_index), build)
+
+    def cover(self, book_index: int) -> CacheEntry:
+        def build(db: Database):
+            rows = db.query(
+                "Select CoverHash,CoverFormat From Books Where Id==?;", (book_index,))
+            data = db.load_cover(rows[0][0]) if rows[0][0] else None
+            if data is None:
+                raise ReaderRequestError(404, "Cover not found")
+            fmt = (rows[0][1] or "").lstrip(".").lower()
+            content_type = "image/jpeg" if fmt in ("jpg", "jpeg") else f"image/{fmt or 'jpeg'}"
+            return data, content_type, True
+        return self.get_cached(book_index, ("cover", book_index), build)
+
+    def route(self, path: str) -> CacheEntry:
+        parsed = urlsplit(path)
+        parts = [i for i in parsed.path.split("/") if i]
+        query = {k: v[0] for k, v in parse_qs(parsed.query).items()}
+
+        if parts == ["books"]:
+            return self.book_list(query)
+        if len(parts) >= 2 and parts[0] == "books":
+            book_index = int(parts[1])
+            if len(parts) == 2:
+                return self.book_info(book_index)
+            if parts[2:] == ["chapters"]:
+                return self.book_menu(book_index)
+            if parts[2:] == ["cover"]:
+                return self.cover(book_index)
+            if len(parts) == 4 and parts[2] == "chapters":
+                name = parts[3]
+                as_html = name.endswith(".html")
+                if as_html:
+                    name = name[:-5]
+                return self.chapter(book_index, int(name), as_html)
+        raise ReaderRequestError(404, "Not found")
+
+    def make_handler(self) -> type:
+        reader = self
+
+        class ReaderHandler(BaseHTTPRequestHandler):
+            # 保持连接，减少每个请求建立连接的开销
+            protocol_version = "HTTP/1.1"
+            # 响应头与响应体合并为一次发送，避免保持连接时Nagle算法与延迟确认造成的等待
+            wbufsize = 64 * 1024
+            disable_nagle_algorithm = True
+
+            def do_GET(self):
+                self.handle_get(True)
+
+            def do_HEAD(self):
+                self.handle_get(False)
+
+            def handle_get(self, send_body: bool):
+                try:
+                    entry = reader.route(self.path)
+                except ReaderRequestError as e:
+                    return self.send_text(e.status, str(e), send_body)
+                except (BookNotExistError, ChapterNotExistError) as e:
+                    return self.send_text(404, str(e), send_body)
+                except ValueError:
+                    return self.send_text(400, "Bad request", send_body)
+                except Exception as e:
+                    reader.log_error(f"Serve '{self.path}' error:{e}")
+                    return self.send_text(500, "Internal server error", send_body)
+
+                if self.headers.get("If-None-Match") == entry.etag:
+                    metrics.reader_requests.inc(1, "304")
+                    self.send_response(304)
+                    self.send_header("ETag", entry.etag)
+                    self.end_headers()
+                    return
+
+                metrics.reader_requests.inc(1, "200")
+                self.send_response(200)
+                self.send_header("Content-Type", entry.content_type)
+                self.send_header("Content-Length", str(len(entry.body)))
+                self.send_header("ETag", entry.etag)
+                self.send_header("Cache-Control", "no-cache")
+                self.end_headers()
+                if send_body:
+                    self.wfile.write(entry.body)
+
+            def send_text(self, status: int, msg: str, send_body: bool):
+                metrics.reader_requests.inc(1, str(status))
+                body = msg.encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "text/plain; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                if send_body:
+                    self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                reader.log_debug(format % args)
+
+        return ReaderHandler
+
+    def create_server(self) -> None:
+        self.server = ThreadingHTTPServer(
+            (self.host, self.port), self.make_handler())
+        self.server.daemon_threads = True
+        self.log_info(
+            f"Reader serving '{self.pool.db_file_path}' on http://{self.host}:{self.port}/")
+
+    def serve_forever(self) -> None:
+        """
+            在当前线程中运行，直到 `stop` 或KeyboardInterrupt
+        """
+        if self.server is None:
+            self.create_server()
+        try:
+            self.server.serve_forever()
+        finally:
+            self.close()
+
+    def start(self) -> None:
+        """
+            在后台线程中运行
+        """
+        self.create_server()
+        self.thread = Thread(target=self.server.serve_forever,
+                             name="Reader", daemon=True)
+        self.thread.start()
+
+    def stop(self) -> None:
+        if self.server is None:
+            return
+        self.server.shutdown()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        self.close()
+
+    def close(self) -> None:
+        server, self.server = self.server, None
+        if server is not None:
+            server.server_close()
+        self.pool.close()
+        self.cache.clear()
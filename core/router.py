@@ -0,0 +1,104 @@
+import re
+from typing import Iterable
+
+
+def get_hostname(url: str) -> str:
+    """
+        取出Url中的hostname，Url可以不带协议( `convert_url` 的结果)
+    """
+    start = url.find("://")
+    start = 0 if start == -1 else start + 3
+    end = len(url)
+    for c in "/?#":
+        idx = url.find(c, start)
+        if idx != -1 and idx < end:
+            end = idx
+    host = url[start:end]
+    host = host[host.rfind("@") + 1:]
+    idx = host.rfind(":")
+    if idx != -1 and "]" not in host[idx:]:
+        host = host[:idx]
+    return host.lower()
+
+
+class UrlRouter:
+    """
+        根据Url选择Spider
+
+        Spider通过 `hosts` 声明可以爬取的hostname，以 `.` 开头表示该域名及其所有子域名，
+        通过 `url_patterns` 声明匹配完整Url的正则表达式。
+        hostname先在字典中精确查找，再在按域名倒序建立的后缀树中查找，最后尝试正则表达式。
+        e.g:
+        ```
+            router = UrlRouter()
+            router.add("BQGSpider", ["www.xbiquge.so"])
+            router.route("https://www.xbiquge.so/book/1/")  # ["BQGSpider"]
+        ```
+    """
+    hosts: dict[str, list[str]]
+    suffixes: dict  # 后缀树，键为域名的一级，`None` 键保存匹配的Spider
+    patterns: list[tuple[re.Pattern, str]]
+    fallback: list[str]  # 没有声明hostname与正则的Spider，需要调用 `check_url`
+    host_cache: dict[str, list[str]]
+
+    HOST_CACHE_SIZE = 65536
+
+    def __init__(self) -> None:
+        self.hosts = {}
+        self.suffixes = {}
+        self.patterns = []
+        self.fallback = []
+        self.host_cache = {}
+
+    def add(self, name: str, hosts: Iterable[str] = (), url_patterns: Iterable[str] = ()) -> None:
+        hosts = list(hosts)
+        url_patterns = list(url_patterns)
+        if len(hosts) == 0 and len(url_patterns) == 0:
+            self.fallback.append(name)
+            return
+
+        for host in hosts:
+            host = host.lower()
+            if host.startswith("."):
+                node = self.suffixes
+                for label in reversed(host[1:].split(".")):
+                    node = node.setdefault(label, {})
+                node.setdefault(None, []).append(name)
+            else:
+                self.hosts.setdefault(host, []).append(name)
+
+        for pattern in url_patterns:
+            self.patterns.append((re.compile(pattern), name))
+        self.host_cache = {}
+
+    def route_host(self, host: str) -> list[str]:
+        res = self.host_cache.get(host)
+        if res is not None:
+            return res
+
+        res = list(self.hosts.get(host, ()))
+        node = self.suffixes
+        for label in reversed(host.split(".")):
+            node = node.get(label)
+            if node is None:
+                break
+            for name in node.get(None, ()):
+                if name not in res:
+                    res.append(name)
+
+        if len(self.host_cache) >= UrlRouter.HOST_CACHE_SIZE:
+            self.host_cache = {}
+        self.host_cache[host] = res
+        return res
+
+    def route(self, url: str) -> list[str]:
+        """
+            返回可以爬取该Url的Spider，不包括需要调用 `check_url` 的Spider
+        """
+        res = self.route_host(get_hostname(url))
+        if len(self.patterns) > 0:
+            res = list(res)
+            for pattern, name in self.patterns:
+                if name not in res and pattern.match(url):
+                    res.append(name)
+        return res
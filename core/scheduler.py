@@ -0,0 +1,214 @@
+"""
+    按优先级调度网络请求
+
+    请求分为几个通道(lane)：交互请求(interactive)、更新检查(check)与整站爬取(bulk)。
+    并发数达到上限后，释放的名额按通道的权重加权公平地分配(stride scheduling)，
+    因此整站爬取排队了上千个章节时，单本书的请求仍然可以很快得到名额。
+    当前的通道保存在contextvar中，协程与由它创建的任务会继承调用者的通道。
+    调度器由Manager按Spider共享，同一站点的所有书籍(包括不同线程与事件循环中的请求)共用名额
+    e.g:
+    ```
+        with lane(LANE_BULK):
+            manager.get_all_book(spider)
+
+        async with scheduler.slot():
+            res = await session.get(url)
+    ```
+"""
+
+import asyncio
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from threading import Lock
+from time import perf_counter
+
+from . import metrics
+
+LANE_INTERACTIVE = "interactive"
+LANE_CHECK = "check"
+LANE_BULK = "bulk"
+
+DEFAULT_LANE_WEIGHTS = {
+    LANE_INTERACTIVE: 16,
+    LANE_CHECK: 4,
+    LANE_BULK: 1
+}
+
+# 为None表示调用者没有指定通道，此时使用 `LANE_INTERACTIVE`
+current_lane: ContextVar[str] = ContextVar("current_lane", default=None)
+
+
+def get_lane() -> str:
+    """
+        当前的通道
+    """
+    return current_lane.get() or LANE_INTERACTIVE
+
+
+@contextmanager
+def lane(name: str):
+    """
+        在该范围内发出的请求使用通道 `name`
+    """
+    token = current_lane.set(name)
+    try:
+        yield
+    finally:
+        current_lane.reset(token)
+
+
+@contextmanager
+def default_lane(name: str):
+    """
+        调用者没有指定通道时，在该范围内使用通道 `name` ，否则保持调用者的通道
+    """
+    if current_lane.get() is not None:
+        yield
+        return
+    with lane(name):
+        yield
+
+
+class SchedulerSlot:
+    __slots__ = ("scheduler", "lane")
+
+    def __init__(self, scheduler: "PriorityScheduler", lane: str) -> None:
+        self.scheduler = scheduler
+        self.lane = lane
+
+    async def __aenter__(self) -> None:
+        await self.scheduler.acquire(self.lane)
+
+    async def __aexit__(self, *args) -> None:
+        self.scheduler.release()
+
+
+class PriorityScheduler:
+    """
+        带优先级的信号量，最多同时有 `capacity` 个请求
+    """
+    capacity: int
+    active: int
+    weights: dict[str, float]
+    waiters: dict[str, deque]
+    passes: dict[str, float]  # 各通道已获得的服务量(按权重缩放)
+    virtual_time: float
+    lock: Lock
+
+    def __init__(self, capacity: int, weights: dict[str, float] = None) -> None:
+        self.capacity = capacity
+        self.lock = Lock()
+        self.active = 0
+        self.weights = {}
+        self.waiters = {}
+        self.passes = {}
+        self.virtual_time = 0.0
+        for name, weight in (weights or DEFAULT_LANE_WEIGHTS).items():
+            self.add_lane(name, weight)
+
+    def add_lane(self, name: str, weight: float) -> None:
+        self.weights[name] = weight
+        self.waiters.setdefault(name, deque())
+        self.passes.setdefault(name, self.virtual_time)
+
+    def set_capacity(self, capacity: int) -> None:
+        with self.lock:
+            self.capacity = capacity
+            self.wake()
+
+    def slot(self, lane: str = None) -> SchedulerSlot:
+        """
+            获取一个名额的异步上下文管理器，未指定通道时使用当前的通道
+        """
+        return SchedulerSlot(self, lane or get_lane())
+
+    def waiting(self) -> int:
+        return sum(len(i) for i in self.waiters.values())
+
+    def charge(self, lane: str) -> None:
+        # 空闲的通道不会积累额度，从当前的虚拟时间开始计算
+        start = max(self.passes[lane], self.virtual_time)
+        self.virtual_time = start
+        self.passes[lane] = start + 1 / self.weights[lane]
+
+    def pick(self) -> str:
+        """
+            选出下一个获得名额的通道，没有等待的请求时返回 `None`
+        """
+        res = None
+        res_pass = 0.0
+        for name, waiters in self.waiters.items():
+            if len(waiters) == 0:
+                continue
+            p = max(self.passes[name], self.virtual_time)
+            if res is None or p < res_pass or (p == res_pass and self.weights[name] > self.weights[res]):
+                res = name
+                res_pass = p
+        return res
+
+    async def acquire(self, lane: str) -> None:
+        with self.lock:
+            if lane not in self.weights:
+                self.add_lane(lane, 1)
+
+            if self.active < self.capacity and self.waiting() == 0:
+                self.active += 1
+                self.charge(lane)
+                return
+
+            future = asyncio.get_event_loop().create_future()
+            self.waiters[lane].append(future)
+
+        start = perf_counter()
+        try:
+            await future
+        except asyncio.CancelledError:
+            with self.lock:
+                if future.done() and not future.cancelled():
+                    # 已经分配了名额，但任务被取消
+                    self.active -= 1
+                    self.wake()
+                else:
+                    try:
+                        self.waiters[lane].remove(future)
+                    except ValueError:
+                        # 名额已经分配，由 `grant` 归还
+                        pass
+            raise
+        metrics.scheduler_wait_seconds.observe(perf_counter() - start, lane)
+
+    def release(self) -> None:
+        with self.lock:
+            self.active -= 1
+            self.wake()
+
+    def grant(self, future: asyncio.Future) -> None:
+        if future.done():
+            # 等待的任务在名额送达前被取消
+            self.release()
+        else:
+            future.set_result(None)
+
+    def wake(self) -> None:
+        # 调用时需要持有 `lock`
+        try:
+            running_loop = asyncio.get_running_loop()
+        except RuntimeError:
+            running_loop = None
+
+        while self.active < self.capacity:
+            lane = self.pick()
+            if lane is None:
+                return
+            future = self.waiters[lane].popleft()
+            if future.done():
+                continue
+            self.active += 1
+            self.charge(lane)
+            loop = future.get_loop()
+            if loop is running_loop:
+                future.set_result(None)
+            else:
+                # 等待者在其他线程的事件循环中
+                loop.call_soon_threadsafe(self.grant, future)
@@ -1,7 +1,12 @@
 from typing import Any, NoReturn, Union
+import atexit
 import json
+import os
 from os.path import exists
+import stat
 from io import open
+import tempfile
+from threading import RLock, Timer
 
 
 class FieldNotExistError(Exception):
@@ -15,35 +20,65 @@ class FieldNotExistError(Exception):
         return f'Field "{self.field}" does not exists'
 
 
+def get_file_mode(path: str) -> int:
+    """
+        获取文件的权限，文件不存在时返回新建文件的默认权限
+    """
+    try:
+        return stat.S_IMODE(os.stat(path).st_mode)
+    except FileNotFoundError:
+        umask = os.umask(0)
+        os.umask(umask)
+        return 0o666 & ~umask
+
+
 class SettingManager:
     """
         管理设定
         设定分 field,每个需要读取设定的对象都有自己的field.当本field的值更新时会通知对象
+
+        修改设定只会把设定标记为已修改，在 `flush_interval` 秒内的多次修改合并为一次写入，
+        `flush_interval` 为0时立即写入。也可以调用 `flush` 立即写入，程序退出时会自动写入。
+        写入时先写临时文件再替换，中途崩溃不会损坏配置文件。
+        修改与写入都持有 `lock` ，定时写入与手动写入不会以旧的内容覆盖新的内容
     """
     data: dict[str, dict[str, Any]]
     fields: dict[str]
     file_path: str
+    flush_interval: float
+    dirty: bool
+    lock: RLock
+    timer: Timer
 
-    def __init__(self, file_path) -> None:
+    def __init__(self, file_path, flush_interval: float = 1.0) -> None:
         self.data = {}
         self.fields = {}
         self.file_path = file_path
+        self.flush_interval = flush_interval
+        self.dirty = False
+        self.lock = RLock()
+        self.timer = None
         self.load()
+        atexit.register(self.flush)
 
     def add_field(self, field: str, obj) -> None:
-        if field not in self.data.keys():
-            self.data[field] = {}
-        self.fields[field] = obj
+        with self.lock:
+            if field not in self.data.keys():
+                self.data[field] = {}
+            self.fields[field] = obj
 
     def remove_field(self, field: str) -> None:
         self.check_field_exist(field)
-        del self.fields[field]
-        del self.data[field]
+        with self.lock:
+            del self.fields[field]
+            del self.data[field]
 
     def remove_key(self, field: str, key: str) -> None:
         self.check_field_exist(field)
-        if key in self.data[field]:
-            del self.data[field][key]
+        with self.lock:
+            if key in self.data[field]:
+                del self.data[field][key]
+                self.save()
 
     def get_field(self, field: str) -> dict[str, Any]:
         self.check_field_exist(field)
@@ -66,14 +101,22 @@ class SettingManager:
 
             `update`:若值更新，是否通知对象
         """
+        # 已存在的设定直接从内存返回
+        values = self.data.get(field)
+        if values is not None and key in values:
+            return values[key]
+
         self.check_field_exist(field)
-        if key not in self.data[field].keys():
+        with self.lock:
+            # 其他线程可能已经在这之间写入了这个设定
+            if key in self.data[field]:
+                return self.data[field][key]
             self.data[field][key] = value
-            if update:
-                self.fields[field].update_setting(key, value)
             self.save()
+        if update:
+            self.fields[field].update_setting(key, value)
 
-        return self.data[field][key]
+        return value
 
     def set(self, field: str, key: str, value: Any, update=True) -> Any:
         """
@@ -82,14 +125,52 @@ class SettingManager:
             `update`:若值更新，是否通知对象
         """
         self.check_field_exist(field)
-        self.data[field][key] = value
+        with self.lock:
+            self.data[field][key] = value
+            self.save()
         if update:
             self.fields[field].update_setting(key, value)
-        self.save()
 
     def save(self) -> None:
-        with open(self.file_path, "w") as f:
-            json.dump(self.data, f)
+        """
+            标记设定已修改，在 `flush_interval` 秒后写入文件
+        """
+        with self.lock:
+            self.dirty = True
+            if self.flush_interval <= 0:
+                self.flush()
+            elif self.timer is None:
+                self.timer = Timer(self.flush_interval, self.flush)
+                self.timer.daemon = True
+                self.timer.start()
+
+    def flush(self) -> None:
+        """
+            立即把修改过的设定写入文件
+        """
+        with self.lock:
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
+            if not self.dirty:
+                return
+            text = json.dumps(self.data)
+
+            directory = os.path.dirname(os.path.abspath(self.file_path))
+            fd, temp_path = tempfile.mkstemp(
+                prefix=os.path.basename(self.file_path), dir=directory)
+            try:
+                with os.fdopen(fd, "w") as f:
+                    f.write(text)
+                    f.flush()
+                    os.fsync(f.fileno())
+                # 临时文件的权限是0600，沿用原文件的权限
+                os.chmod(temp_path, get_file_mode(self.file_path))
+                os.replace(temp_path, self.file_path)
+            except BaseException:
+                os.remove(temp_path)
+                raise
+            self.dirty = False
 
     def load(self) -> None:
         if exists(self.file_path):
@@ -1,21 +1,27 @@
+from __future__ import annotations
 import re
 from time import sleep
 from typing import Any, Iterable, Union
-import requests
-from lxml import etree
 from datetime import date, datetime
 import mimetypes
-import urllib3.exceptions
-import chardet
-import aiohttp
-import aiohttp.client_exceptions
 import asyncio
+from time import perf_counter
 
-from .book import Book, Chapter
+from .book import Book, BookValidators, Chapter
 from .setting import SettingAccessable, SettingManager
 from .logger import Loggable
 from .exceptions import *
-from .utils import get_async_result
+from .router import get_hostname
+from .utils import LazyModule, get_async_result
+from .profiler import stage
+from .scheduler import DEFAULT_LANE_WEIGHTS, PriorityScheduler
+from . import metrics
+
+# 网络与解析相关的库导入较慢，在第一次使用时才导入
+requests = LazyModule("requests")
+etree = LazyModule("lxml.etree")
+chardet = LazyModule("chardet")
+aiohttp = LazyModule("aiohttp")
 
 
 class MaxRetriesError(Exception):
@@ -55,7 +61,11 @@ class Spider(SettingAccessable, Loggable):
     user_agent: str
     timeout: int
     max_retry: int
-    semaphore: asyncio.Semaphore
+    scheduler: PriorityScheduler
+
+    clean_patterns: list[str] = []  # 该站点章节中的广告、水印的正则表达式
+    hosts: list[str] = []  # 可以爬取的hostname，以 `.` 开头表示该域名及其所有子域名
+    url_patterns: list[str] = []  # 可以爬取的Url的正则表达式，没有声明hostname与正则时使用 `check_url`
 
     def __init__(self, setting_manager: SettingManager, field="", name="") -> None:
         if name == "":
@@ -68,7 +78,10 @@ class Spider(SettingAccessable, Loggable):
         self.session = None
         self.max_retry = self.get_setting("max_retry", 10)
         self.timeout = self.get_setting("timeout", 5)
-        self.semaphore = asyncio.Semaphore(self.get_setting("semaphore", 100))
+        # 并发请求数的上限为 `semaphore` ，名额按请求所在的通道加权分配。
+        # 由Manager创建时会替换为同类Spider共用的调度器
+        self.scheduler = PriorityScheduler(self.get_setting("semaphore", 100),
+                                           self.get_setting("lane_weights", DEFAULT_LANE_WEIGHTS))
 
     def create_session(self):
         """
@@ -93,31 +106,48 @@ class Spider(SettingAccessable, Loggable):
         if self.session.closed:
             self.session = self.create_session()
 
+        host = get_hostname(url)
         for _ in range(self.max_retry):
             try:
-                async with self.semaphore:
-                    if use_session:
-                        return await self.session.get(url=url, headers=headers,
-                                                      params=params)
-                    else:
-                        async with self.create_session() as session:
-                            return await session.get(url=url, headers=headers, params=params)
+                async with self.scheduler.slot():
+                    start = perf_counter()
+                    with stage("fetch"):
+                        if use_session:
+                            res = await self.session.get(url=url, headers=headers,
+                                                         params=params)
+                        else:
+                            async with self.create_session() as session:
+                                res = await session.get(url=url, headers=headers, params=params)
+                    metrics.request_seconds.observe(
+                        perf_counter() - start, host)
+                    metrics.http_requests.inc(1, host, "GET")
+                    return res
             except aiohttp.client_exceptions.ClientConnectionError as e:
+                metrics.retries.inc(1, host, "GET")
                 if e.args[0] == "Connection closed":
                     self.session = self.create_session()
                 continue
             except:
+                metrics.retries.inc(1, host, "GET")
                 continue
 
+        metrics.max_retries_errors.inc(1, "GET")
         raise MaxRetriesError("Get", url, params, headers)
 
     def __del__(self):
         self.close()
 
     def close(self):
-        if self.session:
+        if self.session and not self.session.closed:
             get_async_result(self.session.close())
 
+    async def async_close(self):
+        """
+            在事件循环中关闭session
+        """
+        if self.session and not self.session.closed:
+            await self.session.close()
+
     async def async_get_text(self, url, params: dict[str, str] = {}, headers: dict[str, str] = {}, encoding=None, **kparams) -> str:
         """
             获取网页内容并解码.
@@ -126,7 +156,12 @@ class Spider(SettingAccessable, Loggable):
         res = await self.async_get(url, headers, params, **kparams)
         for i in range(self.max_retry):
             try:
-                return await res.text()
+                # 与 `res.text()` 相同，先读取内容以便统计字节数
+                with stage("fetch"):
+                    content = await res.read()
+                metrics.response_bytes.inc(len(content), get_hostname(url))
+                with stage("decode"):
+                    return content.decode(res.get_encoding())
             except UnicodeDecodeError:
                 break
             except asyncio.exceptions.TimeoutError:
@@ -139,13 +174,32 @@ class Spider(SettingAccessable, Loggable):
 
         for i in range(self.max_retry):
             try:
-                content = await res.read()
+                with stage("fetch"):
+                    content = await res.read()
             except:
                 continue
             break
         else:
+            metrics.max_retries_errors.inc(1, "GET")
             raise MaxRetriesError("GetText", url, params, headers)
 
+        metrics.decode_fallbacks.inc(1, get_hostname(url))
+        with stage("decode"):
+            return Spider.decode_content(content, encoding, res.get_encoding())
+
+    @staticmethod
+    def parse_html(text: str):
+        """
+            使用 `etree.HTML` 解析网页
+        """
+        with stage("parse"):
+            return etree.HTML(text)
+
+    @staticmethod
+    def decode_content(content: bytes, encoding: str = None, response_encoding: str = None) -> str:
+        """
+            对编码进行猜测并解码，若所有猜测都失败,使用str(errors="replace")
+        """
         detect_encoding = chardet.detect(content)["encoding"]
         probably_charsets = [
             encoding, detect_encoding, "utf-8", "gbk", "gb2312"]
@@ -160,8 +214,8 @@ class Spider(SettingAccessable, Loggable):
 
         if detect_encoding:
             return str(content, encoding=detect_encoding, errors="replace")
-        elif res.get_encoding():
-            return str(content, encoding=res.get_encoding(), errors="replace")
+        elif response_encoding:
+            return str(content, encoding=response_encoding, errors="replace")
         else:
             return str(content, encoding='utf-8', errors="replace")
 
@@ -169,7 +223,29 @@ class Spider(SettingAccessable, Loggable):
         """
             使用self.get_text获取网页并用 `etree.HTML` 解析
         """
-        return etree.HTML(await self.async_get_text(url, params, headers, encoding, **kparams))
+        text = await self.async_get_text(url, params, headers, encoding, **kparams)
+        return Spider.parse_html(text)
+
+    async def async_conditional_get(self, url: str, validators: BookValidators, **kparams):
+        """
+            带 `If-None-Match` / `If-Modified-Since` 的Get请求，响应的状态为304时页面没有变化。
+            响应中新的验证信息会写入 `validators`
+        """
+        headers = {}
+        if validators.etag:
+            headers["If-None-Match"] = validators.etag
+        if validators.last_modified:
+            headers["If-Modified-Since"] = validators.last_modified
+        res = await self.async_get(url, {}, headers, **kparams)
+        if res.status == 304:
+            # 没有响应体，立即归还连接
+            res.release()
+        else:
+            validators.etag = res.headers.get("ETag")
+            validators.last_modified = res.headers.get("Last-Modified")
+        metrics.conditional_requests.inc(
+            1, "not_modified" if res.status == 304 else "modified")
+        return res
 
     async def async_get_image(self, url) -> tuple[bytes, str]:
         """
@@ -179,7 +255,8 @@ class Spider(SettingAccessable, Loggable):
         content: bytes = None
         for _ in range(self.max_retry):
             try:
-                content = await img.read()
+                with stage("fetch"):
+                    content = await img.read()
             except asyncio.exceptions.TimeoutError:
                 continue
             except aiohttp.client_exceptions.ClientConnectionError as e:
@@ -187,8 +264,10 @@ class Spider(SettingAccessable, Loggable):
                     img = await self.async_get(url)
                 continue
             else:
+                metrics.response_bytes.inc(len(content), get_hostname(url))
                 return content, mimetypes.guess_extension(img.headers["Content-Type"])
 
+        metrics.max_retries_errors.inc(1, "GET")
         raise MaxRetriesError("GetImage", url, None, None)
 
     async def async_post(self, url, params: dict = {}, headers: dict = {}, use_session=True, **kparams) -> requests.Response:
@@ -208,22 +287,32 @@ class Spider(SettingAccessable, Loggable):
         if self.session.closed:
             self.session = self.create_session()
 
+        host = get_hostname(url)
         for _ in range(self.max_retry):
             try:
-                async with self.semaphore:
-                    if use_session:
-                        return await self.session.post(url=url, headers=headers,
-                                                       params=params)
-                    else:
-                        async with self.create_session() as session:
-                            return await session.post(url=url, headers=headers, params=params)
+                async with self.scheduler.slot():
+                    start = perf_counter()
+                    with stage("fetch"):
+                        if use_session:
+                            res = await self.session.post(url=url, headers=headers,
+                                                          params=params)
+                        else:
+                            async with self.create_session() as session:
+                                res = await session.post(url=url, headers=headers, params=params)
+                    metrics.request_seconds.observe(
+                        perf_counter() - start, host)
+                    metrics.http_requests.inc(1, host, "POST")
+                    return res
             except aiohttp.ServerTimeoutError:
+                metrics.retries.inc(1, host, "POST")
                 continue
             except aiohttp.client_exceptions.ClientConnectionError as e:
+                metrics.retries.inc(1, host, "POST")
                 if e.args[0] == "Connection closed":
                     self.session = self.create_session()
                     continue
 
+        metrics.max_retries_errors.inc(1, "POST")
         raise MaxRetriesError("Post", url, params, headers)
 
     def get(self, url: str, params={}, headers: dict[str, str] = {}, **kparams):
@@ -236,44 +325,38 @@ class Spider(SettingAccessable, Loggable):
 
         params.update(kparams)
 
+        host = get_hostname(url)
         for _ in range(self.max_retry):
             try:
-                return requests.get(url=url, headers=headers, params=params, timeout=self.timeout)
+                start = perf_counter()
+                with stage("fetch"):
+                    res = requests.get(url=url, headers=headers,
+                                       params=params, timeout=self.timeout)
             except:
-                pass
+                metrics.retries.inc(1, host, "GET")
+            else:
+                metrics.request_seconds.observe(perf_counter() - start, host)
+                metrics.http_requests.inc(1, host, "GET")
+                return res
 
+        metrics.max_retries_errors.inc(1, "GET")
         raise MaxRetriesError("GET", url, params, headers)
 
     def get_text(self, url: str, params={}, headers: dict[str, str] = {}, encoding=None, **kparams) -> str:
         res = self.get(url, headers, params, **kparams)
 
-        try:
-            return res.text
-        except UnicodeDecodeError:
-            pass
-        content: bytes = res.content
-
-        detect_encoding = chardet.detect(content)["encoding"]
-        probably_charsets = [
-            encoding, detect_encoding, "utf-8", "gbk", "gb2312"]
-
-        for i in probably_charsets:
-            if i == None:
-                continue
+        with stage("decode"):
             try:
-                return content.decode(i)
+                return res.text
             except UnicodeDecodeError:
                 pass
 
-        if detect_encoding:
-            return str(content, encoding=detect_encoding, errors="replace")
-        elif res.encoding:
-            return str(content, encoding=res.encoding, errors="replace")
-        else:
-            return str(content, encoding='utf-8', errors="replace")
+            metrics.decode_fallbacks.inc(1, get_hostname(url))
+            return Spider.decode_content(res.content, encoding, res.encoding)
 
     def get_html(self, url: str, params={}, headers: dict[str, str] = {}, encoding=None, **kparams) -> etree._Element:
-        return etree.HTML(self.get_text(url, params, headers, encoding, **kparams))
+        text = self.get_text(url, params, headers, encoding, **kparams)
+        return Spider.parse_html(text)
 
     def get_image(self, url: str, params={}, headers: dict[str, str] = {}, **kparams) -> tuple[bytes, str]:
         res = self.get(url, params, headers).content
@@ -289,27 +372,36 @@ class Spider(SettingAccessable, Loggable):
 
         params.update(kparams)
 
+        host = get_hostname(url)
         for _ in range(self.max_retry):
             try:
-                return requests.post(url=url, headers=headers, data=params, timeout=self.timeout)
+                start = perf_counter()
+                with stage("fetch"):
+                    res = requests.post(url=url, headers=headers,
+                                        data=params, timeout=self.timeout)
             except:
-                pass
+                metrics.retries.inc(1, host, "POST")
+            else:
+                metrics.request_seconds.observe(perf_counter() - start, host)
+                metrics.http_requests.inc(1, host, "POST")
+                return res
 
+        metrics.max_retries_errors.inc(1, "POST")
         raise MaxRetriesError("POST", url, params, headers)
 
     @ staticmethod
     def get_ele_content(ele: etree._Element) -> str:
-        res = ""
+        res = []
         if ele.text:
-            res += ele.text
+            res.append(ele.text)
 
         for i in ele:
             if i.tag == "br":
-                res += '\n'
+                res.append('\n')
             if i.tail:
-                res += i.tail
+                res.append(i.tail)
 
-        return res
+        return "".join(res)
 
     @ staticmethod
     def match_date(s: str):
@@ -329,13 +421,22 @@ class Spider(SettingAccessable, Loggable):
         if key == "cookie":
             self.cookie = value
         if key == "semaphore":
-            self.semaphore = asyncio.Semaphore(value)
+            self.scheduler.set_capacity(value)
+        if key == "lane_weights":
+            for name, weight in value.items():
+                self.scheduler.add_lane(name, weight)
         if key == "max_retry":
             self.max_retry = value
         if key == "timeout":
             self.timeout = value
             self.session = self.create_session()
 
+    def get_clean_patterns(self) -> list[str]:
+        """
+            获取清理章节内容时使用的规则，包括类中定义的与设置中的 `clean_patterns`
+        """
+        return self.clean_patterns + self.get_setting("clean_patterns", [])
+
     def make_book(self, title="", author="", source="", desc="", style="", idx=-1, chapter_count=0, cover=None, cover_format=None, status=True, update=datetime(1970, 1, 1), publish=datetime(1970, 1, 1)):
         return Book(
             title, author, source, self.name, desc, style, idx, chapter_count, cover, cover_format, status, update, publish
@@ -344,18 +445,36 @@ class Spider(SettingAccessable, Loggable):
     @staticmethod
     def check_url(url: str, **params) -> bool:
         """
-            检查URL是否可以被该Spider爬取
+            检查URL是否可以被该Spider爬取。
+            声明了 `hosts` 或 `url_patterns` 的Spider由 `UrlRouter` 选择，不会调用此函数
         """
         raise NonimplentException(
             Spider,
             Spider.check_url
         )
 
+    async def probe_book(self, book: Book, validators: BookValidators, **params) -> tuple[Union[datetime, None], Any]:
+        """
+            轻量地检查书籍是否更新，在库中已有该书时先于 `get_book_info` 调用。
+            `book` 是库中保存的书籍信息，`validators` 是上次获取时保存的验证信息。
+            返回一个元组，第一项是书籍最新的更新日期，不晚于 `book.update` 时Manager会跳过这本书；
+            为 `None` 表示无法判断，Manager会调用 `get_book_info` 。
+            第二项是探测时已获取的数据(e.g: 解析后的书籍页面)，书籍需要更新时会以 `probe_data` 参数传给 `get_book_info` ，
+            避免重复请求同一个页面。
+            可以使用 `async_conditional_get` 发送条件请求，页面未变化(304)时直接返回 `book.update` 。
+            默认不探测
+        """
+        return None, None
+
     async def get_book_info(self, book: Book,  **params) -> tuple[Book, Any]:
         """
             获取书籍信息，返回一个元组。书籍的Url可以通过 `book.whole_url`获取。
             元组第一项是一个 `Book` ，表示书籍信息。
             第二项是一个任意类型，会被转发给 `get_book_menu`
+            `params` 中的 `validators` 是书籍的验证信息(`BookValidators`)，
+            封面Url与 `validators.cover_url` 相同时可以不下载封面(`book.cover` 保持为 `None`，Manager会沿用原来的封面)，
+            下载封面后应记录到 `validators.cover_url` 。
+            `params` 中的 `probe_data` 是 `probe_book` 返回的数据，没有探测时为 `None`
         """
         raise NonimplentException(
             self.__class__,
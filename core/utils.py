@@ -1,6 +1,32 @@
 from urllib.parse import urlparse
-from datetime import datetime
+from datetime import datetime, timedelta
+from functools import lru_cache
 import asyncio
+import importlib
+
+class LazyModule:
+    """
+        第一次访问属性时才导入的模块，用于推迟导入较慢的第三方库
+        e.g:
+        ```
+            etree = LazyModule("lxml.etree")
+            etree.HTML(text)  # 此时才导入lxml
+        ```
+    """
+    __slots__ = ("_name", "_module")
+
+    def __init__(self, name: str) -> None:
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr: str):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, attr)
+
+
+# 日期以距离该日期的天数保存在数据库中，同时也表示“未知日期”
+EPOCH = datetime(1970, 1, 1)
 
 
 def convert_url(url):
@@ -17,7 +43,14 @@ def convert_url(url):
     return url
 
 
+@lru_cache(maxsize=4096)
 def str_to_date(s):
+    # 常见格式先用 `fromisoformat` 解析，比 `strptime` 快得多
+    try:
+        return datetime.fromisoformat(s.replace('/', '-'))
+    except ValueError:
+        pass
+
     formats = ["%Y-%m-%d", "%Y/%m/%d",
                "%Y-%m-%d %H:%M:%S", "%Y/%m/%d %H:%M:%S"]
 
@@ -29,6 +62,32 @@ def str_to_date(s):
     raise ValueError(f"{s} is not a date!")
 
 
+def date_to_days(d: datetime) -> int:
+    """
+        日期转为距离 `EPOCH` 的天数，数据库保存日期时使用
+    """
+    return (d - EPOCH).days
+
+
+@lru_cache(maxsize=65536)
+def days_to_date(days: int) -> datetime:
+    return EPOCH + timedelta(days=days)
+
+
+def db_to_date(value) -> datetime:
+    """
+        解析数据库中的日期，兼容旧版本以字符串保存的日期。无法解析的日期视为 `EPOCH`
+    """
+    if isinstance(value, int):
+        return days_to_date(value)
+    if value is None or value == "0000-00-00":
+        return EPOCH
+    try:
+        return str_to_date(value)
+    except ValueError:
+        return EPOCH
+
+
 def get_async_result(future):
     loop = asyncio.get_event_loop()
     return loop.run_until_complete(future)
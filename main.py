@@ -1,13 +1,37 @@
 #!/usr/bin/python3
 
-from cli.cli import cli_main
+import argparse
+import shlex
+import sys
+
+from cli.cli import batch_main, cli_main, read_script
 from core.manager import Manager
 
 
+def parse_args(args):
+    parser = argparse.ArgumentParser(
+        description="Book Spider. Start the interactive shell when no command is given.")
+    parser.add_argument("-c", "--command", action="append", default=[],
+                        help="Run a command and exit, can be given multiple times")
+    parser.add_argument("-e", "--stop-on-error", action="store_true",
+                        help="Stop at the first failed command")
+    parser.add_argument("script", nargs="?",
+                        help="A file of commands to run, one per line")
+    return parser.parse_args(args)
+
+
 def main(*args) -> int:
+    options = parse_args(args)
+    commands_list = [shlex.split(i) for i in options.command]
+    if options.script:
+        commands_list.extend(read_script(options.script))
+
     mgr = Manager()
-    cli_main(mgr)
+    if len(commands_list) == 0 and not options.script:
+        cli_main(mgr)
+        return 0
+    return batch_main(mgr, [i for i in commands_list if len(i) > 0], options.stop_on_error)
 
 
 if __name__ == "__main__":
-    exit(main())
+    exit(main(*sys.argv[1:]))
@@ -1,14 +1,16 @@
 from core.spider import Spider
 from core.setting import SettingManager
-from core.book import Book, Chapter
-from typing import Any, Iterable
-from lxml.etree import Element
+from core.book import Book, BookValidators, Chapter
+from datetime import datetime
+from typing import Any, Iterable, Union
 from urllib.parse import urljoin
 from core.utils import convert_url
 
 
 class BQGSpider(Spider):
     name = "BQGSpider"
+    clean_patterns = [r"(?:https?://)?(?:www\.|m\.)?xbiquge\.so[^\s]*"]
+    hosts = ["www.xbiquge.so"]
 
     def __init__(self, setting_manager: SettingManager) -> None:
         super().__init__(setting_manager)
@@ -18,13 +20,35 @@ class BQGSpider(Spider):
         url = convert_url(url)
         return url.startswith('www.xbiquge.so')
 
-    async def get_book_info(self, book: Book, **params) -> tuple[Book, Any]:
-        html = await self.async_get_html(book.whole_url)
+    async def probe_book(self, book: Book, validators: BookValidators, **params) -> tuple[Union[datetime, None], Any]:
+        # 条件请求书籍页面，页面变化时只解析更新日期，不下载封面。解析后的页面交给 `get_book_info` 复用
+        res = await self.async_conditional_get(book.whole_url, validators)
+        if res.status == 304:
+            return book.update, None
+
+        content = await res.read()
+        try:
+            text = content.decode(res.get_encoding())
+        except UnicodeDecodeError:
+            text = Spider.decode_content(content, None, res.get_encoding())
+        html = Spider.parse_html(text)
+        return Spider.match_date(html.xpath(r'//*[@id="info"]/p[3]/text()')[0]), html
+
+    async def get_book_info(self, book: Book, validators: BookValidators = None, probe_data=None, **params) -> tuple[Book, Any]:
+        html = probe_data
+        if html is None:
+            html = await self.async_get_html(book.whole_url)
         book.title = html.xpath(r'//*[@id="info"]/h1/text()')[0]
         book.author = html.xpath(r'//*[@id="info"]/p[1]/a/text()')[0]
         book.desc = Spider.get_ele_content(html.xpath(r'//*[@id="intro"]')[0])
-        book.cover, book.cover_format = await self.async_get_image(
-            html.xpath(r'//*[@id="fmimg"]/img/@src')[0])
+
+        # 封面Url没有变化时不重新下载
+        cover_url = urljoin(book.whole_url + '/',
+                            html.xpath(r'//*[@id="fmimg"]/img/@src')[0])
+        if validators is None or validators.cover_url != cover_url:
+            book.cover, book.cover_format = await self.async_get_image(cover_url)
+            if validators is not None:
+                validators.cover_url = cover_url
         book.update = Spider.match_date(
             html.xpath(r'//*[@id="info"]/p[3]/text()')[0])
         book.status = html.xpath(r'//*[@id="fmimg"]/span/@class')[0] == 'a'
@@ -66,7 +90,7 @@ class BQGSpider(Spider):
         chapter.content = Spider.get_ele_content(content)
 
         if not silent:
-            self.log_info(f"Get chapter '{chapter.title}' successfully.")
+            self.log_debug(f"Get chapter '{chapter.title}' successfully.")
 
         return chapter
 